@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Compare the wall time and peak memory (RSS) of each available
+debugger when producing backtraces from the same core file.
+
+  python bench_analyzers.py [repeat] [exe core]
+
+Without exe and core, ./crasher is run to produce a core file.
+This requires core_pattern to be a plain file name (not a |pipe).
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import glob
+import resource
+import shutil
+import tempfile
+import subprocess as SP
+
+from ci_core_dumper.analyzers import ANALYZERS, find_analyzer
+from ci_core_dumper.capture import _now
+
+repeat = int(sys.argv[1] if len(sys.argv)>1 else 3)
+
+def make_core(tmpdir):
+    exe = os.path.abspath('crasher')
+    if not os.path.isfile(exe):
+        SP.check_call([sys.executable, 'build_crasher.py'])
+    with open('/proc/sys/kernel/core_pattern', 'r') as F:
+        if F.read().startswith('|'):
+            sys.exit('core_pattern is a pipe.  Uninstall, or give: exe core')
+
+    def unlimit():
+        resource.setrlimit(resource.RLIMIT_CORE, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+    SP.call([exe, 'crash'], cwd=tmpdir, preexec_fn=unlimit)
+
+    cores = glob.glob(os.path.join(tmpdir, 'core*'))
+    if len(cores)!=1:
+        sys.exit('Expected one core file in %s, found %s'%(tmpdir, cores))
+    return exe, cores[0]
+
+def run(cmd):
+    'Returns wall time, peak RSS in bytes, exit code, and output'
+    with tempfile.TemporaryFile() as out:
+        T0 = _now()
+        P = SP.Popen(cmd, stdin=open(os.devnull, 'r'), stdout=out, stderr=SP.STDOUT)
+        _pid, status, rusage = os.wait4(P.pid, 0)
+        T1 = _now()
+        P.returncode = 0 # already reaped
+        out.seek(0)
+        return T1-T0, rusage.ru_maxrss*1024, os.WEXITSTATUS(status), out.read()
+
+tmpdir = tempfile.mkdtemp()
+try:
+    if len(sys.argv)>3:
+        exe, core = sys.argv[2:4]
+    else:
+        exe, core = make_core(tmpdir)
+    print('Core %s of %s (%d MB)'%(core, exe, os.stat(core).st_size>>20))
+
+    print('%-10s %10s %10s %10s %8s'%('analyzer', 'min s', 'median s', 'peak MB', 'lines'))
+    for name in sorted(ANALYZERS):
+        analyzer = find_analyzer([name])
+        if analyzer is None:
+            print('Skip %s, not found'%name)
+            continue
+        cmd = analyzer.command(exe, core)
+        times, rss = [], 0
+        for _n in range(repeat):
+            T, M, code, out = run(cmd)
+            if code:
+                print('%s exits with %d'%(name, code))
+            times.append(T)
+            rss = max(rss, M)
+        times.sort()
+        print('%-10s %10.3f %10.3f %10.1f %8d'%(name, times[0], times[len(times)//2],
+              rss/2.0**20, out.count(b'\n')))
+finally:
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""Compare core capture throughput, with and without compression,
+on a large, mostly zero, synthetic core file fed through a pipe.
+
+  python bench_capture.py [size_MB] [density]
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import random
+import shutil
+import tempfile
+import subprocess as SP
+
+from ci_core_dumper.capture import capture, compressor, have_codec, CODECS, _now
+
+size = int(sys.argv[1] if len(sys.argv)>1 else 1024)<<20
+density = float(sys.argv[2] if len(sys.argv)>2 else 0.05) # fraction of non-zero pages
+
+tmpdir = tempfile.mkdtemp()
+try:
+    src = os.path.join(tmpdir, 'core.src')
+    print('Generating %d MB sparse core with %.1f%% data'%(size>>20, density*100))
+    rand = random.Random(42)
+    page = 4096
+    with open(src, 'wb') as F:
+        F.truncate(size)
+        for _n in range(int(size/page*density)):
+            F.seek(rand.randrange(size//page)*page)
+            F.write(os.urandom(page//2) + b'\x55'*(page//2))
+
+    cases = [('sparse', True, None), ('kernel', False, None)]
+    for codec in sorted(CODECS):
+        if have_codec(codec):
+            cases.append(('sparse+'+codec, True, codec))
+        else:
+            print('Skip %s, not available'%codec)
+
+    print('%-14s %10s %10s %12s %12s'%('case', 'seconds', 'MB/s', 'disk MB', 'kept MB'))
+    for name, sparse, codec in cases:
+        out = os.path.join(tmpdir, 'core.out')
+        kept = os.path.join(tmpdir, 'core.kept')
+        # feed through a pipe, as from the kernel
+        P = SP.Popen(['cat', src], stdout=SP.PIPE)
+        with open(out, 'wb') as OF, open(kept, 'wb') as KF:
+            tees = [compressor(codec, KF)] if codec else []
+            T0 = _now()
+            S = capture(P.stdout, OF, sparse=sparse, tees=tees)
+            T1 = _now()
+        P.wait()
+        assert S.nbytes==size, (S.nbytes, size)
+
+        print('%-14s %10.3f %10.1f %12.1f %12.1f'%(name, T1-T0, S.nbytes/(T1-T0)/2**20,
+              os.stat(out).st_blocks*512/2.0**20, os.stat(kept).st_size/2.0**20))
+        os.remove(out)
+        os.remove(kept)
+finally:
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Measure how long a crashing process waits for the core_pattern handler
+to start reading its core.  From exec of the handler (dumper.py)
+until the first byte is read from stdin.  Requires root, as the
+handler enters the namespaces of the "crashed" process.
+
+  python bench_startup.py [repeat]
+
+Compares the interpreter flags used by install with the defaults,
+and with, and without, byte compiled modules.
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import shutil
+import tempfile
+import time
+import subprocess as SP
+
+from ci_core_dumper.capture import _now
+from ci_core_dumper.linux import write_handler, precompile
+
+repeat = int(sys.argv[1] if len(sys.argv)>1 else 10)
+
+if os.geteuid()!=0:
+    sys.exit('Must be run as root')
+
+def first_read(cmd):
+    'Seconds from exec of cmd until it first reads stdin'
+    R, W = os.pipe()
+    # fill the pipe, so the next write blocks until the handler reads
+    os.set_blocking(W, False)
+    try:
+        while True:
+            os.write(W, b'\0'*4096)
+    except (BlockingIOError, IOError):
+        pass
+    os.set_blocking(W, True)
+
+    with open(os.devnull, 'w') as NULL:
+        T0 = _now()
+        P = SP.Popen(cmd, stdin=R, stdout=NULL, stderr=NULL)
+        os.close(R)
+        os.write(W, b'\0')
+        T1 = _now()
+        os.close(W) # not a valid core.  Handler continues with triage only
+        P.wait()
+    return T1-T0
+
+tmpdir = tempfile.mkdtemp()
+# stand in for the crashed process.  No debugger in its PATH
+target = SP.Popen([shutil.which('sleep'), '600'], env={'PATH':'/nonexistent'})
+try:
+    if not precompile():
+        print('Unable to byte compile.  Results with pyc will be compiled by the first run')
+
+    dumper = os.path.join(tmpdir, 'dumper.py')
+    write_handler(dumper, tmpdir, 'None', [''], {}, flags='')
+    nopyc = os.path.join(tmpdir, 'nopyc')
+    cases = [
+        ('default', []),
+        ('-SI', ['-S', '-I']),
+        ('-SI no pyc', ['-S', '-I', '-B', '-X', 'pycache_prefix='+nopyc]),
+    ]
+
+    print('%-12s %10s %10s %10s'%('handler', 'min ms', 'median ms', 'max ms'))
+    for name, flags in cases:
+        times = []
+        for _n in range(repeat):
+            now = int(time.time())
+            times.append(first_read([sys.executable]+flags+[dumper, str(target.pid), str(target.pid), str(now)]))
+            os.remove('/tmp/core.ccd.%d'%target.pid) # left by triage
+        times.sort()
+        print('%-12s %10.1f %10.1f %10.1f'%(name, times[0]*1e3, times[len(times)//2]*1e3, times[-1]*1e3))
+finally:
+    target.kill()
+    target.wait()
+    shutil.rmtree(tmpdir)
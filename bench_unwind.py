@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Compare the wall time of unwinding all threads of a core with many
+threads, by one GDB, and by N GDBs run in parallel on ranges of threads.
+(install --unwind-workers=N)
+
+  python bench_unwind.py [threads] [exe core]
+
+Without exe and core, "./crasher threads <threads>" (default 2000) is run
+to produce a core file.  This requires core_pattern to be a plain file name (not a |pipe).
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import glob
+import resource
+import shutil
+import tempfile
+import subprocess as SP
+
+from ci_core_dumper.analyzers import find_analyzer
+from ci_core_dumper.capture import _now
+from ci_core_dumper.elfcore import CoreParser
+from ci_core_dumper import stacks
+
+nthreads = int(sys.argv[1] if len(sys.argv)>1 else 2000)
+
+def make_core(tmpdir):
+    exe = os.path.abspath('crasher')
+    if not os.path.isfile(exe):
+        SP.check_call([sys.executable, 'build_crasher.py'])
+    with open('/proc/sys/kernel/core_pattern', 'r') as F:
+        if F.read().startswith('|'):
+            sys.exit('core_pattern is a pipe.  Uninstall, or give: exe core')
+
+    def unlimit():
+        resource.setrlimit(resource.RLIMIT_CORE, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+    SP.call([exe, 'threads', str(nthreads)], cwd=tmpdir, preexec_fn=unlimit)
+
+    cores = glob.glob(os.path.join(tmpdir, 'core*'))
+    if len(cores)!=1:
+        sys.exit('Expected one core file in %s, found %s'%(tmpdir, cores))
+    return exe, cores[0]
+
+def count_threads(core):
+    P = CoreParser()
+    with open(core, 'rb') as F:
+        for blk in iter(lambda: F.read(1<<20), b''):
+            P.write(blk)
+            if P.complete:
+                break
+    return len(P.threads)
+
+tmpdir = tempfile.mkdtemp()
+try:
+    if len(sys.argv)>3:
+        exe, core = sys.argv[2:4]
+    else:
+        exe, core = make_core(tmpdir)
+    N = count_threads(core)
+    print('Core %s of %s (%d MB, %d threads)'%(core, exe, os.stat(core).st_size>>20, N))
+
+    gdb = find_analyzer(['gdb'])
+    if gdb is None:
+        sys.exit('gdb not found')
+    limits = stacks.DEFAULT_LIMITS
+
+    print('%8s %8s %10s %10s %8s'%('workers', 'ranges', 'wall s', 'speedup', 'lines'))
+    base = None
+    for workers in (1, 2, 4, 8, 16):
+        ranges = stacks.thread_ranges(N, workers)
+        if len(ranges)<workers and workers>1:
+            print('Skip %d workers, at least %d threads each'%(workers, stacks.SHARD_MIN))
+            break
+        cmds = [gdb.command(exe, core, frames=limits['frames'] if n==0 else None, depth=limits['depth'],
+                            threads=R if len(ranges)>1 else None)
+                for n, R in enumerate(ranges)]
+        with tempfile.TemporaryFile(mode='w+') as out:
+            T0 = _now()
+            if len(cmds)==1:
+                F = stacks.run(cmds[0], out, timeout=limits['timeout'])
+            else:
+                F = stacks.run_sharded(cmds, out, timeout=limits['timeout'])
+            T = _now()-T0
+            out.seek(0)
+            lines = len(out.readlines())
+        if F.code:
+            print('gdb exits with %s'%F.code)
+        base = base or T
+        print('%8d %8d %10.3f %10.2f %8d'%(workers, len(ranges), T, base/T, lines))
+finally:
+    shutil.rmtree(tmpdir)
@@ -22,6 +22,7 @@ def build(exe, src):
     cc.spawn = partial(verbose_spawn, cc.spawn)
 
     objs = cc.compile([src], debug=debug)
-    cc.link_executable(objs, exe, debug=debug)
+    libs = [] if platform.system()=='Windows' else ['pthread'] # crasher threads
+    cc.link_executable(objs, exe, libraries=libs, debug=debug)
 
 build('crasher', 'crasher.c')
@@ -3,12 +3,15 @@ import sys
 import os
 import errno
 import logging
-import platform
-import tempfile
-import subprocess as SP
+
+# also imported by the Linux crash path.  Other imports are done where used.
 
 _log = logging.getLogger(__name__)
 
+def _system():
+    import platform
+    return platform.system()
+
 # our entry in sys.path
 _root_dir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
 
@@ -21,13 +24,41 @@ class CommonDumper(object):
 
     # sub-class hooks
     def install(self):
-        _log.warn('core file analysis not implemented for %s'%platform.system())
+        _log.warn('core file analysis not implemented for %s'%_system())
     def uninstall(self):
         pass
     def report(self):
-        _log.warn('core file analysis not implemented for %s'%platform.system())
+        _log.warn('core file analysis not implemented for %s'%_system())
+    def daemon(self):
+        _log.warn('analysis daemon not implemented for %s'%_system())
+    def reanalyze(self):
+        _log.warn('reanalyze not implemented for %s'%_system())
+
+    def aggregate(self):
+        import json
+        from . import aggregate as A
+        name = self.args.index or A.default_index()
+        index = A.load_index(name)
+        entries, errors = A.update(self.args.dirs, index, jobs=self.args.jobs or None, log=_log.info)
+        for msg in errors:
+            _log.error('Unable to parse %s', msg)
+        try:
+            A.save_index(name, index)
+        except (IOError, OSError):
+            _log.exception('Unable to save index %s', name)
+
+        T = A.tables(entries, top=self.args.top)
+        if self.args.format=='json':
+            json.dump(dict(logs=len(entries), errors=errors,
+                           tables=dict((K, [dict(zip(cols, row)) for row in rows]) for K, (cols, rows) in T.items())),
+                      sys.stdout, indent=1, sort_keys=True)
+            sys.stdout.write('\n')
+        else:
+            sys.stdout.write('%d logs\n'%len(entries))
+            A.print_tables(T)
 
     def doexec(self):
+        import subprocess as SP
         cmd = [self.findbin(self.args.command)] + self.args.args
         _log.debug('EXEC %s', cmd)
         sys.exit(SP.call(cmd))
@@ -75,7 +106,10 @@ class CommonDumper(object):
             sys.stdout.write('::endgroup::\n')
 
 def getargs():
+    import platform
+    import tempfile
     from argparse import ArgumentParser, REMAINDER
+    from .quota import parse_size
     P = ArgumentParser(description='CI core dump analyzer.'\
         +'  Run install prior to exec of suspect code.'\
         +'  Then report afterwards.'\
@@ -114,13 +148,156 @@ def getargs():
                      dest='cdb_cmds', default='',
                      help='Colon separated list of extra CDB commands')
 
+    CMD.add_argument("--analyzer", dest='analyzers', default='gdb,eu-stack,lldb',
+                     help='(Linux) Comma separated list of debuggers to try, in order of preference.'
+                          '  The first found in the PATH of the crashed process is used.'
+                          '  gdb, eu-stack, lldb')
+
+    CMD.add_argument("--core-copy", choices=('sparse', 'kernel'), default='sparse',
+                     help='(Linux) Skip over zero blocks leaving a sparse core file (default),'
+                          ' or copy in-kernel with splice()/sendfile()')
+
+    CMD.add_argument("--core-mode", choices=('full', 'stack'), default='full',
+                     help='(Linux) Write full core files, or reduced cores with only thread stacks,'
+                          ' notes, and file backed data')
+
+    CMD.add_argument("--core-staging", choices=('disk', 'memfd'), default='disk',
+                     help='(Linux) Write core files to a temporary directory in the target FS (default),'
+                          ' or to memory with memfd_create(), up to --memfd-max')
+
+    CMD.add_argument("--memfd-max", type=parse_size, default=1<<30, metavar='BYTES',
+                     help='(Linux) With --core-staging=memfd, larger cores are written to disk.  Default 1G')
+
+    CMD.add_argument("--keep-cores", choices=('none', 'gzip', 'lzma', 'zstd'), default='none',
+                     help='(Linux) Keep a compressed copy of each core file in outdir')
+
+    CMD.add_argument("--elf-index", choices=('none', 'scan', 'gdb-index'), default='none',
+                     help='(Linux) scan to index ELF files under the working directory, so GDB finds debug info'
+                          ' by build-id.  gdb-index also adds a .gdb_index to files without one.  Default none')
+
+    CMD.add_argument("--store-files", action='store_true',
+                     help='(Linux) Keep the executable and libraries of each crash in outdir/store, by build-id.'
+                          '  For reanalyze, with --keep-cores.')
+
+    CMD.add_argument("--daemon", action='store_true',
+                     help='(Linux) Start a persistent analysis daemon, and a minimal core_pattern client')
+
+    CMD.add_argument("--detach", action='store_true',
+                     help='(Linux) Let the crashed process exit once its core is captured.'
+                          '  Analysis continues in a detached child.')
+
+    CMD.add_argument("--defer-analysis", action='store_true',
+                     help='(Linux) Only capture cores, executables, and libraries.'
+                          '  Analysis is done by report, in parallel.')
+
+    CMD.add_argument("--max-analyses", type=int, default=0,
+                     help='(Linux) Number of concurrent debugger runs.  Default from CPU count and available memory')
+
+    CMD.add_argument("--core-pipe-limit", type=int, default=None,
+                     help='(Linux) Set /proc/sys/kernel/core_pipe_limit.  Max. concurrent core_pattern handlers.'
+                          '  Default unchanged')
+
+    CMD.add_argument("--rate-limit", type=int, default=0, metavar='N',
+                     help='(Linux) Analyze at most N crashes of the same executable (or signature) in each window.'
+                          '  Later crashes only record metadata.  Default 0, no limit')
+
+    CMD.add_argument("--rate-window", type=float, default=60, metavar='SECS',
+                     help='(Linux) With --rate-limit, N analyses are allowed per this many seconds')
+
+    CMD.add_argument("--rate-key", choices=('exe', 'signature'), default='exe',
+                     help='(Linux) Rate limit by executable, before the core is copied (default).'
+                          '  Or by signal and faulting PC, after the core is copied, but before analysis')
+
+    CMD.add_argument("--quota-size", type=parse_size, default=0, metavar='BYTES',
+                     help='(Linux) Total size of logs and kept cores in outdir, eg. 2G.'
+                          '  The least recently used crashes are removed to make space.  Default 0, no limit')
+
+    CMD.add_argument("--quota-files", type=int, default=0, metavar='N',
+                     help='(Linux) Number of files of all crashes in outdir.  Default 0, no limit')
+
+    CMD.add_argument("--min-free", type=parse_size, default=0, metavar='BYTES',
+                     help='(Linux) Free space to leave on the FS of outdir, and of temporary core files.'
+                          '  Any --quota-* or --min-free also removes temporary core files after analysis,'
+                          ' and captures a reduced core, or only metadata, when space is short')
+
+    CMD.add_argument("--unwind-workers", type=int, default=1, metavar='N',
+                     help='(Linux) Split the threads of a core with many threads between N GDBs run in parallel.'
+                          '  0 for CPU count.  Each takes an analysis slot, if free.  Default 1')
+
+    CMD.add_argument("--analysis-timeout", type=float, default=300,
+                     help='(Linux) Seconds before a debugger run is killed.  0 for no limit')
+
+    CMD.add_argument("--max-output", type=int, default=16,
+                     help='(Linux) MB of debugger output logged for each crash.  0 for no limit')
+
+    CMD.add_argument("--max-frames", type=int, default=256,
+                     help='(Linux) Backtrace depth of the faulting thread.  0 for no limit')
+
+    CMD.add_argument("--thread-frames", type=int, default=32,
+                     help='(Linux) Backtrace depth of other threads.  0 for no limit')
+
     CMD = SP.add_parser('uninstall')
     CMD.set_defaults(func=Dumper.uninstall)
 
+    CMD = SP.add_parser('daemon', help='Start analysis daemon.  (normally done by install --daemon)')
+    CMD.set_defaults(func=Dumper.daemon)
+
     CMD = SP.add_parser('report')
+    CMD.add_argument('--format', choices=('text', 'json'), default='text',
+                     help='(Linux) Print logs, or a single JSON document with all crash records')
+    CMD.add_argument('--all', action='store_true',
+                     help='(Linux) Print every log.  Default is one log for each stack signature')
+    CMD.add_argument('--signature-frames', type=int, default=5,
+                     help='(Linux) Frames of the faulting thread included in a stack signature')
+    CMD.add_argument('--merge-tree', action='store_true',
+                     help='(Linux) Print the stacks of all threads of crashes close in time, merged as a call tree')
+    CMD.add_argument('--window', type=float, default=60,
+                     help='(Linux) With --merge-tree, crashes within this many seconds are merged')
     CMD.set_defaults(func=Dumper.report)
 
+    CMD = SP.add_parser('reanalyze', help='(Linux) Run GDB again on cores kept with install --keep-cores --store-files')
+    CMD.add_argument('logs', nargs='*', metavar='LOG',
+                     help='Logs, or <time>.<pid>, to reanalyze.  Default all with a kept core')
+    CMD.add_argument('--gdb', dest='debugger')
+    CMD.add_argument("--gdb-commands",
+                     dest='gdb_cmds', default='',
+                     help='Colon separated list of extra GDB commands')
+    CMD.set_defaults(func=Dumper.reanalyze)
+
+    CMD = SP.add_parser('aggregate', help='Summarize logs from many outdirs, or tar files of them')
+    CMD.add_argument('dirs', nargs='+', metavar='DIR')
+    CMD.add_argument('--index', default=None,
+                     help='Cache of parsed logs.  Default $XDG_CACHE_HOME/ci-core-dumper/aggregate.json')
+    CMD.add_argument('-j', '--jobs', type=int, default=0,
+                     help='Number of parallel parsers.  Default CPU count')
+    CMD.add_argument('--format', choices=('text', 'json'), default='text')
+    CMD.add_argument('--top', type=int, default=20,
+                     help='Rows in each table')
+    CMD.set_defaults(func=Dumper.aggregate)
+
     CMD = SP.add_parser('exec')
+    CMD.add_argument('--profile', type=float, default=0, metavar='HZ',
+                     help='(Linux) Sample the stacks of the process tree HZ times each second,'
+                          ' and write <outdir>/<time>.<pid>.folded for flame graphs.  Default 0, disabled')
+    CMD.add_argument('--profile-mode', choices=('wchan', 'stack'), default='wchan',
+                     help='(Linux) Read thread state and kernel wait channel from /proc (default),'
+                          ' or attach a debugger to each process for user space stacks')
+    CMD.add_argument('--profile-analyzer', default='eu-stack,gdb,lldb',
+                     help='(Linux) With --profile-mode=stack, comma separated list of debuggers to try')
+    CMD.add_argument('--profile-overhead', type=float, default=5, metavar='PERCENT',
+                     help='(Linux) Sample less often to keep the time spent sampling below this'
+                          ' percent of elapsed time.  Default 5')
+    CMD.add_argument('--timeout', type=float, default=0, metavar='SECS',
+                     help='(Linux) When the command has not exited after SECS, write backtraces of each of its'
+                          ' processes to outdir, as for a crash, then kill them and exit with 124.  Default 0, no limit')
+    CMD.add_argument('--timeout-core', action='store_true',
+                     help='(Linux) With --timeout, also write <outdir>/<time>.<pid>.core of each process with gcore')
+    CMD.add_argument('--analyzer', dest='analyzers', default='gdb,eu-stack,lldb',
+                     help='(Linux) With --timeout, comma separated list of debuggers to try')
+    CMD.add_argument('--gdb', dest='debugger')
+    CMD.add_argument('--cgroup', action='store_true',
+                     help='(Linux) Run the command in a transient cgroup v2.  Write peak memory, CPU time, and IO'
+                          ' of its process tree to <outdir>/<time>.<pid>.exec.json, and record OOM kills for report')
     CMD.add_argument('command')
     CMD.add_argument('args', nargs=REMAINDER)
     CMD.set_defaults(func=Dumper.doexec)
@@ -0,0 +1,325 @@
+"""
+Summarize the logs in many output directories, eg. downloaded from
+every job of a CI build matrix.  Directories, and tar files of them,
+are searched for the <time>.<pid>.txt logs written by the Linux
+and Windows dump().  Where a Linux crash record (.json) is present,
+it is used instead of the log text.
+
+The result of parsing each file, or tar file, is kept in an index file
+along with its size and modification time.  So a later run only parses
+new, or changed, files.  Parsing is done in parallel.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import json
+import tarfile
+
+from . import buckets
+from .stacks import StackFilter
+
+# bump to invalidate index entries from an older parser
+VERSION = 3
+
+TAR_EXT = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.txz')
+
+# <time>.<pid>.txt
+_log_name = re.compile(r'^\d+\.\d+\.txt$')
+
+_linux_pid = re.compile(r'^Dumping PID (\d+) \((\d+)\) @ (\d+)')
+_linux_exe = re.compile(r'^EXE: (.*)$')
+_linux_sig = re.compile(r'^  Signal: (\d+) (\S+)')
+_linux_lwp = re.compile(r'^  Thread LWP (\d+) \(crashed\)')
+# GDB, when loading the core.  Older logs have no triage summary
+_gdb_sig = re.compile(r'^Program terminated with signal (\w+)')
+_gdb_current = re.compile(r'^\[Current thread is \d+ .*\(LWP (\d+)\)')
+_win_pid = re.compile(r'^PID: (\d+)')
+_win_exe = re.compile(r'^PROCESS_NAME:\s+(\S+)')
+_win_sig = re.compile(r'^(?:EXCEPTION_CODE_STR|ExceptionCode):\s+(\S+)')
+_win_thread = re.compile(r'^\s*([.#])?\s*\d+\s+Id: ')
+# 00 000000c9`1a2ff8d0 00007ff6`3e2d10a9     crasher!doCrash(void)+0x1e [c:\src\crasher.c @ 20]
+_win_frame = re.compile(r'^[0-9a-f]{2,} (?:[0-9a-f`]+\s+){2,}([^\s!]+)!?([^\s+(]*)(?:\(.*?\))?(?:\+0x[0-9a-f]+)?'
+                        r'(?: \[(.+) @ (\d+)\])?')
+
+class _Null(object):
+    def write(self, data):
+        pass
+
+def parse_linux(lines):
+    'Parse a log written by linux.dump(), also by older versions without a triage summary'
+    from .record import parse_frames
+
+    from .elfcore import signame
+
+    ret = dict(platform='Linux')
+    lwp = None
+    for line in lines:
+        M = _linux_pid.match(line)
+        if M:
+            ret['pid'], ret['time'] = int(M.group(2)), int(M.group(3))
+            continue
+        M = _linux_exe.match(line)
+        if M:
+            ret['exe'] = M.group(1)
+            continue
+        M = _linux_sig.match(line)
+        if M:
+            ret['signal'] = M.group(2)
+            continue
+        M = _linux_lwp.match(line)
+        if M:
+            lwp = int(M.group(1))
+            continue
+        M = _gdb_sig.match(line)
+        if M and 'signal' not in ret:
+            sig = M.group(1) # older GDB prints the number
+            ret['signal'] = signame(int(sig)) if sig.isdigit() else sig
+            continue
+        M = _gdb_current.match(line)
+        if M and lwp is None:
+            lwp = int(M.group(1))
+            continue
+        if line.startswith('Thread ') and lwp is not None:
+            break # backtraces
+
+    # faulting thread, from backtraces
+    S = StackFilter(_Null(), lwp=lwp)
+    for line in lines:
+        S.line(line)
+    S.flush()
+    stack = S.top
+    if not stack and S.threads:
+        stack = S.threads[0][1]
+        for T, lines in S.threads:
+            if T==lwp:
+                stack = lines
+    ret['frames'] = parse_frames(stack or [])
+    return ret
+
+def _join_args(lines):
+    'kP prints the arguments of a frame on the following lines.  Join them'
+    ret = []
+    for line in lines:
+        if ret and line.startswith('\t') and ret[-1].rstrip().endswith(('(', ',')):
+            ret[-1] = ret[-1].rstrip()+' '+line.strip()
+        else:
+            ret.append(line)
+    return ret
+
+def parse_windows(lines):
+    'Parse a log written by windows.dump()'
+    ret = dict(platform='Windows')
+    threads = [] # [(mark, [frame, ...])]
+    for line in _join_args(lines):
+        M = _win_pid.match(line)
+        if M:
+            ret['pid'] = int(M.group(1))
+            continue
+        M = _win_exe.match(line)
+        if M:
+            ret['exe'] = M.group(1)
+            continue
+        M = _win_sig.match(line)
+        if M:
+            ret.setdefault('signal', M.group(1))
+            continue
+        M = _win_thread.match(line)
+        if M:
+            threads.append((M.group(1), []))
+            continue
+        M = _win_frame.match(line)
+        if M and threads:
+            module, fn, file, lineno = M.groups()
+            F = dict(module=module, function=fn or None)
+            if file:
+                F['file'], F['line'] = file, int(lineno)
+            threads[-1][1].append(F)
+
+    # the thread which raised the exception is marked with '#', the current thread with '.'
+    ret['frames'] = []
+    for mark in ('#', '.', None):
+        for M, frames in threads:
+            if mark is None or M==mark:
+                ret['frames'] = frames
+                break
+        else:
+            continue
+        break
+    return ret
+
+def parse_log(name, data, record=None):
+    '''Summarize one log.  data is its content as bytes.
+       record is the content of its .json crash record, if any.
+    '''
+    base = os.path.basename(name)
+    if record is not None:
+        try:
+            rec = json.loads(record.decode('utf-8'))
+        except ValueError:
+            rec = None
+        if rec and rec.get('threads'):
+            sig, frames = buckets.signature(rec)
+            return dict(log=base, platform='Linux', time=rec.get('time'), pid=rec.get('pid'), exe=rec.get('exe'),
+                        signal=(rec.get('signal') or {}).get('name'), signature=sig, frames=frames[1:])
+
+    lines = data.decode('utf-8', 'replace').splitlines()
+    if any(_win_pid.match(L) for L in lines[:2]):
+        ret = parse_windows(lines)
+    else:
+        ret = parse_linux(lines)
+    if 'time' not in ret:
+        try:
+            # <time>.<pid>.txt
+            ret['time'] = int(float(base.rsplit('.', 2)[0]))
+        except ValueError:
+            pass
+    rec = dict(signal=dict(name=ret.get('signal')), threads=[dict(crashed=True, frames=ret.pop('frames'))])
+    ret['signature'], frames = buckets.signature(rec)
+    ret['frames'] = frames[1:]
+    ret['log'] = base
+    return ret
+
+def _read(path):
+    with open(path, 'rb') as F:
+        return F.read()
+
+def parse_file(path):
+    'Parse a log file, and its crash record if present'
+    record = None
+    if os.path.isfile(path[:-4]+'.json'):
+        record = _read(path[:-4]+'.json')
+    ret = parse_log(path, _read(path), record=record)
+    ret['dir'] = os.path.dirname(path)
+    return [ret]
+
+def parse_tar(path):
+    'Parse all logs in a tar file'
+    ret = []
+    with tarfile.open(path, 'r:*') as T:
+        members = dict((M.name, M) for M in T.getmembers() if M.isfile())
+        for name in sorted(members):
+            if not _log_name.match(os.path.basename(name)):
+                continue
+            record = None
+            if name[:-4]+'.json' in members:
+                record = T.extractfile(members[name[:-4]+'.json']).read()
+            E = parse_log(name, T.extractfile(members[name]).read(), record=record)
+            E['dir'] = '%s:%s'%(path, os.path.dirname(name))
+            ret.append(E)
+    return ret
+
+def parse(path):
+    'Called through a process pool'
+    try:
+        if path.endswith(TAR_EXT):
+            return path, parse_tar(path)
+        return path, parse_file(path)
+    except Exception as e:
+        return path, dict(error='%s: %r'%(path, e))
+
+def find(paths):
+    'Yield log files, <time>.<pid>.txt, and tar files.  Also any file named in paths'
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for dirpath, _dirnames, filenames in os.walk(path):
+            for name in filenames:
+                if _log_name.match(name) or name.endswith(TAR_EXT):
+                    yield os.path.join(dirpath, name)
+
+def default_index():
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'ci-core-dumper', 'aggregate.json')
+
+def load_index(name):
+    try:
+        with open(name, 'r') as F:
+            index = json.load(F)
+        if index.get('version')==VERSION:
+            return index
+    except (IOError, ValueError):
+        pass
+    return dict(version=VERSION, files={})
+
+def save_index(name, index):
+    dirname = os.path.dirname(name)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmp = name+'.tmp'
+    with open(tmp, 'w') as F:
+        json.dump(index, F)
+    os.rename(tmp, name) # atomic replace
+
+def update(paths, index, jobs=None, log=None):
+    '''Parse new or changed files found under paths.  Index entries of files
+       not found are removed.  Returns list of log summaries, and list of errors.
+    '''
+    # entries of files not found again are dropped, eg. deleted logs
+    old, files = index['files'], {}
+    index['files'] = files
+    entries, todo, errors = [], [], []
+    for path in find(paths):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime]
+        E = old.get(path)
+        if E is not None and E['stamp']==stamp:
+            files[path] = E
+            entries.extend(E['logs'])
+        else:
+            todo.append((path, stamp))
+
+    if log:
+        log('%d files indexed, %d to parse'%(len(entries), len(todo)))
+
+    stamps = dict(todo)
+    if len(todo)>1 and jobs!=1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = list(pool.imap_unordered(parse, sorted(stamps), chunksize=64))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [parse(path) for path in stamps]
+
+    for path, logs in results:
+        if isinstance(logs, dict):
+            errors.append(logs['error'])
+            continue
+        files[path] = dict(stamp=stamps[path], logs=logs)
+        entries.extend(logs)
+    return entries, errors
+
+def tables(entries, top=20):
+    '''Summary tables, as {name: (columns, [row, ...])}'''
+    ret = {}
+
+    def count(key):
+        C = {}
+        for E in entries:
+            C.setdefault(key(E), []).append(E)
+        return sorted(C.items(), key=lambda KV: (-len(KV[1]), '%s'%(KV[0],)))
+
+    ret['executable'] = (('count', 'signatures', 'executable'),
+                         [(len(V), len(set(E['signature'] for E in V)), K) for K, V in count(lambda E: E.get('exe'))[:top]])
+    ret['signal'] = (('count', 'executables', 'signal'),
+                     [(len(V), len(set(E.get('exe') for E in V)), K) for K, V in count(lambda E: E.get('signal'))[:top]])
+    ret['signature'] = (('count', 'dirs', 'signature', 'frames', 'example'),
+                        [(len(V), len(set(E['dir'] for E in V)), K, ' '.join(V[0]['frames']),
+                          os.path.join(V[0]['dir'], V[0]['log'])) for K, V in count(lambda E: E['signature'])[:top]])
+    return ret
+
+def print_tables(T, out=sys.stdout):
+    for name in ('executable', 'signal', 'signature'):
+        cols, rows = T[name]
+        out.write('\n# By %s\n'%name)
+        out.write('\t'.join(cols)+'\n')
+        for row in rows:
+            out.write('\t'.join('%s'%(C,) for C in row)+'\n')
@@ -0,0 +1,278 @@
+"""
+Debuggers which can produce backtraces from a core file.
+
+The first available from a preference list is used.
+Extra commands (--gdb-commands) are only passed to GDB.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+
+def find_executable(name, path=None):
+    'Search PATH, or path, for executable'
+    try:
+        from shutil import which # >= 3.3
+    except ImportError:
+        from distutils.spawn import find_executable as which # py2.  (slow, imports setuptools, on >= 3.10)
+    return which(name, path=path)
+
+class Analyzer(object):
+    name = None
+    exe = None # default executable name
+
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return '%s (%s)'%(self.name, self.path)
+
+    def command(self, exe, corefile, extra_cmds=(), sysroot=None, libdirs=(), frames=None, depth=None,
+                script=None, debugdirs=(), index_cache=False):
+        '''Return argument list to print backtraces of all threads.
+           sysroot and libdirs are used when exe and libraries are not
+           at their original paths.  (deferred analysis)
+           Where supported, the faulting thread is printed first with up to
+           'frames' frames, then all threads with up to 'depth' frames.
+           script is from write_script().
+           debugdirs are searched for separate debug info by build-id.
+           index_cache enables the debugger's per-user cache of symbol indexes.
+        '''
+        raise NotImplementedError()
+
+    def attach(self, pid, depth=None):
+        '''Return argument list to print backtraces of all threads of running process pid,
+           which is stopped only while attached.
+        '''
+        raise NotImplementedError()
+
+    def write_script(self, path, out, frames=None, depth=None):
+        '''Write a script to path which saves the frames of all threads to file out as JSON.
+           Returns False if not supported.
+        '''
+        return False
+
+# Run by GDB, with either python 2 or 3, after printing backtraces.
+# Saves {"threads":[{"num":1, "lwp":123, "name":"", "frames":[{"pc":0, "function":"", ...}]}]}
+gdb_script = '''
+import json
+import gdb
+
+def ccd_module(pc):
+    name = gdb.solib_name(pc) or gdb.current_progspace().filename
+    for objfile in gdb.objfiles():
+        if objfile.filename==name:
+            return name, getattr(objfile, 'build_id', None) # gdb >= 7.11
+    return name, None
+
+def ccd_frames(limit):
+    ret = []
+    try:
+        frame = gdb.newest_frame()
+        while frame is not None and (not limit or len(ret) < limit):
+            pc = frame.pc()
+            F = dict(pc=pc, function=frame.name())
+            sal = frame.find_sal()
+            if sal.symtab is not None:
+                F['file'], F['line'] = sal.symtab.filename, sal.line
+            F['module'], F['build_id'] = ccd_module(pc)
+            if frame.type()==gdb.INLINE_FRAME:
+                F['inline'] = True
+            ret.append(F)
+            frame = frame.older()
+    except gdb.error as e:
+        ret.append(dict(error=str(e)))
+    return ret
+
+def ccd_main():
+    threads = []
+    selected = gdb.selected_thread()
+    for thread in sorted(gdb.selected_inferior().threads(), key=lambda T: T.num):
+        if %(threads)s and not (%(threads)s[0] <= thread.num <= %(threads)s[1]):
+            continue
+        thread.switch()
+        threads.append(dict(num=thread.num, lwp=thread.ptid[1], name=thread.name,
+                            frames=ccd_frames(%(frames)s if thread==selected else %(depth)s)))
+    if selected is not None:
+        selected.switch()
+    with open(%(out)s, 'w') as F:
+        json.dump(dict(threads=threads), F)
+
+ccd_main()
+'''
+
+# Run by GDB, with either python 2 or 3, to analyze many cores of one executable in turn.
+# Symbols are loaded once.  The output for each core follows a line "<mark> <name>".
+gdb_batch = '''
+import gdb
+
+for ccd_name, ccd_cmds in %(cores)s:
+    gdb.write('\\n%%s %%s\\n'%%(%(mark)s, ccd_name))
+    for ccd_cmd in ccd_cmds:
+        try:
+            gdb.execute(ccd_cmd)
+        except gdb.error as e:
+            gdb.write('%%s\\n'%%e)
+    gdb.flush()
+'''
+
+class GDB(Analyzer):
+    name = exe = 'gdb'
+    batch_mark = '#ccd-core'
+
+    def write_script(self, path, out, frames=None, depth=None, threads=None):
+        'threads is an optional (first, last) range of GDB thread numbers'
+        with open(path, 'w') as F:
+            F.write(gdb_script%dict(out=json.dumps(out), frames=frames or 0, depth=depth or 0,
+                                    threads=list(threads) if threads else None))
+        return True
+
+    def _options(self, sysroot=None, libdirs=(), debugdirs=(), index_cache=False):
+        cmd = [
+            self.path,
+            '--nx', '--nw', '--batch', # no .gitinit, no UI, no interactive
+        ]
+        # before loading exe and core
+        if sysroot:
+            cmd += ['-iex', 'set sysroot '+sysroot]
+        if libdirs:
+            cmd += ['-iex', 'set solib-search-path '+':'.join(libdirs)]
+        if debugdirs:
+            cmd += ['-iex', 'set debug-file-directory '+':'.join(debugdirs)]
+        if index_cache:
+            cmd += ['-iex', 'set index-cache enabled on'] # gdb >= 12
+        cmd += ['-ex', 'set pagination 0']
+        return cmd
+
+    def _backtraces(self, extra_cmds=(), frames=None, depth=None, threads=None):
+        cmds = []
+        if frames:
+            cmds.append('bt %d'%frames) # faulting thread is selected
+        which = '%d-%d'%tuple(threads) if threads else 'all'
+        cmds.append('thread apply %s bt %d'%(which, depth) if depth else 'thread apply %s bt'%which)
+        cmds.extend(extra_cmds)
+        return cmds
+
+    def command(self, exe, corefile, extra_cmds=(), sysroot=None, libdirs=(), frames=None, depth=None,
+                script=None, debugdirs=(), index_cache=False, threads=None):
+        '''threads is an optional (first, last) range of GDB thread numbers to print.
+           With stacks.run_sharded(), ranges are printed by debuggers running in parallel.
+        '''
+        cmd = self._options(sysroot=sysroot, libdirs=libdirs, debugdirs=debugdirs, index_cache=index_cache)
+        for C in self._backtraces(extra_cmds, frames=frames, depth=depth, threads=threads):
+            cmd += ['-ex', C]
+        if script:
+            cmd += ['-x', script]
+        cmd += [
+            exe, corefile
+        ]
+        return cmd
+
+    def attach(self, pid, depth=None):
+        cmd = self._options()
+        for C in self._backtraces(depth=depth):
+            cmd += ['-ex', C]
+        return cmd + ['-p', str(pid)]
+
+    def batch(self, path, exe, cores, extra_cmds=(), sysroot=None, libdirs=(), frames=None, depth=None,
+              debugdirs=(), index_cache=False):
+        '''Write a script to path which analyzes each core in turn, switching with core-file.
+           cores is a list of (name, corefile, script).  All must be of exe, with the same libraries.
+           Returns argument list.  Output is split with stacks.run_batch(), by batch_mark.
+        '''
+        extra_cmds = [C for C in extra_cmds if C] # an empty command would repeat the last
+        todo = []
+        for name, corefile, script in cores:
+            cmds = ['core-file '+corefile] + self._backtraces(extra_cmds, frames=frames, depth=depth)
+            if script:
+                cmds.append('source '+script)
+            todo.append([name, cmds])
+        with open(path, 'w') as F:
+            F.write(gdb_batch%dict(cores=json.dumps(todo), mark=json.dumps(self.batch_mark)))
+        cmd = self._options(sysroot=sysroot, libdirs=libdirs, debugdirs=debugdirs, index_cache=index_cache)
+        cmd += ['-x', path, exe]
+        return cmd
+
+class EUStack(Analyzer):
+    'From elfutils.  Unwinds with less overhead than GDB, but no variables'
+    name = exe = 'eu-stack'
+
+    def command(self, exe, corefile, extra_cmds=(), sysroot=None, libdirs=(), frames=None, depth=None,
+                script=None, debugdirs=(), index_cache=False):
+        cmd = [
+            self.path,
+            '-i', # show inlined frames
+            '-m', # module names
+            '-s', # source file:line
+            '--executable='+exe,
+            '--core='+corefile,
+        ]
+        if frames or depth:
+            cmd.append('-n%d'%max(frames or 0, depth or 0))
+        if sysroot:
+            cmd.append('--sysroot='+sysroot) # elfutils >= 0.191
+        if debugdirs:
+            cmd.append('--debuginfo-path='+':'.join(debugdirs))
+        return cmd
+
+    def attach(self, pid, depth=None):
+        cmd = [self.path, '-i', '-p', str(pid)]
+        if depth:
+            cmd.append('-n%d'%depth)
+        return cmd
+
+class LLDB(Analyzer):
+    name = exe = 'lldb'
+    # thread headers with the LWP, 'thread #2: tid = 123, ...', so that backtraces are matched
+    # to the threads of the core.  The defaults for backtraces omit it.
+    _formats = ['settings set %s "thread #${thread.index}: tid = ${thread.id%%tid}'
+                '{, name = \'${thread.name}\'}{, stop reason = ${thread.stop-reason}}\\n"'%S
+                for S in ('thread-format', 'thread-stop-format')]
+
+    def command(self, exe, corefile, extra_cmds=(), sysroot=None, libdirs=(), frames=None, depth=None,
+                script=None, debugdirs=(), index_cache=False):
+        cmd = [
+            self.path,
+            '--no-lldbinit', '--batch',
+        ]
+        for S in self._formats:
+            cmd += ['-O', S]
+        if libdirs:
+            cmd += ['-O', 'settings set target.exec-search-paths '+' '.join(libdirs)]
+        if debugdirs:
+            cmd += ['-O', 'settings set target.debug-file-search-paths '+' '.join(debugdirs)]
+        cmd += [
+            '--core', corefile,
+        ]
+        if frames:
+            cmd += ['-o', 'thread backtrace -c %d'%frames] # faulting thread is selected
+        cmd += [
+            '-o', 'thread backtrace all -c %d'%depth if depth else 'thread backtrace all',
+            exe,
+        ]
+        return cmd
+
+    def attach(self, pid, depth=None):
+        cmd = [self.path, '--no-lldbinit', '--batch']
+        for S in self._formats:
+            cmd += ['-O', S]
+        return cmd + ['-p', str(pid), '-o', 'thread backtrace all -c %d'%depth if depth else 'thread backtrace all']
+
+ANALYZERS = dict((A.name, A) for A in (GDB, EUStack, LLDB))
+DEFAULT = 'gdb,eu-stack,lldb'
+
+def find_analyzer(prefs, path=None, gdb=None):
+    '''Return the first Analyzer available from list of names in prefs,
+       or None.  gdb is the name, or path, of the GDB executable to try first.
+    '''
+    for name in prefs:
+        A = ANALYZERS.get(name)
+        if A is None:
+            continue # unknown, eg. from an older crash record
+        cands = [A.exe]
+        if A is GDB and gdb and gdb!='None':
+            cands.insert(0, gdb)
+        for cand in cands:
+            found = find_executable(cand, path=path)
+            if found:
+                return A(found)
+    return None
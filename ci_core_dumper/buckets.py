@@ -0,0 +1,115 @@
+"""
+Group crashes with the same stack signature into buckets.
+
+The signature of a crash is a hash of its signal, and the top frames
+of the faulting thread, with addresses, arguments, inlined frames,
+and the frames of abort()/raise() and similar removed.
+
+An append-only index of signatures, one JSON object per line, is kept
+in outdir so that occurrences are counted across runs.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import re
+import json
+import hashlib
+
+from .record import DEFERRED, RUNNING
+
+INDEX = 'buckets.jsonl'
+
+# Frames of the faulting thread to include in a signature
+DEPTH = 5
+
+# Frames between the fault and the code which is (probably) at fault
+NOISE = frozenset('''
+    raise abort gsignal pthread_kill __pthread_kill __pthread_kill_implementation __pthread_kill_internal
+    __libc_message __fortify_fail __chk_fail __stack_chk_fail __assert_fail __assert_fail_base
+    __assert_perror_fail malloc_printerr __restore_rt __libc_start_main __libc_start_call_main _start
+    std::terminate __cxa_throw __cxa_rethrow __gnu_cxx::__verbose_terminate_handler
+'''.split())
+
+_suffix = re.compile(r'(\.(?:isra|constprop|part|cold|lto_priv|localalias)(?:\.\d+)?)+$')
+_args = re.compile(r'\(.*\)$')
+
+def frame_name(frame):
+    'Function name without arguments or compiler suffixes.  Or the module if unknown'
+    fn = frame.get('function')
+    if fn:
+        fn = _suffix.sub('', _args.sub('', fn))
+        if fn.startswith('__GI_'):
+            fn = fn[5:]
+        return fn
+    module = frame.get('module')
+    return '?? '+os.path.basename(module) if module else '??'
+
+def normalize(frame):
+    'Name for one frame, or None to omit'
+    if frame.get('inline') or 'error' in frame:
+        return None
+    name = frame_name(frame)
+    return None if name in NOISE else name
+
+def signature(rec, depth=DEPTH):
+    '''Returns (signature, [frame names]) of crash record.
+       Falls back to the module+offset of the faulting PC when there are no frames.
+    '''
+    frames = []
+    sig = (rec.get('signal') or {}).get('name') or '?'
+    for T in rec.get('threads') or []:
+        if not T.get('crashed'):
+            continue
+        for F in T.get('frames') or []:
+            name = normalize(F)
+            if name is not None:
+                frames.append(name)
+            if len(frames)>=depth:
+                break
+        if not frames and T.get('module'):
+            # triage only
+            frames.append(os.path.basename(T['module']))
+        break
+    H = hashlib.sha1('\n'.join([sig]+frames).encode('utf-8'))
+    return H.hexdigest()[:16], [sig]+frames
+
+class Index(object):
+    'Append-only index of signatures in outdir'
+    def __init__(self, outdir):
+        self.path = os.path.join(outdir, INDEX)
+
+    def update(self, records, depth=DEPTH):
+        '''Add records not already in the index, and return
+           {signature: [entry, ...]} for all entries ever indexed.
+           Also sets 'signature' of each record.  Records without threads,
+           or not yet analyzed, are skipped.
+           The index is only created when there is something to record.
+        '''
+        import fcntl # not Windows.  aggregate only needs signature()
+        buckets, known = {}, set()
+        # signature may change
+        records = [rec for rec in records if rec.get('threads') and rec.get('status') not in (DEFERRED, RUNNING)]
+        if not records and not os.path.isfile(self.path):
+            return buckets # eg. outdir does not exist
+        with open(self.path, 'a+') as F:
+            fcntl.flock(F.fileno(), fcntl.LOCK_EX)
+            F.seek(0)
+            for line in F:
+                try:
+                    E = json.loads(line)
+                except ValueError:
+                    continue # partial line?
+                buckets.setdefault(E['signature'], []).append(E)
+                known.add((E['signature'], E['log'], E['time']))
+
+            for rec in records:
+                rec['signature'], frames = signature(rec, depth=depth)
+                if (rec['signature'], rec.get('log'), rec.get('time')) in known:
+                    continue
+                E = dict(signature=rec['signature'], frames=frames, log=rec.get('log'),
+                         time=rec.get('time'), exe=rec.get('exe'))
+                buckets.setdefault(E['signature'], []).append(E)
+                F.write(json.dumps(E, sort_keys=True)+'\n')
+            F.flush()
+            fcntl.flock(F.fileno(), fcntl.LOCK_UN)
+        return buckets
@@ -0,0 +1,264 @@
+"""
+Copy a core file out of the kernel pipe and into storage.
+
+Cores of processes with large, mostly untouched, mappings are mostly zeros.
+By default blocks of zeros are not written, but skipped over with lseek()
+to leave holes in a sparse file.  Alternately, when sparse output is not
+wanted, the copy is done in-kernel with splice() or sendfile() when available.
+
+The core may also be passed, as it is read from the pipe, to other
+consumers (tees), eg. to write a compressed copy.  A tee which only needs
+the beginning of the core (eg. the notes) has a 'satisfied' attribute,
+which becomes True when it has seen enough.  The in-kernel copy
+then takes over.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import print_function
+
+import io
+import os
+import time
+
+_now = getattr(time, 'monotonic', time.time) # py >= 3.3
+
+# Size of reads from the kernel pipe
+BLOCK_SIZE = 1<<20
+# Granularity of zero detection.  Some multiple of the FS block size.
+HOLE_SIZE = 1<<16
+
+# codec name -> file extension
+CODECS = {
+    'gzip':'.gz',
+    'lzma':'.xz',
+    'zstd':'.zst',
+}
+
+def compressor(codec, F):
+    'Wrap writable binary file F with a compressing file-like'
+    if codec=='gzip':
+        import gzip
+        # favor speed.  The crashing process is waiting on us.
+        return gzip.GzipFile(fileobj=F, mode='wb', compresslevel=1)
+    elif codec=='lzma':
+        import lzma # py >= 3.3
+        return lzma.LZMAFile(F, 'wb', preset=0)
+    elif codec=='zstd':
+        try:
+            from compression import zstd # py >= 3.14
+            return zstd.ZstdFile(F, 'wb', level=3)
+        except ImportError:
+            import zstandard
+            return zstandard.ZstdCompressor(level=3).stream_writer(F, closefd=False)
+    raise ValueError('Unknown codec %r'%codec)
+
+def decompressor(codec, F):
+    'Wrap readable binary file F with a decompressing file-like'
+    if codec=='gzip':
+        import gzip
+        return gzip.GzipFile(fileobj=F, mode='rb')
+    elif codec=='lzma':
+        import lzma
+        return lzma.LZMAFile(F, 'rb')
+    elif codec=='zstd':
+        try:
+            from compression import zstd
+            return zstd.ZstdFile(F, 'rb')
+        except ImportError:
+            import zstandard
+            return zstandard.ZstdDecompressor().stream_reader(F, closefd=False)
+    raise ValueError('Unknown codec %r'%codec)
+
+def expand(IF, OF, blocksize=BLOCK_SIZE):
+    'Copy file-like IF to OF, leaving holes in place of zero blocks'
+    zblock = b'\0'*blocksize
+    while True:
+        buf = IF.read(blocksize)
+        if not buf:
+            break
+        if buf==zblock[:len(buf)]:
+            OF.seek(len(buf), os.SEEK_CUR)
+        else:
+            OF.write(buf)
+    OF.truncate()
+
+def have_codec(codec):
+    'Test if codec can be used'
+    try:
+        compressor(codec, io.BytesIO()).close()
+        return True
+    except ImportError:
+        return False
+
+class CaptureStats(object):
+    'Counters describing one capture()'
+    def __init__(self):
+        self.method = None
+        self.nbytes = 0 # total size of core
+        self.written = 0 # bytes actually written
+        self.holes = 0 # number of holes left in output
+        self.holebytes = 0 # bytes skipped over
+        self.elapsed = 0.0 # seconds
+
+    def __str__(self):
+        return 'Captured %d bytes in %.3f s via %s (%d bytes written, %d holes skipping %d bytes)'%(
+            self.nbytes, self.elapsed, self.method, self.written, self.holes, self.holebytes)
+
+def _writeall(fd, buf):
+    while len(buf):
+        n = os.write(fd, buf)
+        buf = buf[n:]
+
+def _readfull(IF, mv):
+    'Fill buffer from pipe.  Returns short count only on EOF'
+    pos = 0
+    while pos < len(mv):
+        n = IF.readinto(mv[pos:])
+        if not n:
+            break
+        pos += n
+    return pos
+
+def _copy_sparse(infd, outfd, S, tees, blocksize=BLOCK_SIZE, holesize=HOLE_SIZE):
+    S.method = 'sparse'
+    IF = io.FileIO(infd, 'rb', closefd=False)
+    buf = bytearray(blocksize)
+    mv = memoryview(buf)
+    zblock = b'\0'*blocksize
+    zhole = b'\0'*holesize
+    skip = 0 # pending lseek()
+
+    while True:
+        n = _readfull(IF, mv)
+        if n==0:
+            break
+        S.nbytes += n
+        for tee in tees:
+            tee.write(mv[:n])
+
+        if n==blocksize and buf==zblock: # fast path for an entirely zero block
+            if not skip:
+                S.holes += 1
+            skip += n
+            continue
+
+        pos = 0
+        while pos < n:
+            end = min(n, pos+holesize)
+            if end-pos==holesize and buf.startswith(zhole, pos):
+                if not skip:
+                    S.holes += 1
+                skip += holesize
+                pos = end
+                continue
+
+            # find extent of non-zero run to write
+            while end < n and not (end+holesize<=n and buf.startswith(zhole, end)):
+                end = min(n, end+holesize)
+
+            if skip:
+                os.lseek(outfd, skip, os.SEEK_CUR)
+                S.holebytes += skip
+                skip = 0
+            _writeall(outfd, mv[pos:end])
+            S.written += end-pos
+            pos = end
+
+    if skip:
+        S.holebytes += skip
+        # extend to full length, leaving trailing hole
+        os.ftruncate(outfd, os.lseek(outfd, skip, os.SEEK_CUR))
+
+def _copy_head(infd, outfd, S, tees, blocksize=HOLE_SIZE):
+    'Copy through user space until all tees are satisfied'
+    IF = io.FileIO(infd, 'rb', closefd=False)
+    buf = bytearray(blocksize)
+    mv = memoryview(buf)
+    while not all(tee.satisfied for tee in tees):
+        n = IF.readinto(mv)
+        if not n:
+            break
+        for tee in tees:
+            if not tee.satisfied:
+                tee.write(mv[:n])
+        S.nbytes += n
+        _writeall(outfd, mv[:n])
+        S.written += n
+
+def _copy_kernel(infd, outfd, S, blocksize=BLOCK_SIZE):
+    splice = getattr(os, 'splice', None) # py >= 3.10
+    start = S.nbytes # after _copy_head()
+    if splice is not None:
+        S.method = 'splice'
+        try:
+            while True:
+                n = splice(infd, outfd, blocksize)
+                if n==0:
+                    return
+                S.nbytes += n
+                S.written += n
+        except OSError:
+            if S.nbytes>start:
+                raise
+            # eg. EINVAL when infd is not a pipe.  Nothing consumed yet, so fall through
+
+    sendfile = getattr(os, 'sendfile', None) # py >= 3.3
+    if sendfile is not None:
+        S.method = 'sendfile'
+        try:
+            while True:
+                n = sendfile(outfd, infd, None, blocksize)
+                if n==0:
+                    return
+                S.nbytes += n
+                S.written += n
+        except OSError:
+            if S.nbytes>start:
+                raise
+            # eg. EINVAL when infd is a pipe on older kernels
+
+    _copy_user(infd, outfd, S, (), blocksize)
+
+def _copy_user(infd, outfd, S, tees, blocksize=BLOCK_SIZE):
+    S.method = 'copy'
+    IF = io.FileIO(infd, 'rb', closefd=False)
+    buf = bytearray(blocksize)
+    mv = memoryview(buf)
+    while True:
+        n = IF.readinto(mv)
+        if not n:
+            break
+        for tee in tees:
+            tee.write(mv[:n])
+        S.nbytes += n
+        if outfd is not None:
+            _writeall(outfd, mv[:n])
+            S.written += n
+
+def capture(IF, OF, sparse=True, tees=()):
+    '''Copy all of IF into OF.  Both are file-like objects with a fileno().
+    tees is a list of writable file-likes (eg. from compressor())
+    which will also be given all of IF, then closed.
+    OF may be None if only tees are to be given IF.
+    Returns a CaptureStats.
+    '''
+    S = CaptureStats()
+    T0 = _now()
+    if OF is None:
+        _copy_user(IF.fileno(), None, S, tees)
+        S.method = 'tee'
+    else:
+        OF.flush()
+        if sparse:
+            _copy_sparse(IF.fileno(), OF.fileno(), S, tees)
+        elif all(getattr(tee, 'satisfied', None) is not None for tee in tees):
+            # only the beginning passes through user space
+            _copy_head(IF.fileno(), OF.fileno(), S, tees)
+            _copy_kernel(IF.fileno(), OF.fileno(), S)
+        else:
+            # data must pass through user space anyway
+            _copy_user(IF.fileno(), OF.fileno(), S, tees)
+    for tee in tees:
+        tee.close() # eg. flush trailer.  Underlying file remains open
+    S.elapsed = _now() - T0
+    return S
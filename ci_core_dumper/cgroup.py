@@ -0,0 +1,246 @@
+"""
+Resource accounting of the exec sub-command, by running it in a transient cgroup v2 child.
+
+The cgroup is created below our own cgroup, or beside it when the memory
+controller is not enabled for children of our own (a cgroup with processes
+may not enable controllers for its children).  Controllers are not enabled
+here, as that would change the cgroups of the CI runner after exec.
+Those not already enabled are reported, and not counted.
+The command is moved in before exec, so its whole process tree is counted,
+including processes which are re-parented.
+
+Afterwards, peak memory, CPU time, IO bytes, and memory.events are read.
+OOM kills never reach core_pattern, so an OOM kill counted by memory.events
+is written as a crash record, of status 'oom', for report.
+
+memory.* requires the memory controller, and io.stat the io controller.
+cpu.stat is always present.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import print_function
+
+import os
+import time
+import errno
+import signal
+import logging
+
+from .linux import FLock
+from . import record
+
+_log = logging.getLogger(__name__)
+
+# for memory.* and io.stat.  cpu.stat is always present
+CONTROLLERS = ('memory', 'io')
+
+def mountpoint():
+    'Where the cgroup v2 hierarchy is mounted, or None'
+    with open('/proc/self/mounts', 'r') as F:
+        for line in F:
+            parts = line.split()
+            if len(parts)>2 and parts[2]=='cgroup2':
+                return parts[1]
+    return None
+
+def current():
+    'Path of our own cgroup v2, relative to the hierarchy'
+    with open('/proc/self/cgroup', 'r') as F:
+        for line in F:
+            if line.startswith('0::'):
+                return line[3:].strip()
+    return '/'
+
+def _read(path):
+    with open(path, 'r') as F:
+        return F.read()
+
+def _keyed(path):
+    'Parse "key value" lines, eg. cpu.stat or memory.events.  Empty if missing'
+    try:
+        return dict((K, int(V)) for K, V in (line.split() for line in _read(path).splitlines() if line.strip()))
+    except (IOError, OSError, ValueError):
+        return {}
+
+def _io(path):
+    'Sum of io.stat, "<maj>:<min> rbytes=N wbytes=N ..." lines, for all devices.  None if missing'
+    try:
+        lines = _read(path).splitlines()
+    except (IOError, OSError):
+        return None
+    ret = dict(rbytes=0, wbytes=0, rios=0, wios=0)
+    for line in lines:
+        for KV in line.split()[1:]:
+            K, _sep, V = KV.partition('=')
+            if K in ret:
+                ret[K] += int(V)
+    return ret
+
+def _controllers(path):
+    'Controllers enabled in cgroup path.  Empty if unknown'
+    try:
+        return _read(os.path.join(path, 'cgroup.controllers')).split()
+    except (IOError, OSError):
+        return []
+
+class CGroup(object):
+    '''home is the cgroup of its creator, where processes which remain are moved
+       so that it can be removed.
+    '''
+    def __init__(self, path, home):
+        self.path, self.home = path, home
+
+    @classmethod
+    def create(cls, name):
+        '''Create cgroup name, preferring one with the memory controller.
+           Raises OSError if none can be created.
+        '''
+        mnt = mountpoint()
+        if mnt is None:
+            raise OSError(errno.ENOENT, 'cgroup v2 not mounted')
+        own = os.path.join(mnt, current().lstrip('/')).rstrip('/')
+        parents = [own] if own==mnt.rstrip('/') else [own, os.path.dirname(own)]
+
+        made, err = None, None
+        for parent in parents:
+            path = os.path.join(parent, name)
+            try:
+                os.mkdir(path)
+            except OSError as e:
+                err = e
+                continue
+            if 'memory' in _controllers(path):
+                if made is not None:
+                    os.rmdir(made)
+                made = path
+                break
+            elif made is None:
+                made = path
+            else:
+                os.rmdir(path)
+        if made is None:
+            raise err
+        missing = [C for C in CONTROLLERS if C not in _controllers(made)]
+        if missing:
+            _log.error('Controllers %s not enabled in %s/cgroup.subtree_control.  Not counted',
+                       ' '.join(missing), os.path.dirname(made))
+        return cls(made, own)
+
+    def enter(self):
+        'Move the calling process in.  eg. as preexec_fn'
+        with open(os.path.join(self.path, 'cgroup.procs'), 'w') as F:
+            F.write('%d'%os.getpid())
+
+    def procs(self):
+        try:
+            return [int(P) for P in _read(os.path.join(self.path, 'cgroup.procs')).split()]
+        except (IOError, OSError):
+            return []
+
+    def populated(self):
+        'True while any process remains'
+        return _keyed(os.path.join(self.path, 'cgroup.events')).get('populated', 0)!=0
+
+    def kill(self, timeout=10.0):
+        '''Kill all processes, including those no longer descendants of the command,
+           and wait until they have exited.  Returns True if none remain.
+        '''
+        try:
+            with open(os.path.join(self.path, 'cgroup.kill'), 'w') as F: # >= 5.14
+                F.write('1')
+            each = False
+        except (IOError, OSError):
+            each = True
+        deadline = time.time()+timeout
+        while self.populated():
+            if each: # new processes may still be forked
+                for pid in self.procs():
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass # exited
+            if time.time()>deadline:
+                _log.error('Processes remain in %s after %.1f s', self.path, timeout)
+                return False
+            time.sleep(0.01)
+        return True
+
+    def resources(self):
+        'Usage of all processes which have run in this cgroup'
+        def value(name):
+            try:
+                V = _read(os.path.join(self.path, name)).strip()
+            except (IOError, OSError):
+                return None # no controller, or older kernel
+            return V if V=='max' else int(V)
+
+        cpu = _keyed(os.path.join(self.path, 'cpu.stat'))
+        events = _keyed(os.path.join(self.path, 'memory.events'))
+        return dict(cgroup=self.path,
+                    memory=dict(peak=value('memory.peak'), # >= 5.19
+                                swap_peak=value('memory.swap.peak'),
+                                max=value('memory.max'),
+                                events=events or None),
+                    cpu=dict((K, cpu[K]) for K in ('usage_usec', 'user_usec', 'system_usec') if K in cpu),
+                    io=_io(os.path.join(self.path, 'io.stat')),
+                    oom_kill=events.get('oom_kill', 0))
+
+    def remove(self):
+        'Remove, after moving any processes which remain home.  Returns True if removed'
+        left = self.procs()
+        if left:
+            _log.warning('%d processes remain after exit (%s).  Moved to %s', len(left),
+                         ' '.join(str(P) for P in left), self.home)
+            for pid in left:
+                try:
+                    with open(os.path.join(self.home, 'cgroup.procs'), 'w') as F:
+                        F.write('%d'%pid)
+                except (IOError, OSError) as e:
+                    if e.errno!=errno.ESRCH:
+                        _log.error('Unable to move PID %d from %s: %s', pid, self.path, e)
+                        return False
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            _log.exception('Unable to remove %s', self.path)
+            return False
+        return True
+
+def summary(R):
+    'One line description of resources()'
+    parts = []
+    peak = R['memory']['peak']
+    if peak is not None:
+        parts.append('peak memory %.1f MB'%(peak/1048576.0))
+    if 'usage_usec' in R['cpu']:
+        parts.append('CPU %.2f s (user %.2f s, system %.2f s)'%tuple(R['cpu'].get(K, 0)/1e6 for K in
+                                                                     ('usage_usec', 'user_usec', 'system_usec')))
+    if R['io'] is not None:
+        parts.append('read %.1f MB, written %.1f MB'%(R['io']['rbytes']/1048576.0, R['io']['wbytes']/1048576.0))
+    if R['oom_kill']:
+        parts.append('%d OOM kills'%R['oom_kill'])
+    return ', '.join(parts) or 'no usage counted'
+
+def write_oom(outdir, ident, R, cmd, code):
+    '''Write log and crash record of an exec with processes killed by the OOM killer.
+       Returns the log file name.
+    '''
+    now, pid = [int(P) for P in ident.split('.')]
+    logfile = os.path.join(outdir, ident+'.txt')
+    rec = dict(format=record.FORMAT, time=now, pid=pid, ipid=pid, log=os.path.basename(logfile),
+               status=record.OOM, signal=dict(signo=9, name='OOM'), exe=cmd[0], cmdline=cmd,
+               timings={}, resources=R,
+               # no stack.  As triage, the signature is of the executable
+               threads=[dict(lwp=pid, crashed=True, module=cmd[0], frames=[])])
+    with open(logfile, 'w') as LOG, FLock(LOG):
+        LOG.write('OOM PID %d (%d) @ %d %s\n'%(pid, pid, now, time.ctime(now)))
+        LOG.write('%d processes killed by the OOM killer in cgroup %s\n'%(R['oom_kill'], R['cgroup']))
+        LOG.write('EXE: {}\nCMDLINE: {}\n'.format(cmd[0], cmd))
+        LOG.write('Exit code: %s\n'%code)
+        M = R['memory']
+        LOG.write('Peak memory: %s bytes.  memory.max: %s\n'%(M['peak'], M['max']))
+        LOG.write('memory.events: %s\n'%' '.join('%s %d'%KV for KV in sorted((M['events'] or {}).items())))
+        LOG.write('The kernel log (dmesg) names the processes killed\n')
+        with open(os.path.join(outdir, ident+'.json'), 'w') as REC:
+            record.save(REC, rec)
+    return logfile
@@ -0,0 +1,216 @@
+"""
+Optional persistent process to analyze cores.
+
+Starting a python interpreter, and importing the linux module, for each
+crash takes time while the crashing process waits.  Instead, core_pattern
+may run a minimal client which connects to this daemon through a Unix socket
+and passes its stdin (the core pipe), and the %p %P %t arguments,
+using SCM_RIGHTS.  The daemon forks a child, from an already warm
+process, which runs dump() as the handler would.
+
+The client closes its copy of the core pipe once passed, and waits
+for the daemon to close the connection when dump() completes.
+If the daemon is not running, the client falls back to exec of dumper.py.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import print_function
+
+import sys
+import os
+import array
+import errno
+import fcntl
+import json
+import signal
+import socket
+import struct
+import traceback
+
+# files in outdir
+SOCKET = 'daemon.sock'
+PIDFILE = 'daemon.pid'
+OPTIONS = 'options.json'
+LOGFILE = 'daemon.log'
+
+# kept minimal as this runs in the crash path.
+client_template = '''#!{exe} {flags}
+import sys, os, socket, array
+S = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+try:
+    S.connect({sock!r})
+    S.sendmsg([' '.join(sys.argv[1:4]).encode()],
+              [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [0]))])
+except (IOError, OSError):
+    os.execv({dumper!r}, [{dumper!r}] + sys.argv[1:])
+# the daemon holds the core pipe now, until the core is captured
+os.close(0)
+# wait for completion
+S.recv(1)
+'''
+
+def supported():
+    return hasattr(socket.socket, 'sendmsg') # py >= 3.3
+
+def peer_uid(conn):
+    'Return UID of connected peer'
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _pid, uid, _gid = struct.unpack('3i', creds)
+    return uid
+
+def recv_request(conn):
+    'Receive arguments and core file descriptor from client'
+    fds = array.array('i')
+    msg, ancdata, _flags, _addr = conn.recvmsg(64, socket.CMSG_LEN(fds.itemsize))
+    for level, type, data in ancdata:
+        if level==socket.SOL_SOCKET and type==socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    if len(fds)!=1:
+        for fd in fds:
+            os.close(fd)
+        raise RuntimeError('Expected one fd, not %d'%len(fds))
+    return msg.decode().split(), fds[0]
+
+def handle(conn, opts):
+    'Run in forked child for one crash'
+    from .linux import dump
+
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    try:
+        argv, fd = recv_request(conn)
+        print('Request', argv)
+        sys.stdout.flush()
+        # the core pipe becomes stdin, as for the core_pattern handler
+        os.dup2(fd, 0)
+        os.close(fd)
+        try:
+            dump(argv=argv, **opts)
+        except SystemExit:
+            pass
+    except:
+        traceback.print_exc()
+    finally:
+        conn.close() # client exits, and kernel may reap
+
+def serve(outdir):
+    '''Listen on socket in outdir.  Returns in parent after socket
+    is bound.  Child becomes daemon and never returns.
+    '''
+    with open(os.path.join(outdir, OPTIONS), 'r') as F:
+        opts = json.load(F)
+
+    # ensure the linux module, and its dependencies, are warm.
+    from . import linux
+
+    sockname = os.path.join(outdir, SOCKET)
+    try:
+        os.remove(sockname)
+    except OSError as e:
+        if e.errno!=errno.ENOENT:
+            raise
+
+    L = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    L.bind(sockname)
+    os.chmod(sockname, 0o600)
+    L.listen(64)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    if os.fork()!=0:
+        L.close()
+        return # parent (eg. install) continues
+
+    os.setsid()
+    if os.fork()!=0:
+        os._exit(0)
+
+    # locked while running, so that stop() can tell a stale pidfile (eg. after reboot)
+    PID = open(os.path.join(outdir, PIDFILE), 'a+')
+    fcntl.flock(PID.fileno(), fcntl.LOCK_EX)
+    PID.truncate(0)
+    PID.write('%d\n'%os.getpid())
+    PID.flush()
+
+    os.chdir('/')
+    log = os.open(os.path.join(outdir, LOGFILE), os.O_WRONLY|os.O_CREAT|os.O_APPEND, 0o644)
+    null = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null, 0)
+    os.dup2(log, 1)
+    os.dup2(log, 2)
+    os.close(null)
+    os.close(log)
+
+    # children run dump() independently.  Let the kernel reap them.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    print('Listening on', sockname, 'as', os.getpid())
+    while True:
+        sys.stdout.flush()
+        try:
+            conn, _addr = L.accept()
+        except socket.error as e:
+            if e.errno==errno.EINTR:
+                continue
+            raise
+
+        try:
+            if peer_uid(conn)!=0:
+                print('Ignore connection from non-root')
+                continue
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+            if os.fork()==0:
+                try:
+                    L.close()
+                    PID.close() # only the daemon holds the lock
+                    handle(conn, opts)
+                finally:
+                    os._exit(0)
+        except:
+            traceback.print_exc()
+        finally:
+            conn.close()
+
+def stop(outdir):
+    '''Signal running daemon, if any, to exit.  Returns True if running.
+       A pidfile which the daemon no longer locks is stale, and only removed.
+    '''
+    pidfile = os.path.join(outdir, PIDFILE)
+    try:
+        F = open(pidfile, 'r')
+    except IOError as e:
+        if e.errno==errno.ENOENT:
+            return False
+        raise
+
+    with F:
+        try:
+            fcntl.flock(F.fileno(), fcntl.LOCK_SH|fcntl.LOCK_NB)
+            running = False
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            running = True
+        try:
+            pid = int(F.read())
+        except ValueError:
+            running = False
+
+    if running:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError as e:
+            if e.errno!=errno.ESRCH:
+                raise
+            running = False
+    else:
+        print('Remove stale', pidfile)
+
+    for name in (PIDFILE, SOCKET):
+        try:
+            os.remove(os.path.join(outdir, name))
+        except OSError as e:
+            if e.errno!=errno.ENOENT:
+                raise
+    return running
@@ -0,0 +1,564 @@
+"""
+Minimal ELF core file parser, with no dependencies.
+
+Parses the ELF header, program headers, and PT_NOTE segments,
+which the Linux kernel places at the beginning of a core file.
+So CoreParser can be fed the core as it is read from the kernel pipe,
+and is complete after the first few pages.
+
+This is enough for a quick triage of a crash: signal, fault address,
+threads with their registers, and mapped files, even when no debugger
+is available.
+
+ReducedCore uses this information to write a smaller core file,
+keeping only what is needed for a backtrace.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import print_function
+
+import os
+import struct
+import binascii
+import signal
+
+ELFMAG = b'\x7fELF'
+ET_EXEC = 2
+ET_DYN = 3
+ET_CORE = 4
+PT_LOAD = 1
+PT_NOTE = 4
+PN_XNUM = 0xffff
+
+PF_X = 1
+PF_W = 2
+PF_R = 4
+
+NT_PRSTATUS = 1
+NT_PRPSINFO = 3
+NT_AUXV = 6
+NT_SIGINFO = 0x53494749
+NT_FILE = 0x46494c45
+NT_GNU_BUILD_ID = 3
+
+AT_NAMES = {
+    3:'AT_PHDR',
+    6:'AT_PAGESZ',
+    7:'AT_BASE',
+    9:'AT_ENTRY',
+    15:'AT_PLATFORM',
+    16:'AT_HWCAP',
+    26:'AT_HWCAP2',
+}
+
+# e_machine -> (name, register names in elf_gregset_t, PC index, SP index)
+MACHINES = {
+    3: ('i386', 'ebx ecx edx esi edi ebp eax ds es fs gs orig_eax eip cs eflags esp ss'.split(), 12, 15),
+    40: ('arm', ['r%d'%n for n in range(13)] + 'sp lr pc cpsr orig_r0'.split(), 15, 13),
+    62: ('x86_64', ('r15 r14 r13 r12 rbp rbx r11 r10 r9 r8 rax rcx rdx rsi rdi orig_rax'
+                    ' rip cs eflags rsp ss fs_base gs_base ds es fs gs').split(), 16, 19),
+    21: ('ppc64', ['r%d'%n for n in range(32)] + 'nip msr orig_r3 ctr lnk xer ccr softe trap dar dsisr result'.split(), 32, 1),
+    183: ('aarch64', ['x%d'%n for n in range(31)] + 'sp pc pstate'.split(), 32, 31),
+    243: ('riscv', 'pc ra sp gp tp t0 t1 t2 s0 s1 a0 a1 a2 a3 a4 a5 a6 a7 s2 s3 s4 s5 s6 s7 s8 s9 s10 s11 t3 t4 t5 t6'.split(), 0, 2),
+}
+
+# give up on a core with more than this many bytes before the end of its notes
+MAX_HEADER = 64<<20
+
+# signals where siginfo holds a fault address
+FAULTS = tuple(getattr(signal, name) for name in ('SIGSEGV', 'SIGBUS', 'SIGILL', 'SIGFPE', 'SIGTRAP')
+               if hasattr(signal, name))
+
+def signame(signo):
+    for name in dir(signal):
+        if name.startswith('SIG') and not name.startswith('SIG_') and getattr(signal, name)==signo:
+            return name
+    return 'signal %d'%signo
+
+def _ident(ehdr):
+    'Returns (wordsize, byte order) of ELF header, or None if not ELF'
+    if len(ehdr)<52 or ehdr[:4]!=ELFMAG or ehdr[4:5] not in (b'\x01', b'\x02'):
+        return None
+    return 8 if ehdr[4:5]==b'\x02' else 4, '>' if ehdr[5:6]==b'\x02' else '<'
+
+def build_id(F):
+    '''GNU build-id of an ELF executable or library, as a hex string.
+       F is a binary file open for reading.  Returns None if not ELF, or no build-id.
+    '''
+    F.seek(0)
+    ehdr = F.read(64)
+    ident = _ident(ehdr)
+    if ident is None:
+        return None
+    W, end = ident
+    if W==8:
+        phoff, = struct.unpack_from(end+'Q', ehdr, 32)
+        phentsize, phnum = struct.unpack_from(end+'HH', ehdr, 54)
+        phfmt, order = end+'IIQQQQQQ', (0, 2, 5) # type, offset, filesz
+    else:
+        phoff, = struct.unpack_from(end+'I', ehdr, 28)
+        phentsize, phnum = struct.unpack_from(end+'HH', ehdr, 42)
+        phfmt, order = end+'IIIIIIII', (0, 1, 4)
+
+    F.seek(phoff)
+    phdrs = F.read(phentsize*phnum)
+    for n in range(min(phnum, len(phdrs)//max(phentsize, 1))):
+        P = struct.unpack_from(phfmt, phdrs, n*phentsize)
+        ptype, offset, filesz = [P[i] for i in order]
+        if ptype!=PT_NOTE or filesz > 1<<16:
+            continue
+        F.seek(offset)
+        data = F.read(filesz)
+        pos = 0
+        while pos+12 <= len(data):
+            namesz, descsz, ntype = struct.unpack_from(end+'III', data, pos)
+            pos += 12
+            name = data[pos:pos+namesz].rstrip(b'\0')
+            pos += (namesz+3)&~3
+            if name==b'GNU' and ntype==NT_GNU_BUILD_ID:
+                return binascii.hexlify(data[pos:pos+descsz]).decode('ascii')
+            pos += (descsz+3)&~3
+    return None
+
+def elf_type(F):
+    'e_type of an ELF file (eg. ET_EXEC), or None if not ELF'
+    F.seek(0)
+    ehdr = F.read(64)
+    ident = _ident(ehdr)
+    if ident is None:
+        return None
+    return struct.unpack_from(ident[1]+'H', ehdr, 16)[0]
+
+def section_names(F):
+    'List of the section names of an ELF file.  Empty if not ELF, or no section headers'
+    F.seek(0)
+    ehdr = F.read(64)
+    ident = _ident(ehdr)
+    if ident is None:
+        return []
+    W, end = ident
+    if W==8:
+        shoff, = struct.unpack_from(end+'Q', ehdr, 40)
+        shentsize, shnum, shstrndx = struct.unpack_from(end+'HHH', ehdr, 58)
+        shfmt = end+'IIQQQQ' # name, type, flags, addr, offset, size
+    else:
+        shoff, = struct.unpack_from(end+'I', ehdr, 32)
+        shentsize, shnum, shstrndx = struct.unpack_from(end+'HHH', ehdr, 46)
+        shfmt = end+'IIIIII'
+    if not shoff or not shnum or shstrndx>=shnum:
+        return []
+
+    F.seek(shoff)
+    shdrs = F.read(shentsize*shnum)
+    if len(shdrs) < shentsize*shnum:
+        return [] # truncated
+    hdrs = [struct.unpack_from(shfmt, shdrs, n*shentsize) for n in range(shnum)]
+    _name, _type, _flags, _addr, stroff, strsize = hdrs[shstrndx]
+    F.seek(stroff)
+    strtab = F.read(min(strsize, 1<<20))
+    ret = []
+    for H in hdrs:
+        nul = strtab.find(b'\0', H[0])
+        name = strtab[H[0]:nul if nul>=0 else None]
+        ret.append(name.decode('utf-8', 'replace'))
+    return ret
+
+class Segment(object):
+    'A program header'
+    def __init__(self, type, flags, offset, vaddr, filesz, memsz, align):
+        self.type, self.flags, self.offset, self.vaddr = type, flags, offset, vaddr
+        self.filesz, self.memsz, self.align = filesz, memsz, align
+
+    def __contains__(self, addr):
+        return self.vaddr <= addr < self.vaddr + self.memsz
+
+class Thread(object):
+    'From one NT_PRSTATUS'
+    def __init__(self, signo, pid, regs, pc=None, sp=None):
+        self.signo, self.pid, self.regs, self.pc, self.sp = signo, pid, regs, pc, sp
+
+class CoreParser(object):
+    '''Incremental parser.  Feed with successive blocks through write().
+    Also usable as a capture() tee, which is satisfied once the notes are parsed.
+    Check .complete afterwards.
+    '''
+    def __init__(self):
+        self.offset = 0 # bytes seen
+        self.complete = False # all notes parsed
+        self.error = None
+
+        self.machine = None # name
+        self.wordsize = None # 4 or 8
+        self.segments = [] # [Segment]
+        self.threads = [] # [Thread] the first is the thread which received the signal
+        self.siginfo = None # (signo, errno, code, addr, sender pid)
+        self.files = [] # [(start, end, file offset in pages, name)]
+        self.pagesize = 4096 # of file offsets.  From NT_FILE
+        self.auxv = {}
+        self.psinfo = None # (fname, args)
+
+        self._buf = bytearray()
+        self._need = 64 # buffer until this offset
+        self._stage = self._ehdr
+        self._regnames = []
+        self._pcsp = (None, None)
+
+    def write(self, data):
+        if self._stage is not None:
+            self._buf.extend(data)
+            try:
+                while self._stage is not None and len(self._buf) >= self._need:
+                    self._stage()
+            except Exception as e:
+                self.error = 'Unable to parse core: %r'%e
+                self._stage = None
+            if self._stage is not None and len(self._buf) > MAX_HEADER:
+                self.error = 'Notes not found in first %d bytes'%MAX_HEADER
+                self._stage = None
+            if self._stage is None:
+                self._buf = None # release memory
+        self.offset += len(data)
+        return len(data)
+
+    @property
+    def satisfied(self):
+        'True once further data would be ignored'
+        return self._stage is None
+
+    def close(self):
+        if not self.complete and self.error is None:
+            self.error = 'Truncated core file'
+
+    # stages of parsing
+
+    def _ehdr(self):
+        buf = self._buf
+        if bytes(buf[:4])!=ELFMAG:
+            raise ValueError('Not ELF')
+        ei_class, ei_data = buf[4], buf[5]
+        self.wordsize = {1:4, 2:8}[ei_class]
+        self._end = {1:'<', 2:'>'}[ei_data]
+        self._L = 'I' if self.wordsize==4 else 'Q'
+
+        if self.wordsize==8:
+            fmt = self._end+'HHIQQQIHHHHHH'
+        else:
+            fmt = self._end+'HHIIIIIHHHHHH'
+        (e_type, e_machine, _ver, _entry, e_phoff, _shoff, _flags, _ehsize,
+         e_phentsize, e_phnum, _shentsize, _shnum, _shstrndx) = struct.unpack_from(fmt, bytes(buf[:64]), 16)
+        self._ehfmt = fmt
+
+        if e_type!=ET_CORE:
+            raise ValueError('Not a core file')
+        if e_phnum==PN_XNUM:
+            raise ValueError('Extended program header numbering not supported')
+
+        self.machine, self._regnames, pc, sp = MACHINES.get(e_machine, ('EM_%d'%e_machine, [], None, None))
+        self._pcsp = (pc, sp)
+
+        self._phoff, self.phentsize, self._phnum = e_phoff, e_phentsize, e_phnum
+        self._need = e_phoff + e_phentsize*e_phnum
+        self._stage = self._phdrs
+
+    def _phfmt(self):
+        'Returns struct format, and Segment() argument order'
+        if self.wordsize==8:
+            return self._end+'IIQQQQQQ', (0, 1, 2, 3, 5, 6, 7)
+        else:
+            return self._end+'IIIIIIII', (0, 6, 1, 2, 4, 5, 7)
+
+    def _phdrs(self):
+        fmt, order = self._phfmt()
+        for n in range(self._phnum):
+            F = struct.unpack_from(fmt, bytes(self._buf[self._phoff + n*self.phentsize:
+                                                         self._phoff + (n+1)*self.phentsize]))
+            self.segments.append(Segment(*[F[i] for i in order]))
+
+        notes = [seg for seg in self.segments if seg.type==PT_NOTE]
+        if not notes:
+            raise ValueError('No PT_NOTE')
+        self._need = max(seg.offset+seg.filesz for seg in notes)
+        self._stage = self._notes
+
+    def _notes(self):
+        for seg in self.segments:
+            if seg.type!=PT_NOTE:
+                continue
+            data = bytes(self._buf[seg.offset:seg.offset+seg.filesz])
+            pos = 0
+            while pos+12 <= len(data):
+                namesz, descsz, ntype = struct.unpack_from(self._end+'III', data, pos)
+                pos += 12
+                name = data[pos:pos+namesz].rstrip(b'\0')
+                pos += (namesz+3)&~3
+                desc = data[pos:pos+descsz]
+                pos += (descsz+3)&~3
+                if name==b'CORE':
+                    self._note(ntype, desc)
+        self.complete = True
+        self._stage = None
+
+    def _words(self, desc, offset, count):
+        return struct.unpack_from('%s%d%s'%(self._end, count, self._L), desc, offset)
+
+    def _note(self, ntype, desc):
+        W = self.wordsize
+        if ntype==NT_PRSTATUS:
+            # struct elf_prstatus
+            signo = struct.unpack_from(self._end+'i', desc, 0)[0]
+            pid = struct.unpack_from(self._end+'i', desc, 16+2*W)[0]
+            regoff = 32+10*W
+            nregs = (len(desc) - regoff - 4)//W # excludes pr_fpvalid
+            if self._regnames:
+                nregs = min(nregs, len(self._regnames))
+            regs = self._words(desc, regoff, nregs)
+            pc, sp = self._pcsp
+            self.threads.append(Thread(signo, pid, regs,
+                                       pc=regs[pc] if pc is not None and pc<nregs else None,
+                                       sp=regs[sp] if sp is not None and sp<nregs else None))
+
+        elif ntype==NT_SIGINFO:
+            signo, errno, code = struct.unpack_from(self._end+'iii', desc, 0)
+            # union of si_addr or si_pid
+            addr = self._words(desc, 16 if W==8 else 12, 1)[0]
+            pid = struct.unpack_from(self._end+'i', desc, 16 if W==8 else 12)[0]
+            self.siginfo = (signo, errno, code, addr, pid)
+
+        elif ntype==NT_FILE:
+            count, self.pagesize = self._words(desc, 0, 2)
+            ranges = self._words(desc, 2*W, 3*count)
+            names = desc[(2+3*count)*W:].split(b'\0')
+            for n in range(count):
+                self.files.append((ranges[3*n], ranges[3*n+1], ranges[3*n+2],
+                                   names[n].decode('utf-8', 'replace')))
+
+        elif ntype==NT_AUXV:
+            vals = self._words(desc, 0, len(desc)//W)
+            for n in range(0, len(vals)-1, 2):
+                if vals[n]==0: # AT_NULL
+                    break
+                self.auxv[vals[n]] = vals[n+1]
+
+        elif ntype==NT_PRPSINFO:
+            # pr_fname[16] and pr_psargs[80] end struct elf_prpsinfo
+            fname = desc[-96:-80].split(b'\0')[0].decode('utf-8', 'replace')
+            args = desc[-80:].split(b'\0')[0].decode('utf-8', 'replace')
+            self.psinfo = (fname, args)
+
+    # results
+
+    def module(self, addr):
+        'Describe address as file+offset, if in a mapped file'
+        for start, end, pgoff, name in self.files:
+            if start <= addr < end:
+                return '%s+0x%x'%(name, addr - start + pgoff*self.pagesize)
+        return None
+
+    def summary(self):
+        'Triage information as a dict, for a crash record'
+        ret = dict(machine=self.machine, error=self.error,
+                   threads=[dict(lwp=T.pid, pc=T.pc, sp=T.sp, module=self.module(T.pc) if T.pc is not None else None)
+                            for T in self.threads])
+        if self.siginfo:
+            signo, _errno, code, addr, pid = self.siginfo
+            ret['signal'] = dict(signo=signo, name=signame(signo), code=code,
+                                 addr=addr if signo in FAULTS and code > 0 else None,
+                                 sender=pid if code <= 0 else None)
+        elif self.threads:
+            signo = self.threads[0].signo
+            ret['signal'] = dict(signo=signo, name=signame(signo))
+        if self.psinfo:
+            ret['program'], ret['args'] = self.psinfo
+        return ret
+
+    def triage(self, out=print):
+        'Print summary.  Returns False if the core could not be parsed'
+        out('# Triage')
+        if not self.complete:
+            out('  %s'%(self.error or 'Incomplete'))
+            return False
+
+        if self.psinfo:
+            out('  Program: %s  Args: %s'%self.psinfo)
+
+        if self.siginfo:
+            signo, _errno, code, addr, pid = self.siginfo
+            if signo in FAULTS and code > 0:
+                extra = '  fault address 0x%x'%addr
+            elif code <= 0: # SI_USER, SI_TKILL, ...
+                extra = '  sent by PID %d'%pid
+            else:
+                extra = ''
+            out('  Signal: %d %s code %d%s'%(signo, signame(signo), code, extra))
+        elif self.threads:
+            signo = self.threads[0].signo
+            out('  Signal: %d %s'%(signo, signame(signo)))
+
+        out('  Machine: %s  Threads: %d  Mapped files: %d'%(self.machine, len(self.threads), len(self.files)))
+        for key in sorted(self.auxv):
+            if key in AT_NAMES:
+                out('  %s: 0x%x'%(AT_NAMES[key], self.auxv[key]))
+
+        for n, T in enumerate(self.threads):
+            where = ''
+            if T.pc is not None:
+                where = '  pc 0x%x %s  sp 0x%x'%(T.pc, self.module(T.pc) or '', T.sp)
+            out('  Thread LWP %d%s%s'%(T.pid, ' (crashed)' if n==0 else '', where))
+
+        if self.threads and self._regnames:
+            # registers of the thread which crashed
+            regs = ['%s=0x%x'%(name, val) for name, val in zip(self._regnames, self.threads[0].regs)]
+            for n in range(0, len(regs), 4):
+                out('    '+'  '.join(regs[n:n+4]))
+        return True
+
+    def pack_ehdr(self, ehdr, phoff, phnum):
+        'Modify a copy of the ELF header for a new program header table'
+        ehdr = bytearray(ehdr)
+        F = list(struct.unpack_from(self._ehfmt, bytes(ehdr), 16))
+        F[4], F[5], F[9], F[11], F[12] = phoff, 0, phnum, 0, 0 # no section headers
+        struct.pack_into(self._ehfmt, ehdr, 16, *F)
+        return ehdr
+
+    def pack_phdr(self, seg):
+        fmt, order = self._phfmt()
+        F = [0]*8 # p_paddr is always zero
+        for i, val in zip(order, (seg.type, seg.flags, seg.offset, seg.vaddr, seg.filesz, seg.memsz, seg.align)):
+            F[i] = val
+        return struct.pack(fmt, *F).ljust(self.phentsize, b'\0')
+
+class ReducedCore(object):
+    '''Tee which writes a reduced core file, with only enough to produce a backtrace.
+
+    Keeps notes, a window around the stack pointer of each thread,
+    and memory of file backed mappings (eg. ELF headers, .data, and .bss).
+    Also small anonymous segments, which may hold dynamic linker state.
+    Other PT_LOAD segments are kept with p_filesz=0, so the memory
+    layout is preserved, but with no contents.
+
+    Must be given the core in order.  OF must be seekable.
+    '''
+    # window around each stack pointer.  Stacks grow down, so most of the window is above
+    STACK_BELOW = 64<<10
+    STACK_ABOVE = 1<<20
+    # keep entire anonymous segments this small
+    SMALL = 256<<10
+
+    def __init__(self, OF):
+        self.OF = OF
+        self.parser = CoreParser()
+        self.offset = 0 # of input
+        self.insize = self.outsize = 0
+        self._prefix = bytearray() # input until parser is complete
+        self._copies = None # [(input offset, size, output offset)]
+        self._nloads = self._nkept = 0
+
+    def write(self, data):
+        if self._copies is None:
+            self._prefix.extend(data)
+            self.parser.write(data)
+            if self.parser.complete:
+                self._plan()
+            elif self.parser.error:
+                # unable to reduce, so copy everything
+                self._copies = [(0, 1<<62, 0)]
+            if self._copies is not None:
+                prefix, self._prefix = self._prefix, None
+                self._emit(prefix, 0)
+        else:
+            self._emit(data, self.offset)
+        self.offset += len(data)
+        return len(data)
+
+    def close(self):
+        self.parser.close()
+        self.insize = self.offset
+        self.OF.flush()
+        self.outsize = os.fstat(self.OF.fileno()).st_size
+
+    def __str__(self):
+        if self.parser.error:
+            return 'Unable to reduce core: %s'%self.parser.error
+        return 'Reduced core %d -> %d bytes.  Kept %d of %d memory segments.'%(
+            self.insize, self.outsize, self._nkept, self._nloads)
+
+    def _emit(self, data, offset):
+        end = offset + len(data)
+        for inoff, size, outoff in self._copies:
+            lo, hi = max(offset, inoff), min(end, inoff+size)
+            if lo < hi:
+                self.OF.seek(outoff + lo - inoff)
+                self.OF.write(data[lo-offset:hi-offset])
+
+    def _keep(self, seg):
+        'Returns list of (start, end) virtual address ranges to keep from PT_LOAD'
+        if seg.filesz <= self.SMALL:
+            return [(seg.vaddr, seg.vaddr+seg.memsz)]
+        for start, end, _pgoff, _name in self.parser.files:
+            if seg.flags&PF_W and start < seg.vaddr+seg.memsz and seg.vaddr < end:
+                return [(seg.vaddr, seg.vaddr+seg.memsz)]
+
+        ranges = []
+        mask = self.parser.pagesize-1
+        for T in self.parser.threads:
+            if T.sp is not None and T.sp in seg:
+                lo = max(seg.vaddr, (T.sp - self.STACK_BELOW)&~mask)
+                hi = min(seg.vaddr+seg.memsz, (T.sp + self.STACK_ABOVE + mask)&~mask)
+                ranges.append((lo, hi))
+        ranges.sort()
+        merged = []
+        for lo, hi in ranges:
+            if merged and lo <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(hi, merged[-1][1]))
+            else:
+                merged.append((lo, hi))
+        return merged
+
+    def _plan(self):
+        P = self.parser
+        notes, loads = [], []
+        for seg in P.segments:
+            if seg.type==PT_NOTE:
+                notes.append(seg)
+                continue
+            elif seg.type!=PT_LOAD:
+                continue
+
+            # split into pieces with, or without, contents
+            pos, fileend = seg.vaddr, seg.vaddr+seg.filesz
+            for lo, hi in self._keep(seg):
+                if pos < lo:
+                    loads.append((Segment(PT_LOAD, seg.flags, 0, pos, 0, lo-pos, seg.align), None))
+                filesz = max(0, min(hi, fileend) - lo)
+                loads.append((Segment(PT_LOAD, seg.flags, 0, lo, filesz, hi-lo, seg.align),
+                              seg.offset + lo - seg.vaddr))
+                pos = hi
+            if pos < seg.vaddr+seg.memsz:
+                loads.append((Segment(PT_LOAD, seg.flags, 0, pos, 0, seg.vaddr+seg.memsz-pos, seg.align), None))
+
+        self._nloads = len([seg for seg in P.segments if seg.type==PT_LOAD])
+        self._nkept = len([inoff for _seg, inoff in loads if inoff is not None])
+
+        ehsize = 64 if P.wordsize==8 else 52
+        phnum = len(notes) + len(loads)
+        pos = ehsize + phnum*P.phentsize
+        copies = []
+        phdrs = []
+        for seg in notes:
+            copies.append((seg.offset, seg.filesz, pos))
+            phdrs.append(Segment(PT_NOTE, seg.flags, pos, seg.vaddr, seg.filesz, seg.memsz, seg.align))
+            pos += (seg.filesz+3)&~3
+        for seg, inoff in loads:
+            pos = (pos + P.pagesize-1)&~(P.pagesize-1)
+            seg.offset = pos
+            if inoff is not None:
+                copies.append((inoff, seg.filesz, pos))
+                pos += seg.filesz
+            phdrs.append(seg)
+
+        self.OF.seek(0)
+        self.OF.write(P.pack_ehdr(self._prefix[:ehsize], ehsize, phnum))
+        for seg in phdrs:
+            self.OF.write(P.pack_phdr(seg))
+        self.OF.truncate(pos)
+        self._copies = copies
@@ -0,0 +1,114 @@
+"""
+Index of the ELF files in a build tree, made by install.
+
+Records the build-id of each executable, library, and separate debug file,
+and whether it already has an index for GDB (.gdb_index or .debug_names).
+Files with debug info are linked by build-id in outdir/debug/.build-id/
+so that GDB, with 'set debug-file-directory', finds separate debug info
+by lookup, instead of searching.
+
+Optionally, a .gdb_index is added to files without one by gdb-add-index.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import json
+import shutil
+import subprocess as SP
+
+from .elfcore import build_id, elf_type, section_names, ET_EXEC, ET_DYN
+
+INDEX = 'elfindex.json'
+DEBUG = 'debug'
+
+# default system location, searched after DEBUG
+SYSTEM_DEBUG = '/usr/lib/debug'
+
+SKIP_DIRS = frozenset(['.git', '.hg', '.svn', '__pycache__', 'node_modules'])
+
+def find(top):
+    'Yield files which may be ELF'
+    for root, subdirs, files in os.walk(top):
+        subdirs[:] = [D for D in subdirs if D not in SKIP_DIRS]
+        for name in files:
+            if name.endswith(('.o', '.a', '.c', '.cpp', '.h', '.py', '.pyc', '.txt')):
+                continue
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                yield path
+
+def inspect(path):
+    'Index entry for one file, or None if not an ELF executable, library, or debug file'
+    try:
+        with open(path, 'rb') as F:
+            if elf_type(F) not in (ET_EXEC, ET_DYN):
+                return None
+            sections = set(section_names(F))
+            return dict(path=path, build_id=build_id(F),
+                        debug_info='.debug_info' in sections,
+                        gdb_index='.gdb_index' in sections,
+                        debug_names='.debug_names' in sections)
+    except (IOError, OSError):
+        return None
+
+def add_index(args):
+    '''Run gdb-add-index on one file, keeping its owner.  Returns (path, success)'''
+    tool, path = args
+    st = os.stat(path)
+    with open(os.devnull, 'w') as NULL:
+        ok = SP.call([tool, path], stdout=NULL, stderr=NULL)==0
+    after = os.stat(path)
+    if (after.st_uid, after.st_gid)!=(st.st_uid, st.st_gid):
+        os.chown(path, st.st_uid, st.st_gid)
+    return path, ok
+
+def link_debug(entries, debugdir):
+    '''(Re)create debugdir/.build-id/ab/cdef.debug symlinks
+       to files with debug info.  Returns the number of links.
+    '''
+    shutil.rmtree(debugdir, ignore_errors=True)
+    n = 0
+    for E in entries:
+        bid = E['build_id']
+        if not bid or not E['debug_info']:
+            continue
+        link = os.path.join(debugdir, '.build-id', bid[:2], bid[2:]+'.debug')
+        if os.path.lexists(link):
+            continue # same build, first found wins
+        if not os.path.isdir(os.path.dirname(link)):
+            os.makedirs(os.path.dirname(link))
+        os.symlink(os.path.abspath(E['path']), link)
+        n += 1
+    return n
+
+def scan(top, outdir, jobs=None, gdb_index=None, log=None):
+    '''Index ELF files under top, in parallel, and write outdir/elfindex.json.
+       gdb_index is the path of gdb-add-index, to index files which have debug info but no index.
+       Returns the list of index entries.
+    '''
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs)
+    try:
+        entries = [E for E in pool.imap_unordered(inspect, find(top), chunksize=64) if E is not None]
+        entries.sort(key=lambda E: E['path'])
+
+        todo = [E for E in entries if E['debug_info'] and not (E['gdb_index'] or E['debug_names'])]
+        if gdb_index and todo:
+            if log:
+                log('Adding .gdb_index to %d files'%len(todo))
+            done = dict(pool.imap_unordered(add_index, [(gdb_index, E['path']) for E in todo]))
+            for E in todo:
+                E['gdb_index'] = done.get(E['path'], False)
+    finally:
+        pool.close()
+        pool.join()
+
+    nlinks = link_debug(entries, os.path.join(outdir, DEBUG))
+    with open(os.path.join(outdir, INDEX), 'w') as F:
+        json.dump(dict(top=top, files=entries), F, indent=1)
+
+    if log:
+        log('Indexed %d ELF files under %s.  %d with debug info, %d with an index, %d linked by build-id'%(
+            len(entries), top, len([E for E in entries if E['debug_info']]),
+            len([E for E in entries if E['gdb_index'] or E['debug_names']]), nlinks))
+    return entries
@@ -0,0 +1,144 @@
+"""
+Hang watchdog for the exec sub-command.
+
+When the command has not exited after a timeout, each process of its tree
+is attached by a debugger, and the backtraces of all threads written
+to <time>.<pid>.txt, with a <time>.<pid>.json crash record of status 'hung',
+as if it had crashed.  So report shows hung tests along with crashed ones.
+Optionally a core file is written with gcore.  Then the tree is killed.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import print_function
+
+import os
+import time
+import errno
+import signal
+import logging
+import subprocess as SP
+
+from .capture import _now
+from .analyzers import find_executable
+from .linux import FLock
+from .profile import tree
+from . import stacks
+from . import record
+
+_log = logging.getLogger(__name__)
+
+# seconds for each debugger, or gcore, run
+TIMEOUT = 60
+# exit code, as timeout(1)
+EXIT = 124
+
+def wait(P, deadline=None):
+    'Wait for subprocess P to exit, until time deadline.  Returns its exit code, or None'
+    while True:
+        code = P.poll()
+        if code is not None or (deadline is not None and _now()>=deadline):
+            return code
+        time.sleep(0.05 if deadline is None else max(0, min(deadline-_now(), 0.05)))
+
+def gcore(pid, path):
+    'Write a core file of running process pid to path.  Returns True on success'
+    tool = find_executable('gcore')
+    if tool is None:
+        print('ERROR: gcore not found')
+        return False
+    with open(os.devnull, 'r') as NULL:
+        P = SP.Popen([tool, '-o', path, str(pid)], stdin=NULL, stdout=SP.PIPE, stderr=SP.STDOUT)
+    deadline = _now()+TIMEOUT
+    out = P.communicate()[0] if wait(P, deadline) is not None else None
+    if out is None:
+        P.kill()
+        P.wait()
+        print('ERROR: gcore killed after %d s'%TIMEOUT)
+        return False
+    try:
+        os.rename('%s.%d'%(path, pid), path) # gcore appends .<pid>
+    except OSError as e:
+        print('ERROR: gcore exits with %d : %s'%(P.returncode, out.decode('utf-8', 'replace').strip() or e))
+        return False
+    return True
+
+def backtrace(outdir, pid, now, analyzer, timeout, command, core=False, limits=stacks.DEFAULT_LIMITS):
+    '''Write log and crash record of hung process pid.
+       Returns the log file name.
+    '''
+    ident = '{}.{}'.format(now, pid)
+    logfile = os.path.join(outdir, ident+'.txt')
+    with open(logfile, 'w') as LOG, FLock(LOG), open(os.path.join(outdir, ident+'.json'), 'w') as REC:
+        rec = dict(format=record.FORMAT, time=now, pid=pid, ipid=pid, log=os.path.basename(logfile),
+                   status=record.FAILED, signal=dict(signo=None, name='TIMEOUT'), timeout=timeout, timings={})
+        T0 = _now()
+        try:
+            LOG.write('Hung PID %d (%d) @ %d %s\n'%(pid, pid, now, time.ctime(now)))
+            LOG.write('Timeout of %s s reached by: %s\n'%(timeout, command))
+            exe = os.readlink('/proc/%d/exe'%pid)
+            with open('/proc/%d/cmdline'%pid, 'rb') as F:
+                cmdline = [arg.decode('utf-8', 'replace') for arg in F.read().split(b'\0')][:-1]
+            LOG.write('EXE: {}\nCMDLINE: {}\n'.format(exe, cmdline))
+            rec.update(exe=exe, cmdline=cmdline)
+            # main thread first
+            tids = sorted((int(T) for T in os.listdir('/proc/%d/task'%pid)), key=lambda T: (T!=pid, T))
+
+            out = None
+            if analyzer is None:
+                LOG.write('ERROR: No debugger found.  No backtraces\n')
+            else:
+                LOG.write('Analyzer: %s\n'%analyzer)
+                rec['analyzer'] = analyzer.name
+                cmd = analyzer.attach(pid, depth=limits['depth'])
+                LOG.write('exec: %s\n'%cmd)
+                out = stacks.run(cmd, LOG, timeout=limits['timeout'], max_output=limits['max_output'],
+                                 depth=limits['depth'])
+                if out.code:
+                    LOG.write('ERROR: %s exits with %s\n'%(analyzer.name, out.code))
+                rec['cuts'] = out.cuts
+            rec['timings']['analysis'] = _now()-T0
+            # without frames, the signature is of the executable, as for triage
+            rec['threads'] = record.threads(dict(threads=[dict(lwp=T, module=exe if T==pid else None) for T in tids]),
+                                            text=out)
+
+            if core:
+                corefile = os.path.join(outdir, ident+'.core')
+                T1 = _now()
+                if gcore(pid, corefile):
+                    LOG.write('Core: %s\n'%corefile)
+                rec['timings']['core'] = _now()-T1
+
+            rec['status'] = record.HUNG if out is not None and out.code==0 else record.FAILED
+            LOG.write('Complete\n')
+        except (IOError, OSError) as e:
+            LOG.write('ERROR: %s\n'%e) # exited meanwhile
+        finally:
+            rec['timings']['total'] = _now()-T0
+            record.save(REC, rec)
+    return logfile
+
+def kill(root):
+    'SIGKILL process root and its descendants'
+    for pid in tree(root):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError as e:
+            if e.errno!=errno.ESRCH:
+                raise
+
+def expire(P, outdir, analyzer, timeout, command, core=False):
+    '''Subprocess P has run for longer than timeout.
+       Record backtraces of its process tree, kill it, and return EXIT.
+    '''
+    now = int(time.time())
+    pids = tree(P.pid)
+    _log.error('%s timeout after %s s.  Backtraces of %d processes in %s', command, timeout, len(pids), outdir)
+    for pid in pids:
+        try:
+            _log.info('Wrote %s', backtrace(outdir, pid, now, analyzer, timeout, command, core=core,
+                                            limits=dict(stacks.DEFAULT_LIMITS, timeout=TIMEOUT)))
+        except (IOError, OSError):
+            _log.exception('Unable to record hung PID %d', pid)
+    kill(P.pid)
+    P.wait()
+    return EXIT
@@ -10,24 +10,24 @@ GDB to produce stack traces.
 
 from __future__ import print_function
 
+# The crash path, dump(), runs while the crashing process waits.
+# So modules only needed by other sub-commands are imported where used.
 import sys
 import os
 import time
 import errno
-import ctypes
+import json
 import logging
 import fcntl
-import shutil
 import traceback
-import resource
-import subprocess as SP
-from glob import glob
-try:
-    from distutils.spawn import find_executable # < 3.12
-except ImportError:
-    from shutil import which as find_executable # >= 3.3
 
 from . import CommonDumper, _root_dir
+from .capture import capture, compressor, decompressor, expand, have_codec, CODECS, _now
+from . import sched
+from .elfcore import CoreParser, ReducedCore
+from .analyzers import ANALYZERS, GDB, find_analyzer, find_executable
+from . import stacks
+from . import record
 
 try:
     from os import set_inheritable # >=3.4
@@ -44,7 +44,65 @@ _log = logging.getLogger(__name__)
 
 core_pattern = '/proc/sys/kernel/core_pattern'
 
-def forknpark(fn, **kws):
+# core_pattern handler.  Runs while the crashing process waits, so
+# python is started without site (-S), and isolated from the environment (-I).
+dumper_template = '''#!{exe} {flags}
+import sys
+sys.path.append(r'{cwd}')
+from ci_core_dumper.linux import dump
+dump(outdir=r'{outdir}', gdb=r'{gdb}', extra_cmds={cmds!r}{opts})
+'''
+
+def lean_flags(site=False):
+    'Interpreter flags for a crash handler'
+    if sys.version_info < (3, 4):
+        return '-E' if site else '-SE' # no -I
+    return '-I' if site else '-SI'
+
+def write_handler(path, outdir, gdb, extra_cmds, opts, flags=None):
+    '''Write core_pattern handler script which calls dump().
+       opts are extra keyword arguments.
+    '''
+    if flags is None:
+        site = False
+        if opts.get('keep_cores')=='zstd':
+            try:
+                from compression import zstd # py >= 3.14
+            except ImportError:
+                site = True # zstandard package
+        flags = lean_flags(site=site)
+    with open(path, 'w') as F:
+        F.write(dumper_template.format(exe=sys.executable,
+                                       flags=flags,
+                                       cwd=_root_dir,
+                                       outdir=outdir,
+                                       gdb=gdb,
+                                       cmds=extra_cmds,
+                                       opts=''.join(', %s=%r'%KV for KV in sorted(opts.items())),
+                                       ))
+    # executable
+    os.chmod(path, 0o755)
+
+def precompile():
+    'Byte compile this package, so that a crash handler does not have to'
+    import compileall
+    try:
+        return compileall.compile_dir(os.path.dirname(os.path.abspath(__file__)), quiet=1)
+    except (IOError, OSError):
+        return False
+
+def release_core():
+    '''Replace stdin, the core pipe, with /dev/null.  Once no process holds the pipe,
+       the kernel reaps the crashed process, even with a nonzero core_pipe_limit.
+    '''
+    fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(fd, 0)
+    os.close(fd)
+
+def forknpark(fn, release_stdin=False, **kws):
+    '''Run fn(**kws) in a child, and wait for it to exit.
+       With release_stdin, the parent lets go of the core pipe, which the child reads.
+    '''
     sys.stdout.flush()
     sys.stderr.flush()
 
@@ -63,6 +121,8 @@ def forknpark(fn, **kws):
         os._exit(code)
         os.abort() # paranoia
     else: # parent
+        if release_stdin:
+            release_core()
         pid, sts = os.waitpid(pid, 0)
 
         sys.stdout.flush()
@@ -75,16 +135,21 @@ def nsenter(pid, spaces):
     """Join the current process to all of the namespaces
        of the target PID of which it is not already a member.
     """
-    myself = ctypes.CDLL(None)
+    if hasattr(os, 'setns'): # py >= 3.12
+        def setns(F, nstype=0):
+            os.setns(F.fileno(), nstype)
+    else:
+        import ctypes
+        myself = ctypes.CDLL(None, use_errno=True)
 
-    _setns = myself.setns
-    _setns.argtypes = [ctypes.c_int, ctypes.c_int]
-    _setns.restype = ctypes.c_int
+        _setns = myself.setns
+        _setns.argtypes = [ctypes.c_int, ctypes.c_int]
+        _setns.restype = ctypes.c_int
 
-    def setns(F, nstype=0):
-        ret = _setns(F.fileno(), nstype)
-        if ret!=0:
-            raise OSError(ctypes.get_errno())
+        def setns(F, nstype=0):
+            ret = _setns(F.fileno(), nstype)
+            if ret!=0:
+                raise OSError(ctypes.get_errno())
 
     NSs = []
 
@@ -106,6 +171,48 @@ def nsenter(pid, spaces):
         T.close()
         S.close()
 
+def same_namespace(pid, ns):
+    'True if the target PID is a member of the same namespace (eg. "mnt") as this process, or if unknown'
+    try:
+        A, B = os.stat('/proc/%d/ns/%s'%(pid, ns)), os.stat('/proc/self/ns/%s'%ns)
+    except OSError:
+        return True
+    return (A.st_dev, A.st_ino)==(B.st_dev, B.st_ino)
+
+# from linux/memfd.h and linux/fcntl.h
+MFD_CLOEXEC = 1
+MFD_ALLOW_SEALING = 2
+F_ADD_SEALS = 1033
+F_SEAL_ALL = 0xf # SEAL | SHRINK | GROW | WRITE
+
+def memfd_create(name):
+    '''Anonymous, memory backed, file which may be sealed.
+       Returns fd, or None if not supported.
+    '''
+    flags = MFD_CLOEXEC|MFD_ALLOW_SEALING
+    if hasattr(os, 'memfd_create'): # py >= 3.8
+        try:
+            return os.memfd_create(name, flags)
+        except OSError:
+            return None
+    import ctypes
+    myself = ctypes.CDLL(None, use_errno=True)
+    _memfd_create = getattr(myself, 'memfd_create', None) # glibc >= 2.27
+    if _memfd_create is None:
+        return None
+    _memfd_create.argtypes = [ctypes.c_char_p, ctypes.c_uint]
+    _memfd_create.restype = ctypes.c_int
+    fd = _memfd_create(name.encode(), flags)
+    return None if fd<0 else fd
+
+def seal(fd):
+    'Prevent further changes to a memfd.  Returns True if sealed'
+    try:
+        fcntl.fcntl(fd, F_ADD_SEALS, F_SEAL_ALL)
+        return True
+    except (IOError, OSError):
+        return False
+
 def read_uid_gid(pid):
     'Detect UID/GID of target PID'
     res = os.stat('/proc/{}/status'.format(pid))
@@ -124,14 +231,38 @@ def readenv(pid):
     return env
 
 class FLock(object):
-    def __init__(self, file):
+    '''With release=False, the lock is instead held until all copies
+       of the file descriptor (eg. in a detached child) are closed.
+    '''
+    def __init__(self, file, release=True):
         self._file = file
+        self._release = release
     def __enter__(self):
         fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
     def __exit__(self,A,B,C):
         self._file.flush()
         os.fsync(self._file.fileno())
-        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        if self._release:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+def detach_child():
+    '''Fork a child which continues after the parent returns, and exits.
+       Returns True in the child.
+    '''
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    pid = os.fork()
+    if pid!=0: # parent
+        print('Analysis continues in detached PID %d'%pid)
+        return False
+
+    os.setsid()
+    # release the core pipe
+    null = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null, 0)
+    os.close(null)
+    return True
 
 def syncfd(F):
     '''dump() writes only once, so it is enough to cycle through the write lock
@@ -179,25 +310,29 @@ class LinuxDumper(CommonDumper):
         with open(os.path.join(self.args.outdir, 'core_pattern'), 'w') as F:
             F.write(current)
 
+        self.mkdirs(os.path.join(self.args.outdir, 'slots'))
+        self.set_pipe_limit()
+        if self.args.defer_analysis:
+            self.mkdir_pending()
+        if self.args.store_files:
+            from .store import STORE
+            self.mkdirs(os.path.join(self.args.outdir, STORE))
+
+        opts = self.dump_opts()
+        opts.update(self.elf_index())
+
         dumper = os.path.join(self.args.outdir, 'dumper.py')
-        with open(dumper, 'w') as F:
-            F.write('''#!{sys.executable}
-import sys
-sys.path.append(r'{cwd}')
-from ci_core_dumper.linux import dump
-dump(outdir=r'{args.outdir}', gdb=r'{args.debugger}', extra_cmds={cmds!r})
-'''.format(sys=sys,
-           args=self.args,
-           cwd=_root_dir,
-           cmds=self.args.gdb_cmds.split(';'),
-           ))
+        write_handler(dumper, self.args.outdir, self.args.debugger, self.args.gdb_cmds.split(';'), opts)
+        if not precompile():
+            _log.warning('Unable to byte compile %s.  Crash handling will be slower', os.path.dirname(__file__))
 
-        # executable
-        os.chmod(dumper, 0o755)
+        handler = dumper
+        if self.args.daemon:
+            handler = self.install_daemon(dumper, opts)
 
         try:
             with open(core_pattern, 'w') as F:
-                F.write('|{} %p %P %t'.format(dumper))
+                F.write('|{} %p %P %t'.format(handler))
         except IOError as e:
             if e.errno==errno.EACCES:
                 _log.error('Insufficient permission to open "{}".  sudo?'.format(core_pattern))
@@ -207,9 +342,168 @@ dump(outdir=r'{args.outdir}', gdb=r'{args.debugger}', extra_cmds={cmds!r})
                 return # soft-fail
             raise
 
+    def dump_opts(self):
+        'Extra keyword arguments to be passed to dump()'
+        return dict(
+            sparse=self.args.core_copy=='sparse',
+            keep_cores=self.keep_cores(),
+            max_analyses=self.args.max_analyses or sched.default_slots(),
+            detach=self.args.detach,
+            defer=self.defer_analysis(),
+            store_files=self.store_files(),
+            rate_limit=self.rate_limit(),
+            quota=self.quota(),
+            staging=dict(mode=self.args.core_staging, max=self.args.memfd_max),
+            unwind_workers=self.args.unwind_workers or sched.cpu_count(),
+            core_mode=self.args.core_mode,
+            analyzers=self.analyzers(),
+            limits=dict(timeout=self.args.analysis_timeout,
+                        max_output=self.args.max_output<<20,
+                        frames=self.args.max_frames,
+                        depth=self.args.thread_frames),
+        )
+
+    def analyzers(self, arg=None):
+        'Debugger preference list, from --analyzer, or arg'
+        names = []
+        for name in (arg or self.args.analyzers).split(','):
+            name = name.strip()
+            if name in ANALYZERS:
+                names.append(name)
+            elif name:
+                _log.error('Unknown analyzer "%s" ignored.  Choose from: %s', name, ', '.join(sorted(ANALYZERS)))
+        return names or ['gdb']
+
+    def defer_analysis(self):
+        if self.args.defer_analysis and os.open not in getattr(os, 'supports_dir_fd', ()):
+            _log.error('Deferred analysis not supported by this python.  Continuing without.')
+            return False
+        return self.args.defer_analysis
+
+    def elf_index(self):
+        '''Index the ELF files of the build tree (working directory) for GDB.
+           Returns extra keyword arguments for dump()
+        '''
+        if self.args.elf_index=='none':
+            return {}
+        from . import elfindex
+        tool = None
+        if self.args.elf_index=='gdb-index':
+            tool = find_executable('gdb-add-index')
+            if tool is None:
+                _log.error('gdb-add-index not found.  Only existing indexes will be used.')
+        T0 = _now()
+        try:
+            elfindex.scan(os.getcwd(), self.args.outdir, gdb_index=tool, log=_log.info)
+        except Exception:
+            _log.exception('Unable to index %s', os.getcwd())
+            return dict(index_cache=True) # soft-fail
+        _log.info('Indexing took %.3f s', _now()-T0)
+        return dict(debugdirs=[os.path.join(self.args.outdir, elfindex.DEBUG), elfindex.SYSTEM_DEBUG],
+                    index_cache=True)
+
+    def rate_limit(self):
+        'Options for sched.RateLimit, or None'
+        if self.args.rate_limit<=0:
+            return None
+        return dict(burst=self.args.rate_limit, window=self.args.rate_window, by=self.args.rate_key)
+
+    def quota(self):
+        'Options for quota.Quota, or None'
+        if not (self.args.quota_size or self.args.quota_files or self.args.min_free):
+            return None
+        return dict(max_bytes=self.args.quota_size, max_files=self.args.quota_files, min_free=self.args.min_free)
+
+    def store_files(self):
+        if not self.args.store_files:
+            return False
+        elif os.open not in getattr(os, 'supports_dir_fd', ()):
+            _log.error('Storing files not supported by this python.  Continuing without.')
+            return False
+        if self.args.keep_cores=='none':
+            _log.warning('reanalyze requires cores kept with --keep-cores')
+        return True
+
+    def mkdir_pending(self):
+        '''Deferred cores are saved here, and analyzed, then removed by report
+           which may not be run as root.
+        '''
+        pending = os.path.join(self.args.outdir, 'pending')
+        self.mkdirs(pending)
+        # we have been run through sudo
+        if 'SUDO_UID' in os.environ:
+            os.chown(pending, int(os.environ['SUDO_UID']), int(os.environ['SUDO_GID']))
+
+    def set_pipe_limit(self):
+        '''Set the number of concurrent core_pattern handlers, if --core-pipe-limit is given.
+           The kernel will keep /proc/<pid> valid until the handler closes the core pipe,
+           which dump() does once the core is captured.
+        '''
+        if self.args.core_pipe_limit is None:
+            return
+        try:
+            current = sched.read_pipe_limit()
+            with open(os.path.join(self.args.outdir, 'core_pipe_limit'), 'w') as F:
+                F.write('%d\n'%current)
+            with open(sched.core_pipe_limit, 'w') as F:
+                F.write('%d\n'%self.args.core_pipe_limit)
+            _log.debug('core_pipe_limit %d -> %d', current, self.args.core_pipe_limit)
+        except IOError as e:
+            if e.errno in (errno.EACCES, errno.EROFS, errno.ENOENT):
+                _log.error('Unable to set "{}" : {}'.format(sched.core_pipe_limit, e))
+                return # soft-fail
+            raise
+
+    def install_daemon(self, dumper, opts):
+        '''Start daemon and write the client for it.
+           Returns path of core_pattern handler to use.
+        '''
+        from . import daemon
+
+        if not daemon.supported():
+            _log.error('Analysis daemon not supported by this python.  Continuing without.')
+            return dumper
+
+        # options for dump() when called by daemon
+        with open(os.path.join(self.args.outdir, daemon.OPTIONS), 'w') as F:
+            json.dump(dict(outdir=self.args.outdir,
+                           gdb='%s'%self.args.debugger,
+                           extra_cmds=self.args.gdb_cmds.split(';'),
+                           **opts), F, indent=1)
+
+        daemon.stop(self.args.outdir) # previous instance
+        self.daemon()
+
+        client = os.path.join(self.args.outdir, 'client.py')
+        with open(client, 'w') as F:
+            F.write(daemon.client_template.format(exe=sys.executable, flags=lean_flags(),
+                                                  sock=os.path.join(self.args.outdir, daemon.SOCKET),
+                                                  dumper=dumper))
+        os.chmod(client, 0o755)
+        return client
+
+    def daemon(self):
+        self.sudo()
+        from . import daemon
+        daemon.serve(self.args.outdir)
+        _log.info('Started analysis daemon')
+
+    def keep_cores(self):
+        codec = self.args.keep_cores
+        if codec=='none':
+            return None
+        elif not have_codec(codec):
+            _log.error('Compression codec %s not available.  Cores will not be kept.', codec)
+            return None
+        return codec
+
     def uninstall(self):
         self.sudo()
 
+        from . import daemon
+        if daemon.stop(self.args.outdir):
+            _log.info('Stopped analysis daemon')
+
         save = os.path.join(self.args.outdir, 'core_pattern')
         try:
             with open(save, 'r') as F:
@@ -231,17 +525,332 @@ dump(outdir=r'{args.outdir}', gdb=r'{args.debugger}', extra_cmds={cmds!r})
 
         os.remove(save)
 
+        save = os.path.join(self.args.outdir, 'core_pipe_limit')
+        try:
+            with open(save, 'r') as F:
+                current = F.read()
+            with open(sched.core_pipe_limit, 'w') as F:
+                F.write(current)
+            os.remove(save)
+        except IOError as e:
+            if e.errno!=errno.ENOENT:
+                _log.error('Unable to restore "{}" : {}'.format(sched.core_pipe_limit, e))
+
     def report(self):
-        for log in glob(os.path.join(self.args.outdir, '*.txt')):
-            self.error(log)
-            self.catfile(log, sync=syncfd)
+        from glob import glob
+        from . import buckets
+        # every log in full, as each deferred analysis completes
+        stream = self.args.all and self.args.format=='text' and not self.args.merge_tree
+        shown = set()
+
+        # analyze deferred cores in parallel
+        pending = glob(os.path.join(self.args.outdir, 'pending', '*'))
+        if pending:
+            import multiprocessing
+            pool = multiprocessing.Pool(min(len(pending), sched.cpu_count()))
+            try:
+                # cores of the same executable, and libraries, share one GDB
+                groups, order = {}, []
+                for entry, key in pool.imap(batch_key, sorted(pending)):
+                    key = key or entry
+                    if key not in groups:
+                        groups[key] = []
+                        order.append(key)
+                    groups[key].append(entry)
+                _log.info('Analyzing %d deferred cores in %d groups', len(pending), len(order))
+                for logs in pool.imap_unordered(analyze_batch, [groups[key] for key in order]):
+                    for log in logs:
+                        shown.add(log)
+                        if stream:
+                            self.show(log)
+                        else:
+                            _log.info('Analyzed %s', log)
+            finally:
+                pool.close()
+                pool.join()
+
+        logs = sorted(glob(os.path.join(self.args.outdir, '*.txt')))
+        if stream:
+            for log in logs:
+                if log not in shown:
+                    self.show(log)
+            return
+
+        records = [self.load_record(log) for log in logs]
+        if records:
+            self.exit = max(self.exit, 1)
+
+        if self.args.merge_tree:
+            self.merge_tree(records)
+            return
+
+        index = buckets.Index(self.args.outdir).update(records, depth=self.args.signature_frames)
+
+        # metadata only.  Not shown in full
+        limited = [R['log'] for R in records if R.get('status')==record.LIMITED]
+        nospace = [R['log'] for R in records if R.get('status')==record.NOSPACE]
+        ratelimit = self.ratelimit_state()
+
+        # group by signature, in order of first occurrence
+        groups, order = {}, []
+        for R in records:
+            if R.get('status') in (record.LIMITED, record.NOSPACE):
+                continue
+            key = R.get('signature') or R['log'] # each unrecorded log alone
+            if key not in groups:
+                groups[key] = []
+                order.append(key)
+            groups[key].append(R)
+
+        if self.args.format=='json':
+            json.dump(dict(format=record.FORMAT, outdir=self.args.outdir, crashes=records,
+                           buckets=[dict(signature=key, frames=index[key][0]['frames'], seen=len(index[key]),
+                                         logs=[R['log'] for R in groups[key]])
+                                    for key in order if key in index],
+                           ratelimit=dict(keys=ratelimit, logs=limited), nospace=nospace),
+                      sys.stdout, indent=1, sort_keys=True)
+            sys.stdout.write('\n')
+            return
+
+        for key in order:
+            G = groups[key]
+            log = os.path.join(self.args.outdir, G[0]['log'])
+            if key not in index:
+                self.show(log)
+                continue
+            self.error('%s  signature %s: %s  (%d in this report, %d seen)'%(log, key,
+                       ' '.join(index[key][0]['frames']), len(G), len(index[key])))
+            self.catfile(log) # already synced
+            if len(G)>1:
+                sys.stdout.write('Same signature: %s\n'%' '.join(R['log'] for R in G[1:]))
+
+        if limited:
+            self.error('%d crashes rate limited, metadata only'%len(limited))
+            for key, E in sorted(ratelimit.items()):
+                if E['skipped']:
+                    sys.stdout.write('  %s  %d analyzed, %d skipped\n'%(key, E['analyzed'], E['skipped']))
+            sys.stdout.write('Logs: %s\n'%' '.join(limited))
+
+        if nospace:
+            self.error('%d crashes without space for a core file, metadata only'%len(nospace))
+            sys.stdout.write('Logs: %s\n'%' '.join(nospace))
+
+    def ratelimit_state(self):
+        'Counters of analyzed, and skipped, crashes for each rate limit key'
+        try:
+            with open(os.path.join(self.args.outdir, sched.RATELIMIT), 'r') as F:
+                return sched.read_ratelimit(F)
+        except IOError:
+            return {}
+
+    def merge_tree(self, records):
+        'Print a merged call tree for each group of crashes close in time'
+        from . import mergetree
+        groups = []
+        for W in mergetree.windows(records, window=self.args.window):
+            groups.append(dict(start=W[0].get('time'), end=W[-1].get('time'), logs=[R['log'] for R in W],
+                               tree=mergetree.build(W)))
+
+        if self.args.format=='json':
+            for G in groups:
+                G['tree'] = G['tree'].todict()
+            json.dump(dict(format=record.FORMAT, outdir=self.args.outdir, windows=groups),
+                      sys.stdout, indent=1, sort_keys=True)
+            sys.stdout.write('\n')
+            return
+
+        for G in groups:
+            self.error('%d crashes from %s to %s'%(len(G['logs']), time.ctime(G['start'] or 0), time.ctime(G['end'] or 0)))
+            sys.stdout.write('Logs: %s\n'%' '.join(G['logs']))
+            G['tree'].render(lambda line: sys.stdout.write(line+'\n'))
+
+    def reanalyze(self):
+        'Run GDB again on kept cores, with the executable and libraries from the store'
+        import shutil
+        import tempfile
+        import subprocess as SP
+        from glob import glob
+        from . import store, elfindex
+        storedir = os.path.abspath(os.path.join(self.args.outdir, store.STORE))
+        if self.args.logs:
+            # <time>.<pid>.txt, or .json, or .core.gz, ...
+            ids = ['.'.join(os.path.basename(L).split('.')[:2]) for L in self.args.logs]
+        else:
+            ids = sorted(set('.'.join(os.path.basename(C).split('.')[:2])
+                             for C in glob(os.path.join(self.args.outdir, '*.core*'))))
+
+        analyzer = find_analyzer(['gdb'], gdb=self.args.debugger)
+        if analyzer is None:
+            _log.error('GDB not found')
+            self.exit = 1
+            return
+
+        for ident in ids:
+            cores = glob(os.path.join(self.args.outdir, ident+'.core*'))
+            try:
+                rec = record.load(os.path.join(self.args.outdir, ident+'.json'))
+            except (IOError, ValueError):
+                rec = {}
+            if not cores:
+                self.error('%s no core kept.  (install --keep-cores)'%ident)
+                continue
+            elif not rec.get('modules'):
+                self.error('%s no files stored.  (install --store-files)'%ident)
+                continue
+
+            tmp = tempfile.mkdtemp(prefix='ccd-reanalyze-')
+            try:
+                root = os.path.join(tmp, 'root')
+                for M in store.sysroot(storedir, rec['modules'], root):
+                    _log.warning('%s missing from store', M['path'])
+
+                corefile = cores[0]
+                for codec, ext in CODECS.items():
+                    if corefile.endswith(ext):
+                        corefile = os.path.join(tmp, 'core')
+                        with open(cores[0], 'rb') as IF, decompressor(codec, IF) as DF, open(corefile, 'wb') as OF:
+                            expand(DF, OF)
+
+                cmd = analyzer.command(root+rec['exe'], corefile, [C for C in self.args.gdb_cmds.split(';') if C], sysroot=root,
+                                       debugdirs=[storedir, os.path.join(self.args.outdir, elfindex.DEBUG),
+                                                  elfindex.SYSTEM_DEBUG], index_cache=True)
+                _log.debug('exec: %s', cmd)
+                self.error(ident)
+                sys.stdout.write('==== BEGIN: reanalyze {} ====\n'.format(ident))
+                sys.stdout.flush()
+                code = SP.call(cmd)
+                sys.stdout.write('==== END: reanalyze {} ====\n'.format(ident))
+                if code:
+                    _log.error('%s exits with %d', analyzer.name, code)
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+    def show(self, log):
+        self.error(log)
+        self.catfile(log, sync=syncfd)
+
+    def load_record(self, log):
+        'Crash record of log, once complete'
+        with open(log, 'r') as F:
+            syncfd(F) # the log is complete after the record
+        try:
+            return record.load(log[:-4]+'.json')
+        except (IOError, ValueError):
+            return dict(format=record.FORMAT, log=os.path.basename(log), status=None) # no record
 
     def doexec(self):
+        import resource
         # raise core file limit for self and child
         S, H = resource.getrlimit(resource.RLIMIT_CORE)
         resource.setrlimit(resource.RLIMIT_CORE, (H, H))
         _log.debug('adjust ulimit -c%d', H)
-        CommonDumper.doexec(self)
+        if not (self.args.profile or self.args.timeout or self.args.cgroup):
+            CommonDumper.doexec(self)
+            return
+
+        import subprocess as SP
+        from . import profile, hang
+        prof = None
+        if self.args.profile:
+            analyzer = None
+            if self.args.profile_mode=='stack':
+                analyzer = find_analyzer(self.analyzers(self.args.profile_analyzer))
+                if analyzer is None:
+                    _log.error('None of %s found.  Profile with --profile-mode=wchan', self.args.profile_analyzer)
+            prof = profile.Profiler(self.args.profile, analyzer=analyzer, overhead=self.args.profile_overhead/100.0)
+
+        analyzer = None
+        if self.args.timeout:
+            analyzer = find_analyzer(self.analyzers(), gdb=self.args.debugger)
+            if analyzer is None:
+                _log.error('None of %s found.  No backtraces on timeout', self.args.analyzers)
+
+        cmd = [self.findbin(self.args.command)] + self.args.args
+        _log.debug('EXEC %s', cmd)
+        now = int(time.time())
+
+        cg = None
+        if self.args.cgroup:
+            from . import cgroup
+            try:
+                cg = cgroup.CGroup.create('ccd-exec-%d'%os.getpid())
+                _log.debug('cgroup %s', cg.path)
+            except (IOError, OSError) as e:
+                _log.error('Unable to create cgroup: %s.  No resource accounting', e)
+
+        hooks = []
+        if analyzer or (prof and prof.analyzer):
+            hooks.append(profile.allow_ptrace)
+            scope = profile.ptrace_scope()
+            if scope>=1 and os.geteuid()!=0:
+                _log.warning('Yama ptrace_scope=%d.  Child processes of %s can not be attached by a debugger'
+                             ' without CAP_SYS_PTRACE', scope, self.args.command)
+        if cg is not None:
+            hooks.append(cg.enter)
+        def preexec():
+            for H in hooks:
+                H()
+
+        deadline = _now()+self.args.timeout if self.args.timeout else None
+        T0 = _now()
+        try:
+            P = SP.Popen(cmd, preexec_fn=preexec if hooks else None)
+        except (OSError, RuntimeError) as e:
+            if cg is None:
+                raise
+            # not yet exec'd.  eg. not permitted to move into the cgroup
+            _log.error('Unable to enter cgroup %s: %s.  No resource accounting', cg.path, e)
+            hooks.remove(cg.enter)
+            cg.remove()
+            cg = None
+            P = SP.Popen(cmd, preexec_fn=preexec if hooks else None)
+        try:
+            if prof is not None:
+                code = prof.run(P, deadline)
+            else:
+                code = hang.wait(P, deadline)
+            expired = code is None
+            if expired:
+                self.mkdirs(self.args.outdir)
+                code = hang.expire(P, self.args.outdir, analyzer, self.args.timeout, ' '.join(cmd),
+                                   core=self.args.timeout_core)
+        except:
+            P.kill()
+            P.wait()
+            raise
+
+        elapsed = _now()-T0
+
+        ident = '%d.%d'%(now, P.pid)
+        if cg is not None:
+            if expired:
+                cg.kill() # also any processes which left the tree
+            R = cg.resources()
+            cg.remove()
+            _log.info('%s: %s', self.args.command, cgroup.summary(R))
+            out = os.path.join(self.args.outdir, ident+'.exec.json')
+            try:
+                self.mkdirs(self.args.outdir)
+                with open(out, 'w') as F:
+                    json.dump(dict(format=record.FORMAT, time=now, pid=P.pid, cmdline=cmd, code=code,
+                                   elapsed=elapsed, resources=R), F, indent=1, sort_keys=True)
+                    F.write('\n')
+                if R['oom_kill']:
+                    _log.error('%d processes killed by the OOM killer.  See %s',
+                               R['oom_kill'], cgroup.write_oom(self.args.outdir, ident, R, cmd, code))
+            except (IOError, OSError):
+                _log.exception('Unable to write %s', out)
+
+        if prof is not None:
+            out = os.path.join(self.args.outdir, ident+'.folded')
+            try:
+                self.mkdirs(self.args.outdir)
+                prof.write(out)
+                _log.info('Profile of %s in %s', self.args.command, out)
+                _log.info('%s', prof.summary())
+            except (IOError, OSError):
+                _log.exception('Unable to write profile %s', out)
+        sys.exit(code)
 
     def fix_parent(self):
         '''Attempt to adjust core dump limits of parent so that
@@ -250,6 +859,7 @@ dump(outdir=r'{args.outdir}', gdb=r'{args.debugger}', extra_cmds={cmds!r})
            Allow us to "just work" even if caller has forgotten to raise
            the core limit, and doesn't use our 'exec' sub-command.
         '''
+        import resource
         if not hasattr(resource, 'prlimit'):
             return # py < 3.4
         try:
@@ -264,6 +874,7 @@ dump(outdir=r'{args.outdir}', gdb=r'{args.debugger}', extra_cmds={cmds!r})
     def sudo(self):
         '''re-exec myself w/ sudo
         '''
+        import subprocess as SP
         who = os.geteuid()
         _log.info('IAM %d', who)
         if os.geteuid()==0:
@@ -282,56 +893,364 @@ dump(outdir=r'{args.outdir}', gdb=r'{args.debugger}', extra_cmds={cmds!r})
         if ret==0:
             sys.exit(0)
 
-def dump(outdir, gdb, extra_cmds):
+def dump(outdir, gdb, extra_cmds, sparse=True, keep_cores=None, max_analyses=None, detach=False,
+         defer=False, core_mode='full', analyzers=('gdb',), limits=None, store_files=False,
+         debugdirs=(), index_cache=False, rate_limit=None, quota=None, staging=None, unwind_workers=1,
+         argv=None):
     # running as root in init namespaces (not container)
     # core file open as stdin
 
     os.umask(0o022)
 
     # PID in target namespace, PID in init namespace, time of dump (POSIX)
-    tpid, ipid, dtime = int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3])
+    # from core_pattern arguments, or passed through by daemon
+    tpid, ipid, dtime = [int(arg) for arg in (argv or sys.argv[1:4])]
 
     logfile  = os.path.join(outdir, '{}.{}.txt' .format(dtime, ipid))
 
     # Open output file for this analysis, lock output against later syncfd(),
     # and cause stdout/err to be redirected to it.  (saves us the bother of
     # redirecting later)
-    with open(logfile, 'w') as LOG, FLock(LOG), InstallStdIO(LOG):
+    # When detached, the lock is held until the analysis child exits.
+    with open(logfile, 'w') as LOG, FLock(LOG, release=not detach), InstallStdIO(LOG):
         print('Dumping PID %d (%d) @ %d %s'%(tpid, ipid, dtime, time.ctime(dtime)))
 
         try:
+            space = None
+            if quota:
+                # evict old crashes, or capture less, before anything is written
+                from . import quota as Q
+                full, reduced = Q.estimate(ipid, sparse=sparse)
+                mode, _evicted = Q.Quota(outdir, **quota).reserve(
+                    Q.tiers(full, reduced, Q.METADATA, keep=bool(keep_cores), defer=defer, core_mode=core_mode),
+                    protect=('{}.{}'.format(dtime, ipid),))
+                if mode=='stack' and (keep_cores or core_mode=='full'):
+                    print('Insufficient space in %s.  Reduced core, not kept'%outdir)
+                    keep_cores, core_mode = None, 'stack'
+                elif mode not in ('capture', 'stack'):
+                    print('Insufficient space in %s.  Metadata only'%outdir)
+                    keep_cores = defer = store_files = False
+                space = dict(full=full, stack=reduced, min_free=quota.get('min_free') or 0,
+                             metadata=mode not in ('capture', 'stack'))
+
+            keep = None
+            if keep_cores:
+                # opened from init mount namespace
+                keep = open(os.path.join(outdir, '{}.{}.core{}'.format(dtime, ipid, CODECS[keep_cores])), 'wb')
+
+            pending = None
+            if defer:
+                # save files for later analysis by report()
+                pdir = os.path.join(outdir, 'pending', '{}.{}'.format(dtime, ipid))
+                os.mkdir(pdir)
+                owner = os.stat(os.path.dirname(pdir))
+                os.chown(pdir, owner.st_uid, owner.st_gid)
+                pending = os.open(pdir, os.O_RDONLY)
+
+            storedir = None
+            if store_files:
+                # opened from init mount namespace
+                from .store import STORE
+                storedir = os.open(os.path.join(outdir, STORE), os.O_RDONLY)
+
+            # machine readable summary, completed by dump2()
+            REC = open(os.path.join(outdir, '{}.{}.json'.format(dtime, ipid)), 'w')
+            rec = dict(format=record.FORMAT, time=dtime, pid=tpid, ipid=ipid,
+                       log=os.path.basename(logfile), status=record.FAILED, timings={})
+            record.save(REC, rec)
+
+            ratelimit = None
+            if rate_limit:
+                ratelimit = sched.RateLimit(open(os.path.join(outdir, sched.RATELIMIT), 'a+'), **rate_limit)
+
+            slots = queue = None
+            if max_analyses and not defer:
+                sdir = os.path.join(outdir, 'slots')
+                slots = sched.Slots(sdir, 'run', max_analyses)
+                limit = sched.read_pipe_limit()
+                if limit:
+                    # as many handlers may wait for a slot as the kernel lets capture at once
+                    queue = sched.Slots(sdir, 'wait', max(0, limit - max_analyses))
+
+            if debugdirs and not same_namespace(ipid, 'mnt'):
+                # install --elf-index links to paths in this mount namespace (eg. not in a container)
+                from .elfindex import DEBUG
+                debugdirs = [D for D in debugdirs if D!=os.path.join(outdir, DEBUG)]
+
             # only need to join mount namespace.
             # also join PID namespace so that target PID can be used.
             nsenter(ipid, ('mnt', 'pid'))
 
             # must fork in order to fully join
-            forknpark(dump2, pid=tpid, gdb=gdb, extra_cmds=extra_cmds)
+            forknpark(dump2_record, release_stdin=True, REC=REC, rec=rec, pid=tpid, gdb=gdb, extra_cmds=extra_cmds, sparse=sparse,
+                      keep_cores=keep_cores, keep=keep, slots=slots, queue=queue,
+                      detach=detach, pending=pending, core_mode=core_mode, analyzers=analyzers,
+                      limits=limits or stacks.DEFAULT_LIMITS, storedir=storedir,
+                      debugdirs=debugdirs, index_cache=index_cache, ratelimit=ratelimit, space=space,
+                      staging=staging, unwind_workers=unwind_workers)
+            REC.close()
+            if keep:
+                keep.close()
+                if os.stat(keep.name).st_size==0:
+                    os.remove(keep.name) # metadata only
+            if pending is not None:
+                os.close(pending)
+                if not os.listdir(pdir):
+                    os.rmdir(pdir) # metadata only
+            if storedir is not None:
+                os.close(storedir)
         except:
             traceback.print_exc()
             sys.exit(1) # not really any point as Linux kernel doesn't seem to do anything with !=0
         else:
-            print('Complete')
+            print('Capture complete' if detach or defer else 'Complete')
+
+def save_files(pid, exe, D):
+    '''Hard link, or copy, the executable and all mapped files of target PID
+       into directory D (fd), preserving paths, as a sysroot for GDB.
+       Returns the list of paths saved.
+    '''
+    from . import store
+    owner = os.fstat(D)
+    paths = store.mapped_files(pid, exe)
+    for path in paths:
+        dest = 'root'+path
+        store.mkdirs_at(os.path.dirname(dest), D, owner)
+        print(store.link_or_copy(path, dest, D, owner), path)
+    return paths
+
+def analyze_pending(entry):
+    '''Run GDB on a deferred core saved by dump2().  Append output to its log.
+       Called from report() through a process pool.  Returns log file name.
+    '''
+    import shutil
+    outdir = os.path.dirname(os.path.dirname(entry))
+    logfile = os.path.join(outdir, os.path.basename(entry)+'.txt')
+
+    with open(logfile, 'a') as LOG, FLock(LOG): # waits for capture to complete
+        if not os.path.isdir(entry):
+            return logfile # analyzed by a concurrent report
 
-def dump2(pid, gdb, extra_cmds):
+        try:
+            with open(os.path.join(entry, 'meta.json'), 'r') as F:
+                meta = json.load(F) # empty until capture completes
+        except (IOError, ValueError) as e:
+            if isinstance(e, IOError) and e.errno!=errno.ENOENT:
+                raise
+            LOG.write('Deferred capture incomplete in %s\n'%entry)
+            return logfile
+
+        prefs = meta.get('analyzers', ['gdb'])
+        analyzer = find_analyzer(prefs, gdb=meta['gdb'])
+        if analyzer is None:
+            LOG.write('ERROR: None of debuggers %s found: %s\n'%(prefs, os.environ.get('PATH')))
+            return logfile
+
+        root = os.path.join(entry, 'root')
+        libdirs = sorted(set(os.path.dirname(root+path) for path in meta['files']))
+        limits = meta.get('limits') or stacks.DEFAULT_LIMITS
+        # frames for the crash record
+        script = os.path.join(entry, 'frames.py')
+        frames = os.path.join(entry, 'frames.json')
+        if not analyzer.write_script(script, frames, frames=limits['frames'], depth=limits['depth']):
+            script = None
+        cmd = analyzer.command(root+meta['exe'], os.path.join(entry, 'core'), meta['extra_cmds'],
+                               sysroot=root, libdirs=libdirs, frames=limits['frames'], depth=limits['depth'],
+                               script=script, debugdirs=meta.get('debugdirs', ()),
+                               index_cache=meta.get('index_cache', False))
+
+        LOG.write('Deferred analysis with %s\nexec: %s\n'%(analyzer, cmd))
+        T0 = _now()
+        out = stacks.run(cmd, LOG, timeout=limits['timeout'], max_output=limits['max_output'],
+                         frames=limits['frames'], depth=limits['depth'], lwp=meta.get('lwp'))
+        pending_done(logfile, LOG, analyzer, out, _now()-T0, frames, root)
+
+    shutil.rmtree(entry, ignore_errors=True)
+    return logfile
+
+def pending_done(logfile, LOG, analyzer, out, elapsed, frames, root):
+    'Complete the log, and crash record, of a deferred analysis'
+    if out.code:
+        LOG.write('ERROR: %s exits with %d\n'%(analyzer.name, out.code))
+    LOG.write('Complete\n')
+
+    recfile = logfile[:-4]+'.json'
+    try:
+        rec = record.load(recfile)
+    except (IOError, ValueError):
+        rec = dict(format=record.FORMAT, log=os.path.basename(logfile), timings={})
+    rec['analyzer'] = analyzer.name
+    rec['timings']['analysis'] = elapsed
+    rec['threads'] = record.threads(dict(threads=rec.get('threads', [])), text=out,
+                                    script=record.load_script_output(frames), sysroot=root)
+    rec['cuts'] = out.cuts
+    rec['status'] = record.COMPLETE if out.code==0 else record.FAILED
+    with open(recfile, 'w') as F:
+        record.save(F, rec)
+
+def batch_key(entry):
+    '''Deferred cores with equal keys may be analyzed by one GDB.
+       Same executable and libraries, by build-id, and same options.
+       Returns (entry, key), with key None if the capture is incomplete.
+    '''
+    from .elfcore import build_id
+    try:
+        with open(os.path.join(entry, 'meta.json'), 'r') as F:
+            meta = json.load(F)
+    except (IOError, ValueError):
+        return entry, None
+    files = []
+    for path in meta['files']:
+        try:
+            with open(os.path.join(entry, 'root')+path, 'rb') as F:
+                st = os.fstat(F.fileno())
+                files.append([path, build_id(F) or '%d:%d'%(st.st_size, st.st_mtime)])
+        except IOError:
+            files.append([path, None])
+    opts = [meta.get(K) for K in ('gdb', 'analyzers', 'extra_cmds', 'limits', 'debugdirs', 'index_cache')]
+    return entry, json.dumps([files, opts], sort_keys=True)
+
+def analyze_batch(entries):
+    '''Run one GDB on several deferred cores, with equal batch_key(),
+       switching between them with core-file so symbols are loaded once.
+       Output for each core is appended to its own log.
+       Called from report() through a process pool.  Returns list of log file names.
+    '''
+    import shutil
+    if len(entries)==1:
+        return [analyze_pending(entries[0])]
+
+    outdir = os.path.dirname(os.path.dirname(entries[0]))
+    logs, metas, others = [], [], []
+    try:
+        for entry in sorted(entries): # consistent lock order
+            LOG = open(os.path.join(outdir, os.path.basename(entry)+'.txt'), 'a')
+            fcntl.flock(LOG.fileno(), fcntl.LOCK_EX) # waits for capture to complete
+            try:
+                with open(os.path.join(entry, 'meta.json'), 'r') as F:
+                    metas.append((entry, LOG, json.load(F)))
+            except (IOError, ValueError):
+                LOG.close() # analyzed by a concurrent report, or incomplete
+                others.append(entry)
+
+        meta = metas[0][2] if metas else {}
+        analyzer = find_analyzer(meta.get('analyzers', ['gdb']), gdb=meta.get('gdb'))
+        if len(metas)<2 or not isinstance(analyzer, GDB):
+            # nothing to share
+            for entry, LOG, _meta in metas:
+                LOG.close()
+                others.append(entry)
+            metas = []
+            return [analyze_pending(entry) for entry in others]
+
+        root = os.path.join(metas[0][0], 'root')
+        libdirs = sorted(set(os.path.dirname(root+path) for path in meta['files']))
+        limits = meta.get('limits') or stacks.DEFAULT_LIMITS
+        cores = []
+        for entry, LOG, M in metas:
+            # frames for the crash record
+            script = os.path.join(entry, 'frames.py')
+            analyzer.write_script(script, os.path.join(entry, 'frames.json'), frames=limits['frames'], depth=limits['depth'])
+            cores.append((entry, os.path.join(entry, 'core'), script))
+        cmd = analyzer.batch(os.path.join(metas[0][0], 'batch.py'), root+meta['exe'], cores, meta['extra_cmds'],
+                             sysroot=root, libdirs=libdirs, frames=limits['frames'], depth=limits['depth'],
+                             debugdirs=meta.get('debugdirs', ()), index_cache=meta.get('index_cache', False))
+
+        for entry, LOG, M in metas:
+            LOG.write('Deferred analysis with %s, one of %d cores of %s\nexec: %s\n'%(analyzer, len(metas), meta['exe'], cmd))
+        outs = stacks.run_batch(cmd, analyzer.batch_mark, [(entry, LOG, M.get('lwp')) for entry, LOG, M in metas],
+                                timeout=limits['timeout'] and limits['timeout']*len(metas),
+                                max_output=limits['max_output'], frames=limits['frames'], depth=limits['depth'])
+        for entry, LOG, M in metas:
+            out = outs[entry]
+            pending_done(LOG.name, LOG, analyzer, out, out.elapsed, os.path.join(entry, 'frames.json'), root)
+            logs.append(LOG.name)
+        logs.extend(analyze_pending(entry) for entry in others)
+    finally:
+        for _entry, LOG, _meta in metas:
+            if not LOG.closed:
+                LOG.flush()
+                os.fsync(LOG.fileno())
+                LOG.close()
+
+    for entry, _LOG, _meta in metas:
+        shutil.rmtree(entry, ignore_errors=True)
+    return logs
+
+def wait_slot(slots, queue, want=1):
+    '''Wait until one of a limited number of analysis slots is available.
+       Then take up to want-1 more, if free, for debuggers run in parallel.
+       The slots are held until this process, and the debuggers it runs, exit.
+       Returns the number of slots held, or 0 if too many handlers are already waiting.
+    '''
+    T0 = time.time()
+    n = slots.try_acquire()
+    if n is None:
+        if queue is not None:
+            if queue.try_acquire() is None:
+                print('Analysis queue full.  %d running, %d waiting (core_pipe_limit)'%(len(slots), len(queue)))
+                return 0
+        print('Waiting for one of %d analysis slots'%len(slots))
+        sys.stdout.flush()
+        n = slots.acquire()
+    if queue is not None:
+        queue.close()
+
+    print('Waited %.3f s for analysis slot %d of %d'%(time.time()-T0, n, len(slots)))
+    held = [n]
+    while len(held)<want:
+        n = slots.try_acquire(held)
+        if n is None:
+            break
+        held.append(n)
+    if len(held)>1:
+        print('Holding %d analysis slots'%len(held))
+    for F in slots.keep(*held):
+        set_inheritable(F.fileno(), True)
+    return len(held)
+
+def drain(rec, status=record.LIMITED):
+    'Read, and discard, the core file.  Recording only the signal'
+    parser = CoreParser()
+    S = capture(sys.stdin, None, tees=[parser])
+    release_core()
+    rec['timings']['capture'] = S.elapsed
+    rec.update((K, V) for K, V in parser.summary().items() if K!='threads')
+    rec['status'] = status
+    rec.pop('analyzer', None)
+
+def dump2_record(REC, rec, **kws):
+    '''Run dump2(), then save the crash record to file REC, however it ends.
+       When detached, saved first by the parent, then again by the analysis child.
+    '''
+    T0 = _now()
+    try:
+        dump2(rec=rec, **kws)
+    finally:
+        rec['timings']['total'] = _now()-T0
+        record.save(REC, rec)
+
+def dump2(pid, gdb, extra_cmds, sparse=True, keep_cores=None, keep=None, slots=None, queue=None,
+          detach=False, pending=None, core_mode='full', analyzers=('gdb',), limits=stacks.DEFAULT_LIMITS,
+          storedir=None, debugdirs=(), index_cache=False, ratelimit=None, space=None, staging=None,
+          unwind_workers=1, rec=None):
     # running as root, fully in the target/container namespaces
+    if rec is None:
+        rec = dict(timings={})
 
-    # assume target process identity
-    # must have mappable uid/gid when/if overlayfs is in used, or it will EOVERFLOW all over us.
     uid, gid = read_uid_gid(pid)
-    os.setgid(gid)
-    os.setuid(uid)
-
-    print('Target UID %s/%s'%(uid, gid))
 
     env = readenv(pid)
 
-    for gname in (gdb, 'gdb'):
-        gdb = find_executable(gname, path=env.get('PATH') or '')
-        if gdb:
-            break
-    else:
-        print('ERROR: Debugger %s executable not found in target NS: %s'%(gdb, env.get('PATH')))
-        sys.exit(1)
+    analyzer = None
+    if pending is None:
+        analyzer = find_analyzer(analyzers, path=env.get('PATH') or '', gdb=gdb)
+        if analyzer is None:
+            print('ERROR: None of debuggers %s found in target NS: %s'%(list(analyzers), env.get('PATH')))
+            # continue for triage
+        else:
+            print('Analyzer: %s'%analyzer)
+            rec['analyzer'] = analyzer.name
 
     # inspect the target process
     exe = os.readlink('/proc/{}/exe'.format(pid))
@@ -340,51 +1259,258 @@ def dump2(pid, gdb, extra_cmds):
     cmdline.pop() # result of final nil
 
     print('EXE: {}\nCMDLINE: {}'.format(exe, cmdline))
+    rec.update(exe=exe, cmdline=cmdline, uid=uid, gid=gid)
 
-    # write the core file into some temporary storage in the target mount NS
-    for tmpdir in ('/tmp', '/var/tmp', '/dev/shm'):
-        corefile = os.path.join(tmpdir, 'core.ccd.%d'%pid)
-        assert not os.path.exists(corefile), corefile
-        try:
-            OF = open(corefile, 'wb')
-            break
-        except Exception as e:
-            print('Unable to write core file to %s : %r'%(corefile, e))
-            continue
-    else:
-        print('Unable to store core file in target FS')
-        for path in ('/proc/{}/mountinfo', '/proc/{}/status', '/proc/{}/uid_map', '/proc/{}/gid_map'):
-            with open(path.format(pid), 'r') as F:
-                print('#', F.name)
-                for L in F.readlines():
-                    print('  ', L.rstrip())
-        sys.exit(1)
+    if ratelimit is not None and ratelimit.by=='exe':
+        allowed, state = ratelimit.take(exe)
+        if not allowed:
+            print('Rate limited.  %d crashes of %s skipped.  Metadata only'%(state['skipped'], exe))
+            drain(rec)
+            return
+
+    if space is not None and space['metadata']:
+        drain(rec, record.NOSPACE)
+        return
+
+    if detach:
+        # once capture completes, /proc/<pid> will disappear before analysis.
+        # the environment is already saved for the debugger.
+        with open('/proc/{}/maps'.format(pid), 'r') as F:
+            print('# MAPS')
+            for L in F:
+                print('  ', L.rstrip())
+
+    OF = None
+    if pending is not None:
+        # while still root, save everything needed for later analysis by report()
+        files = save_files(pid, exe, pending)
+        owner = os.fstat(pending)
+
+        # written after capture, when the faulting thread is known
+        fd = os.open('meta.json', os.O_WRONLY|os.O_CREAT|os.O_EXCL, 0o644, dir_fd=pending)
+        os.fchown(fd, owner.st_uid, owner.st_gid)
+        META = os.fdopen(fd, 'w')
+
+        fd = os.open('core', os.O_WRONLY|os.O_CREAT|os.O_EXCL, 0o644, dir_fd=pending)
+        os.fchown(fd, owner.st_uid, owner.st_gid)
+        OF = os.fdopen(fd, 'wb')
+        corefile = os.readlink('/proc/self/fd/%d'%fd)
+
+    if storedir is not None:
+        # while still root, keep executable and libraries for reanalyze
+        from . import store
+        T0 = _now()
+        rec['modules'] = store.save(pid, exe, storedir)
+        rec['timings']['store'] = _now()-T0
+
+    # assume target process identity
+    # must have mappable uid/gid when/if overlayfs is in used, or it will EOVERFLOW all over us.
+    os.setgid(gid)
+    os.setuid(uid)
+
+    print('Target UID %s/%s'%(uid, gid))
+
+    mfd = None
+    if OF is None and staging is not None and staging['mode']=='memfd':
+        # keep moderate cores in memory, avoiding FS I/O
+        if space is not None:
+            size = space[core_mode]
+        else:
+            from .quota import estimate
+            size = estimate(pid, sparse=sparse)[core_mode!='full']
+        avail = sched.mem_available()
+        if size > staging['max'] or (avail is not None and size > avail//2):
+            print('Core file of ~%d bytes too large for memory.  Writing to disk'%size)
+        else:
+            mfd = memfd_create('core.ccd.%d'%pid)
+            if mfd is None:
+                print('memfd_create() not supported.  Writing to disk')
+            else:
+                OF = os.fdopen(os.dup(mfd), 'wb')
+                corefile = '/proc/self/fd/%d'%mfd
+
+    if OF is None:
+        # write the core file into some temporary storage in the target mount NS
+        tmpdirs = ('/tmp', '/var/tmp', '/dev/shm')
+        if space is not None:
+            from . import quota as Q
+            tmpdirs, mode = Q.tmpdirs(tmpdirs, core_mode, space)
+            if not tmpdirs:
+                print('Insufficient space for core file in target FS.  Metadata only')
+                drain(rec, record.NOSPACE)
+                return
+            if mode!=core_mode:
+                print('Insufficient space for full core file.  Reduced core only')
+                core_mode = mode
+        for tmpdir in tmpdirs:
+            corefile = os.path.join(tmpdir, 'core.ccd.%d'%pid)
+            assert not os.path.exists(corefile), corefile
+            try:
+                OF = open(corefile, 'wb')
+                break
+            except Exception as e:
+                print('Unable to write core file to %s : %r'%(corefile, e))
+                continue
+        else:
+            print('Unable to store core file in target FS')
+            for path in ('/proc/{}/mountinfo', '/proc/{}/status', '/proc/{}/uid_map', '/proc/{}/gid_map'):
+                with open(path.format(pid), 'r') as F:
+                    print('#', F.name)
+                    for L in F.readlines():
+                        print('  ', L.rstrip())
+            # eg. read-only container.  Last resort, regardless of size
+            mfd = memfd_create('core.ccd.%d'%pid)
+            if mfd is None:
+                sys.exit(1)
+            OF = os.fdopen(os.dup(mfd), 'wb')
+            corefile = '/proc/self/fd/%d'%mfd
 
     print('Writing core file to %s'%corefile)
+    if core_mode=='stack':
+        reduced = ReducedCore(OF)
+        parser, tees, full = reduced.parser, [reduced], None
+    else:
+        parser = CoreParser()
+        tees, full = [parser], OF
+    if keep is not None:
+        print('Keeping %s compressed core %s'%(keep_cores, keep.name))
+        tees.append(compressor(keep_cores, keep))
     with OF:
-        if hasattr(sys.stdin, 'buffer'):
-            IF = sys.stdin.buffer # py3
-        else:
-            IF = sys.stdin # py2 (!win32)
-        shutil.copyfileobj(IF, OF)
-        OF.flush()
+        # read directly from the kernel pipe
+        S = capture(sys.stdin, full, sparse=sparse, tees=tees)
+        release_core()
+        if keep is not None:
+            keep.flush() # this (forked) process exits with os._exit()
+        print(S)
+        rec['timings']['capture'] = S.elapsed
+    if core_mode=='stack':
+        print(reduced)
+    if mfd is not None and seal(mfd):
+        print('Sealed core file in memory')
 
     # /proc/<pid> has now disappeared
 
-    cmd = [
-        gdb,
-        '--nx', '--nw', '--batch', # no .gitinit, no UI, no interactive
-        '-ex', 'set pagination 0',
-        '-ex', 'thread apply all bt',
-    ]
-    for extra in extra_cmds:
-        cmd += ['-ex', extra]
-    cmd += [
-        exe, corefile
-    ]
-    print('exec: %s'%cmd)
-    sys.stdout.flush()
-    sys.stderr.flush()
+    parser.triage()
+
+    lwp = parser.threads[0].pid if parser.threads else None
+    summary = parser.summary()
+    rec.update((K, V) for K, V in summary.items() if K!='threads')
+    rec['threads'] = record.threads(summary)
+
+    if pending is not None:
+        with META:
+            json.dump(dict(pid=pid, exe=exe, cmdline=cmdline, files=files,
+                           gdb=gdb, analyzers=list(analyzers), extra_cmds=extra_cmds,
+                           limits=limits, lwp=lwp, debugdirs=list(debugdirs), index_cache=index_cache),
+                      META, indent=1)
+        print('Analysis deferred to report')
+        rec['status'] = record.DEFERRED
+        return
+
+    # with a quota, the temporary core file is not left behind
+    discard = space is not None and pending is None and mfd is None
+    if mfd is not None:
+        fate = 'Core file in memory discarded'
+    elif discard:
+        fate = 'Core file removed'
+    else:
+        fate = 'Core file remains in %s'%corefile
+
+    if analyzer is None:
+        if discard:
+            os.remove(corefile)
+        print('No debugger.  Triage only.  %s'%fate)
+        rec['status'] = record.TRIAGE
+        return
+
+    if ratelimit is not None and ratelimit.by=='signature' and summary['threads']:
+        # approximate stack signature, before analysis
+        key = '%s %s %s'%(exe, (rec.get('signal') or {}).get('name'), summary['threads'][0]['module'])
+        allowed, state = ratelimit.take(key)
+        if not allowed:
+            print('Rate limited.  %d crashes of %s skipped.  Metadata only'%(state['skipped'], key))
+            if mfd is None:
+                os.remove(corefile)
+            rec['threads'] = []
+            rec['status'] = record.LIMITED
+            return
 
-    os.execve(gdb, cmd, env)
-    # not reached
+    rec['status'] = record.RUNNING
+    if detach and not detach_child():
+        return # let the kernel reap the crashed process
+
+    # many threads may be unwound by debuggers running in parallel, each printing a range.
+    # Each debugger takes an analysis slot
+    workers = 1
+    if unwind_workers>1 and isinstance(analyzer, GDB):
+        workers = len(stacks.thread_ranges(len(parser.threads), unwind_workers))
+    T0 = _now()
+    if slots is not None:
+        workers = wait_slot(slots, queue, want=workers)
+        if not workers:
+            if discard:
+                os.remove(corefile)
+            print('Analysis skipped.  %s'%fate)
+            rec['status'] = record.SKIPPED
+            return
+    rec['timings']['wait'] = _now()-T0
+
+    ranges = [None]
+    if workers>1:
+        ranges = stacks.thread_ranges(len(parser.threads), workers)
+        if len(ranges)==1:
+            ranges = [None]
+
+    scratch = corefile if mfd is None else '/tmp/core.ccd.%d'%pid
+    jobs = [] # [(cmd, script, frames)]
+    for n, threads in enumerate(ranges):
+        # frames for the crash record
+        script, frames = scratch+'.py', scratch+'.frames'
+        if threads:
+            script, frames = '%s.%d.py'%(scratch, n), '%s.%d.frames'%(scratch, n)
+        try:
+            if not analyzer.write_script(script, frames, frames=limits['frames'], depth=limits['depth'],
+                                         **(dict(threads=threads) if threads else {})):
+                script = None
+        except (IOError, OSError) as e:
+            print('Unable to write %s : %r.  Frames parsed from backtrace'%(script, e))
+            script = None
+
+        # faulting thread first, extra commands last
+        kws = dict(threads=threads) if threads else {}
+        cmd = analyzer.command(exe, corefile, extra_cmds if n==len(ranges)-1 else (),
+                               frames=limits['frames'] if n==0 else None, depth=limits['depth'],
+                               script=script, debugdirs=debugdirs, index_cache=index_cache, **kws)
+        print('exec: %s'%cmd)
+        jobs.append((cmd, script, frames))
+
+    # run, rather than exec(), the debugger to enforce limits
+    T0 = _now()
+    kws = dict(env=env, timeout=limits['timeout'], max_output=limits['max_output'],
+               frames=limits['frames'], depth=limits['depth'], lwp=lwp,
+               pass_fds=() if mfd is None else (mfd,))
+    if len(jobs)==1:
+        out = stacks.run(jobs[0][0], sys.stdout, **kws)
+    else:
+        print('Unwinding %d threads with %d debuggers in parallel'%(len(parser.threads), len(jobs)))
+        out = stacks.run_sharded([J[0] for J in jobs], sys.stdout, **kws)
+    rec['timings']['analysis'] = _now()-T0
+    if out.code:
+        print('ERROR: %s exits with %d'%(analyzer.name, out.code))
+
+    scripted = None
+    for _cmd, script, frames in jobs:
+        R = script and record.load_script_output(frames)
+        if R:
+            scripted = scripted or dict(threads=[])
+            scripted['threads'].extend(R['threads'])
+        if script:
+            os.remove(script)
+
+    rec['threads'] = record.threads(summary, text=out, script=scripted)
+    rec['cuts'] = out.cuts
+    rec['status'] = record.COMPLETE if out.code==0 else record.FAILED
+    if discard:
+        os.remove(corefile)
+    if detach:
+        print('Complete')
@@ -0,0 +1,86 @@
+"""
+Merge the stacks of many processes into one prefix tree of call paths.
+
+When many processes crash together (eg. all ranks of an MPI job),
+their stacks are mostly identical.  Merging from the outermost frame
+(eg. main) inward, each node of the tree lists the processes, and the
+number of threads, whose stacks pass through it.  A process which
+differs from the rest appears as a branch with few members.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from .buckets import frame_name
+from .stacks import ranges
+
+# Crashes less than this many seconds apart are merged together
+WINDOW = 60
+
+class Node(object):
+    def __init__(self, name):
+        self.name = name
+        self.pids = set()
+        self.threads = 0
+        self.children = {} # name -> Node
+        self.order = [] # names of children, in order of first occurrence
+
+    def child(self, name):
+        C = self.children.get(name)
+        if C is None:
+            C = self.children[name] = Node(name)
+            self.order.append(name)
+        return C
+
+    def add(self, pid, frames):
+        'Add the stack of one thread.  frames are innermost first'
+        node = self
+        node.pids.add(pid)
+        node.threads += 1
+        for name in reversed(frames):
+            node = node.child(name)
+            node.pids.add(pid)
+            node.threads += 1
+
+    def sorted_children(self):
+        # largest first, so that odd ones stand out at the end
+        return sorted((self.children[name] for name in self.order), key=lambda C: -C.threads)
+
+    def label(self):
+        return '[%d procs %s, %d threads]'%(len(self.pids), ranges(self.pids, limit=8), self.threads)
+
+    def render(self, out, indent=''):
+        'Print as text.  Chains of frames with the same members are joined on one line'
+        for C in self.sorted_children():
+            names = [C.name]
+            while len(C.children)==1:
+                N = C.children[C.order[0]]
+                if N.pids!=C.pids or N.threads!=C.threads:
+                    break
+                C = N
+                names.append(C.name)
+            out('%s%s  %s'%(indent, ' > '.join(names), C.label()))
+            C.render(out, indent+'  ')
+
+    def todict(self):
+        return dict(name=self.name, pids=sorted(self.pids), threads=self.threads,
+                    children=[C.todict() for C in self.sorted_children()])
+
+def windows(records, window=WINDOW):
+    'Split crash records into groups where each crash is within window seconds of the first'
+    ret = []
+    for R in sorted(records, key=lambda R: R.get('time') or 0):
+        if not R.get('threads'):
+            continue
+        if ret and (R.get('time') or 0) - (ret[-1][0].get('time') or 0) <= window:
+            ret[-1].append(R)
+        else:
+            ret.append([R])
+    return ret
+
+def build(records):
+    'Tree of all threads of all crash records'
+    root = Node('all')
+    for R in records:
+        for T in R['threads']:
+            frames = [frame_name(F) for F in T.get('frames') or [] if 'error' not in F]
+            root.add(R.get('ipid', R.get('pid')), frames or ['?? no frames'])
+    return root
@@ -0,0 +1,236 @@
+"""
+Sampling profiler for the exec sub-command.
+
+While the command runs, every thread of its process tree is sampled
+HZ times each second.  Stacks are counted as "folded" stacks,
+one "process;outer;...;inner count" line per unique stack,
+as read by flamegraph.pl, inferno, and speedscope.
+
+Mode 'wchan' reads /proc/<pid>/task/<tid>/stat and wchan.  Cheap, but only
+shows the thread name, its scheduler state, and where in the kernel
+(or in which system call) a sleeping thread waits.
+
+Mode 'stack' attaches a debugger (eu-stack, GDB, or LLDB) to each process
+in turn for user space backtraces.  A process is stopped while attached.
+
+The time spent taking samples is measured.  When it would exceed a fraction
+of the elapsed time (overhead), samples are taken less often.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import print_function
+
+import os
+import re
+import time
+import logging
+
+from .capture import _now
+from . import stacks
+
+_log = logging.getLogger(__name__)
+
+# frames of each thread in 'stack' mode
+DEPTH = 64
+# seconds before a debugger attached to one process is killed
+ATTACH_TIMEOUT = 10
+
+PR_SET_PTRACER = 0x59616d61
+
+_states = dict(R='running', S='sleeping', D='disk', T='stopped', t='traced', Z='zombie', I='idle', X='dead')
+
+# frame number, address, and module` (LLDB), are skipped.  Then the function name
+_func = re.compile(r'^\s*(?:\* )?(?:frame )?#\d+:?\s+(?:0x[0-9a-fA-F]+(?: in |\s+))?(?:\S+`)?(?!0x)([^\s(]+)')
+
+# CONFIG_PROC_CHILDREN
+_have_children = os.path.exists('/proc/self/task/%d/children'%os.getpid())
+
+def _read(path):
+    with open(path, 'r') as F:
+        return F.read()
+
+def _stat(path):
+    '(comm, state, ppid) from a /proc/.../stat file.  comm may contain spaces and parenthesis'
+    S = _read(path)
+    comm, _sep, rest = S[S.index('(')+1:].rpartition(')')
+    fields = rest.split()
+    return comm, fields[0], int(fields[1])
+
+def _children(pid):
+    ret = []
+    for tid in os.listdir('/proc/%d/task'%pid):
+        ret.extend(int(C) for C in _read('/proc/%d/task/%s/children'%(pid, tid)).split())
+    return ret
+
+def _parents():
+    'Map of PPID -> [PID] of all processes'
+    ret = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                ppid = _stat('/proc/%s/stat'%name)[2]
+            except (IOError, OSError, ValueError):
+                continue # exited
+            ret.setdefault(ppid, []).append(int(name))
+    return ret
+
+def tree(root):
+    'PIDs of root and its descendants'
+    parents = None if _have_children else _parents()
+    pids, todo = [], [root]
+    while todo:
+        pid = todo.pop(0)
+        try:
+            todo.extend(_children(pid) if parents is None else parents.get(pid, []))
+        except (IOError, OSError):
+            continue # exited
+        pids.append(pid)
+    return pids
+
+def _syscall(task):
+    'Number of the system call a task waits in, if permitted'
+    try:
+        nr = _read(task+'syscall').split()[0]
+    except (IOError, OSError, IndexError):
+        return None
+    return 'syscall %s'%nr if nr.isdigit() else None
+
+def sample_wchan(pid):
+    '''[[process, thread, state, wchan]] of each thread of pid.
+       wchan is replaced by the system call where the kernel hides it (reads as "0")
+    '''
+    comm = _stat('/proc/%d/stat'%pid)[0]
+    ret = []
+    for tid in os.listdir('/proc/%d/task'%pid):
+        task = '/proc/%d/task/%s/'%(pid, tid)
+        try:
+            tcomm, state, _ppid = _stat(task+'stat')
+            where = None
+            if state!='R':
+                where = _read(task+'wchan').strip()
+                if where in ('', '0'):
+                    where = _syscall(task)
+        except (IOError, OSError):
+            continue # exited
+        stack = [comm, tcomm, _states.get(state, state)]
+        if where:
+            stack.append('[%s]'%where)
+        ret.append(stack)
+    return ret
+
+class Folder(object):
+    '''Accepts debugger output by line(), as stacks._pump(),
+       and collects the functions of each thread, outermost first, in stacks.
+    '''
+    full = False
+
+    def __init__(self):
+        self.cuts = []
+        self.stacks = []
+        self.block = None
+
+    def line(self, line):
+        if stacks._header.match(line):
+            self.flush()
+            self.block = []
+        elif self.block is not None:
+            M = _func.match(line)
+            if M:
+                self.block.append(M.group(1))
+            elif stacks._frame.match(line):
+                self.block.append('??')
+
+    def flush(self):
+        if self.block:
+            self.stacks.append(self.block[::-1])
+        self.block = None
+
+def sample_stack(analyzer, pid):
+    '[[process, outer, ..., inner]] of each thread of pid, from a debugger attached for a moment'
+    comm = _stat('/proc/%d/stat'%pid)[0]
+    F = Folder()
+    P = stacks._popen(analyzer.attach(pid, depth=DEPTH))
+    stacks._pump(P, F, ATTACH_TIMEOUT)
+    P.wait()
+    F.flush()
+    return [[comm]+S for S in F.stacks]
+
+def ptrace_scope():
+    'Yama ptrace_scope, or 0 without Yama'
+    try:
+        with open('/proc/sys/kernel/yama/ptrace_scope', 'r') as F:
+            return int(F.read())
+    except (IOError, OSError, ValueError):
+        return 0
+
+def allow_ptrace():
+    '''Run in the child before exec.  With Yama ptrace_scope=1, only an ancestor may attach.
+       Declare our parent, whose debuggers are then also permitted.  Harmless without Yama.
+       Yama does not pass this exception, nor PR_SET_PTRACER_ANY, on to child processes.
+       So their descendants can only be attached with CAP_SYS_PTRACE.
+    '''
+    import ctypes
+    myself = ctypes.CDLL(None, use_errno=True)
+    myself.prctl(PR_SET_PTRACER, os.getppid(), 0, 0, 0)
+
+class Profiler(object):
+    '''Sample a process tree hz times each second, with analyzer, or from /proc if None.
+       overhead is the fraction of elapsed time which may be spent sampling.
+    '''
+    def __init__(self, hz, analyzer=None, overhead=0.05):
+        self.interval = 1.0/hz
+        self.analyzer, self.overhead = analyzer, overhead
+        self.counts = {}      # folded stack -> samples
+        self.nsamples = 0
+        self.busy = 0.0       # seconds spent sampling
+        self.elapsed = 0.0
+        self.slowest = 0.0    # longest interval used
+
+    def snapshot(self, root):
+        for pid in tree(root):
+            try:
+                if self.analyzer is None:
+                    found = sample_wchan(pid)
+                else:
+                    found = sample_stack(self.analyzer, pid)
+            except (IOError, OSError):
+                continue # exited
+            for S in found:
+                key = ';'.join(F.replace(';', ':').replace('\n', ' ') for F in S)
+                self.counts[key] = self.counts.get(key, 0) + 1
+        self.nsamples += 1
+
+    def run(self, P, deadline=None):
+        '''Sample the process tree of subprocess P until it exits, or until time deadline.
+           Returns its exit code, or None
+        '''
+        start = due = _now()
+        while True:
+            code = P.poll()
+            if code is not None or (deadline is not None and _now()>=deadline):
+                break
+            now = _now()
+            if now >= due:
+                self.snapshot(P.pid)
+                taken = _now()-now
+                self.busy += taken
+                # start of the next sample.  Later if sampling takes too long
+                wait = max(self.interval, taken/self.overhead if self.overhead else 0)
+                if wait>self.interval and self.slowest<=self.interval:
+                    _log.info('Sampling slowed to %.2f Hz to keep overhead below %.1f%%', 1.0/wait, self.overhead*100)
+                self.slowest = max(self.slowest, wait)
+                due = now + wait
+            wake = due if deadline is None else min(due, deadline)
+            time.sleep(max(0, min(wake-_now(), 0.05))) # notice exit within 50ms
+        self.elapsed = _now()-start
+        return code
+
+    def write(self, path):
+        with open(path, 'w') as F:
+            for key, n in sorted(self.counts.items()):
+                F.write('%s %d\n'%(key, n))
+
+    def summary(self):
+        return '%d samples in %.1f s (%.2f Hz), %d unique stacks.  Overhead %.1f%% (%.3f s sampling)'%(
+            self.nsamples, self.elapsed, self.nsamples/self.elapsed if self.elapsed else 0,
+            len(self.counts), 100*self.busy/self.elapsed if self.elapsed else 0, self.busy)
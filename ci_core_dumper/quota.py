@@ -0,0 +1,220 @@
+"""
+Bound the disk space used by outdir on a long lived runner.
+
+Each crash leaves <time>.<pid>.txt, .json, and optionally a kept core
+(.core.gz, ...) and a deferred capture (pending/<time>.<pid>/).
+When a new crash would exceed a byte, or file count, quota, or leave
+less than a minimum of free space, the files of the least recently used
+crashes are removed.  A crash whose log is locked (capture or analysis
+in progress) is never removed.
+
+If space can not be made, the new crash is captured with less:
+a reduced core (--core-mode=stack) and no kept core, or only metadata.
+
+The store/ and debug/ directories are shared by many crashes, and not counted.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import print_function
+
+import os
+import re
+import errno
+import shutil
+
+from .elfcore import ReducedCore
+
+LOCK = 'quota.lock'
+
+# eg. 1700000000.1234.txt  or  1700000000.1234.core.gz
+_crash_file = re.compile(r'^(\d+\.\d+)\.')
+
+# typical log and crash record
+METADATA = 64<<10
+# notes, and other overhead, of a core file
+NOTES = 1<<20
+# guess at compression of a kept core
+KEEP_RATIO = 4
+# file backed data, and small anonymous segments, of a reduced core
+REDUCED_DATA = 16<<20
+
+_units = {'': 1, 'K': 1<<10, 'M': 1<<20, 'G': 1<<30, 'T': 1<<40}
+
+def parse_size(arg):
+    'Bytes from eg. "500M" or "2G"'
+    M = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', arg, re.I)
+    if not M:
+        raise ValueError('Invalid size %r'%arg)
+    return int(float(M.group(1))*_units[M.group(2).upper()])
+
+def free_space(path):
+    'Bytes available to unprivileged users on the FS containing path, or 0 if unknown'
+    try:
+        S = os.statvfs(path)
+    except OSError:
+        return 0
+    return S.f_bavail*S.f_frsize
+
+def estimate(pid, sparse=True):
+    '''Estimated sizes of the (full, reduced) core files of PID, from /proc/<pid>/status.
+       A sparse copy skips untouched pages, so only resident anonymous memory is counted.
+    '''
+    status = {}
+    with open('/proc/%d/status'%pid, 'r') as F:
+        for line in F:
+            K, _sep, V = line.partition(':')
+            status[K] = V.split()
+    def kb(K):
+        return int(status[K][0])*1024 if K in status else 0
+
+    if sparse:
+        full = kb('RssAnon') + kb('RssShmem')
+    else:
+        full = kb('VmData') + kb('VmStk')
+    threads = int(status.get('Threads', ['1'])[0])
+    stack = threads*(ReducedCore.STACK_ABOVE + ReducedCore.STACK_BELOW) + REDUCED_DATA
+    return full + NOTES, min(full, stack) + NOTES
+
+def _usage(path):
+    'Returns (bytes, files) under path.  Files also linked elsewhere free no space, so are not counted'
+    nbytes = nfiles = 0
+    if os.path.isdir(path) and not os.path.islink(path):
+        for dirpath, _dirnames, filenames in os.walk(path):
+            for name in filenames:
+                B, N = _usage(os.path.join(dirpath, name))
+                nbytes, nfiles = nbytes+B, nfiles+N
+        return nbytes, nfiles
+    st = os.lstat(path)
+    return (st.st_blocks*512 if st.st_nlink==1 else 0), 1
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno!=errno.ENOENT:
+                raise
+
+def tiers(full, reduced, log, keep=False, defer=False, core_mode='full'):
+    '''Preference list of what to capture, and the space each needs in outdir.
+       'capture' as configured, 'stack' a reduced core without a kept copy, or 'metadata'.
+       [(name, bytes, files)]
+    '''
+    core = full if core_mode=='full' else reduced
+    return [('capture', log + (full//KEEP_RATIO if keep else 0) + (core if defer else 0), 2 + bool(keep) + 2*defer),
+            ('stack', log + (reduced if defer else 0), 2 + 2*defer),
+            ('metadata', log, 2)]
+
+def tmpdirs(dirs, core_mode, space):
+    '''Those of dirs with enough free space for the core file, and the core mode to use.
+       Falls back to a reduced core.  Returns ([], None) if there is space for neither.
+    '''
+    for mode in (['full', 'stack'] if core_mode=='full' else ['stack']):
+        ok = [D for D in dirs if free_space(D) >= space[mode] + space['min_free']]
+        if ok:
+            return ok, mode
+    return [], None
+
+class Quota(object):
+    '''Storage limits of outdir.  Zero for no limit, except that what is
+    written must always fit in the free space, less min_free.
+    Changes are serialized between crash handlers by flock() of outdir/quota.lock
+    '''
+    def __init__(self, outdir, max_bytes=0, max_files=0, min_free=0):
+        self.outdir, self.max_bytes, self.max_files, self.min_free = outdir, max_bytes, max_files, min_free
+
+    def crashes(self):
+        '''Files of each crash in outdir, least recently used first.
+           [{id, paths, bytes, files, used}]
+        '''
+        C = {}
+        pdir = os.path.join(self.outdir, 'pending')
+        for dirname in (self.outdir, pdir):
+            try:
+                names = os.listdir(dirname)
+            except OSError:
+                continue
+            for name in names:
+                M = _crash_file.match(name+'.')
+                if M:
+                    C.setdefault(M.group(1), []).append(os.path.join(dirname, name))
+
+        ret = []
+        for cid, paths in C.items():
+            E = dict(id=cid, paths=paths, bytes=0, files=0, used=0)
+            for path in paths:
+                try:
+                    B, N = _usage(path)
+                    st = os.lstat(path)
+                except OSError:
+                    continue # removed concurrently
+                E['bytes'] += B
+                E['files'] += N
+                E['used'] = max(E['used'], st.st_atime, st.st_mtime)
+            ret.append(E)
+        ret.sort(key=lambda E: (E['used'], E['id']))
+        return ret
+
+    def fits(self, need, files, used, nfiles, free):
+        return (not self.max_bytes or used+need <= self.max_bytes) \
+            and (not self.max_files or nfiles+files <= self.max_files) \
+            and free-need >= self.min_free
+
+    def reserve(self, tiers, protect=()):
+        '''Make space for a new crash, by evicting least recently used crashes.
+           tiers is a preference list of [(name, bytes, files)].
+           Returns (name of the first which fits, or None, [evicted crash ids])
+        '''
+        import fcntl # not Windows.  parse_size() is used by getargs() everywhere
+        with open(os.path.join(self.outdir, LOCK), 'a') as L:
+            fcntl.flock(L.fileno(), fcntl.LOCK_EX)
+            crashes = self.crashes()
+            used = sum(E['bytes'] for E in crashes)
+            nfiles = sum(E['files'] for E in crashes)
+            free = free_space(self.outdir)
+            evictable = [E for E in crashes if E['id'] not in protect]
+            maxbytes = sum(E['bytes'] for E in evictable)
+            maxfiles = sum(E['files'] for E in evictable)
+
+            evicted = []
+            for name, need, files in tiers:
+                # possible, if everything not in use were evicted?
+                if not self.fits(need, files, used-maxbytes, nfiles-maxfiles, free+maxbytes):
+                    continue
+                while evictable and not self.fits(need, files, used, nfiles, free):
+                    E = evictable.pop(0)
+                    if not self._evict(E):
+                        continue
+                    evicted.append(E['id'])
+                    used, nfiles, free = used-E['bytes'], nfiles-E['files'], free+E['bytes']
+                if self.fits(need, files, used, nfiles, free):
+                    return name, evicted
+            return None, evicted
+
+    def _evict(self, E):
+        'Remove the files of one crash, unless its log is locked.  Returns True if removed'
+        import fcntl
+        log = os.path.join(self.outdir, E['id']+'.txt')
+        LOG = None # no log.  eg. orphaned core
+        if log in E['paths']:
+            LOG = open(log, 'a')
+        try:
+            if LOG is not None:
+                try:
+                    fcntl.flock(LOG.fileno(), fcntl.LOCK_EX|fcntl.LOCK_NB)
+                except IOError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                    return False # in progress
+            for path in E['paths']:
+                if path!=log:
+                    _remove(path)
+            if LOG is not None:
+                _remove(log) # last, as it is also the lock
+        finally:
+            if LOG is not None:
+                LOG.close()
+        print('Evicted %s, %d bytes'%(E['id'], E['bytes']))
+        return True
@@ -0,0 +1,143 @@
+"""
+Machine readable record of one crash, written as <time>.<pid>.json
+alongside the <time>.<pid>.txt log.
+
+  {"format": 1, "time": 0, "pid": 0, "ipid": 0, "exe": "", "cmdline": [],
+   "status": "complete", "analyzer": "gdb", "machine": "x86_64",
+   "signal": {"signo": 11, "name": "SIGSEGV", "code": 1, "addr": 0, "sender": null},
+   "threads": [{"lwp": 0, "crashed": true, "pc": 0, "sp": 0, "name": "",
+                "frames": [{"pc": 0, "function": "", "file": "", "line": 0,
+                            "module": "", "build_id": "", "inline": false}]}],
+   "cuts": [], "timings": {"capture": 0.0, "wait": 0.0, "analysis": 0.0, "total": 0.0},
+   "modules": [{"path": "", "build_id": "", "key": ""}]}
+
+modules are only present with install --store-files.  key is relative to outdir/store.
+
+Frames come from a script run by GDB when possible.
+Otherwise they are parsed from backtrace text, without build-id.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import re
+import json
+
+FORMAT = 1
+
+# status
+COMPLETE = 'complete'   # analysis finished
+TRIAGE = 'triage'       # no debugger, triage from core notes only
+DEFERRED = 'deferred'   # waiting for report
+SKIPPED = 'skipped'     # too many concurrent analyses
+RUNNING = 'running'     # analysis in a detached child
+LIMITED = 'limited'     # rate limited, metadata only
+NOSPACE = 'nospace'     # insufficient disk space (install --quota-*), metadata only
+HUNG = 'hung'           # exec --timeout reached, backtraces of a live process
+OOM = 'oom'             # exec --cgroup counted an OOM kill, resources only
+FAILED = 'failed'
+
+# #1  0x00005555 in main (argc=2, argv=0x7ffd) at crasher.c:40
+# #2  0x00007fff in __libc_start_main () from /lib/libc.so.6
+_gdb = re.compile(r'^#(\d+)\s+(?:(0x[0-9a-fA-F]+) in )?(.+?) \(.*\)(?: at (.+):(\d+))?(?: from (\S+))?\s*$')
+# * frame #0: 0x00005555 crasher`doCrash at crasher.c:20:12
+_lldb = re.compile(r'^\s*(?:\* )?frame #\d+: (0x[0-9a-fA-F]+) (.+?)`(\S+?)(?:\(.*\))?(?: \+ \d+)?(?: at (.+?):(\d+)(?::\d+)?)?\s*$')
+# #0  0x00007fff raise - /lib/libc.so.6
+#     /usr/src/raise.c:50:3
+_eustack = re.compile(r'^#\d+\s+(0x[0-9a-fA-F]+)\s*(\S+)?(?: - (.+?))?\s*$')
+_source = re.compile(r'^\s+(/\S+?):(\d+)(?::\d+)?\s*$')
+
+def parse_frame(line):
+    'Parse one line of backtrace text.  Returns a dict, or None'
+    inline = False
+    M = _gdb.match(line)
+    if M:
+        num, pc, fn, file, lineno, module = M.groups()
+        inline = pc is None and num!='0' # GDB omits the address of inlined frames
+    else:
+        M = _lldb.match(line)
+        if M:
+            pc, module, fn, file, lineno = M.groups()
+        else:
+            M = _eustack.match(line)
+            if not M:
+                return None
+            pc, fn, module = M.groups()
+            file = lineno = None
+    F = dict(pc=int(pc, 16) if pc else None, function=None if fn in (None, '??') else fn)
+    if file:
+        F['file'], F['line'] = file, int(lineno)
+    if module:
+        F['module'] = module
+    if inline:
+        F['inline'] = True
+    return F
+
+def parse_frames(lines):
+    'Frames from backtrace text of one thread'
+    ret = []
+    for line in lines:
+        F = parse_frame(line)
+        if F is not None:
+            ret.append(F)
+            continue
+        M = _source.match(line)
+        if M and ret and 'file' not in ret[-1]:
+            ret[-1]['file'], ret[-1]['line'] = M.group(1), int(M.group(2))
+    return ret
+
+def threads(summary, text=None, script=None, sysroot=None):
+    '''Merge per-thread information from CoreParser.summary(),
+       with frames from a debugger script, or StackFilter text.
+    '''
+    frames, names = {}, {}
+    if script:
+        for T in script.get('threads', []):
+            frames[T['lwp']] = T['frames']
+            names[T['lwp']] = T.get('name')
+    elif text is not None:
+        for lwp, lines in text.threads:
+            frames[lwp] = parse_frames(lines)
+        if not text.threads and text.top and summary['threads']:
+            # backtrace of faulting thread only
+            frames[summary['threads'][0]['lwp']] = parse_frames(text.top)
+
+    if sysroot:
+        # deferred analysis.  show original paths
+        for F in [F for FS in frames.values() for F in FS]:
+            for key in ('module', 'file'):
+                if (F.get(key) or '').startswith(sysroot+'/'):
+                    F[key] = F[key][len(sysroot):]
+
+    ret = []
+    for n, T in enumerate(summary['threads']):
+        T = dict(T, crashed=n==0, name=names.get(T['lwp']), frames=frames.pop(T['lwp'], []))
+        ret.append(T)
+    for lwp in sorted(L for L in frames if L is not None):
+        # not in core notes?
+        ret.append(dict(lwp=lwp, crashed=False, frames=frames[lwp]))
+    return ret
+
+def load_script_output(path):
+    'Read, and remove, the output of Analyzer.write_script().  Returns None if missing'
+    try:
+        with open(path, 'r') as F:
+            return json.load(F)
+    except (IOError, ValueError):
+        return None
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def save(F, rec):
+    'Replace contents of file F with crash record'
+    F.seek(0)
+    F.truncate()
+    json.dump(rec, F, indent=1, sort_keys=True)
+    F.write('\n')
+    F.flush()
+
+def load(name):
+    with open(name, 'r') as F:
+        return json.load(F)
@@ -0,0 +1,150 @@
+"""
+Bound the number of concurrent analyses during a crash storm.
+
+Each crash is handled by a separate process, so concurrency is limited with
+a set of lock files in outdir, each flock()'d by at most one analysis at a time.
+Capture of the core file is not delayed.  Only starting the debugger is.
+
+When core_pipe_limit is set, the number of handlers waiting for an
+analysis slot is also limited, to as many as the kernel lets capture at once.
+
+Repeated crashes of the same executable may also be rate limited,
+in which case only metadata is recorded.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import print_function
+
+import os
+import errno
+import fcntl
+import json
+import time
+
+core_pipe_limit = '/proc/sys/kernel/core_pipe_limit'
+
+# rate limit state, in outdir
+RATELIMIT = 'ratelimit.json'
+
+# Guess at the memory needed by one GDB
+GDB_MEMORY = 512<<20
+
+def mem_available():
+    'Bytes of available memory, or None if unknown'
+    try:
+        with open('/proc/meminfo', 'r') as F:
+            for line in F:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])*1024
+    except IOError:
+        pass
+    return None
+
+def cpu_count():
+    if hasattr(os, 'sched_getaffinity'): # py >= 3.3
+        return len(os.sched_getaffinity(0))
+    import multiprocessing
+    return multiprocessing.cpu_count()
+
+def default_slots():
+    'Number of concurrent analyses from CPU count and available memory'
+    N = cpu_count()
+    mem = mem_available()
+    if mem is not None:
+        N = min(N, mem//GDB_MEMORY)
+    return max(1, N)
+
+def read_pipe_limit():
+    with open(core_pipe_limit, 'r') as F:
+        return int(F.read())
+
+class Slots(object):
+    '''Counting semaphore shared between processes.
+    A slot is held by flock() on one of a set of files.
+    The lock is held until all copies of the fd are closed,
+    including by a child exec()'d after acquire().
+    '''
+    def __init__(self, dirname, prefix, count):
+        self.files = []
+        for n in range(count):
+            self.files.append(open(os.path.join(dirname, '%s%d.lock'%(prefix, n)), 'a'))
+
+    def __len__(self):
+        return len(self.files)
+
+    def try_acquire(self, held=()):
+        'Returns index of acquired slot, or None.  Slots already held are skipped'
+        for n, F in enumerate(self.files):
+            if n in held:
+                continue # a second flock() of our own fd would succeed
+            try:
+                fcntl.flock(F.fileno(), fcntl.LOCK_EX|fcntl.LOCK_NB)
+                return n
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+        return None
+
+    def acquire(self, poll=0.1):
+        'Block until a slot is available'
+        while True:
+            n = self.try_acquire()
+            if n is not None:
+                return n
+            time.sleep(poll)
+
+    def release(self, n):
+        fcntl.flock(self.files[n].fileno(), fcntl.LOCK_UN)
+
+    def keep(self, *ns):
+        'Close all but slots ns, which will be held until exit.  Returns their files'
+        for i, F in enumerate(self.files):
+            if i not in ns:
+                F.close()
+        return [self.files[n] for n in ns]
+
+    def close(self):
+        for F in self.files:
+            F.close()
+
+def read_ratelimit(F):
+    'Rate limit state from file F.  {key: {tokens, time, analyzed, skipped}}'
+    F.seek(0)
+    try:
+        return json.loads(F.read() or '{}')
+    except ValueError:
+        return {}
+
+class RateLimit(object):
+    '''Token bucket for each key (eg. executable) shared between crash handlers
+    through a JSON file, locked with flock().
+    Each key starts with 'burst' tokens, refilled at 'burst' per 'window' seconds.
+    An analysis takes one token.  Without a token, the crash is only counted.
+    by is 'exe' or 'signature', and describes the keys used.
+    '''
+    def __init__(self, F, burst, window, by='exe'):
+        self.F, self.burst, self.window, self.by = F, burst, window, by
+
+    def take(self, key, now=None):
+        'Returns (allowed, state of key)'
+        now = time.time() if now is None else now
+        fcntl.flock(self.F.fileno(), fcntl.LOCK_EX)
+        try:
+            state = read_ratelimit(self.F)
+            E = state.setdefault(key, dict(tokens=float(self.burst), time=now, analyzed=0, skipped=0))
+            if self.window > 0:
+                E['tokens'] = min(float(self.burst), E['tokens'] + max(0, now-E['time'])*float(self.burst)/self.window)
+            E['time'] = now
+            ok = E['tokens'] >= 1
+            if ok:
+                E['tokens'] -= 1
+                E['analyzed'] += 1
+            else:
+                E['skipped'] += 1
+            self.F.seek(0)
+            self.F.truncate()
+            json.dump(state, self.F, sort_keys=True)
+            self.F.flush()
+        finally:
+            fcntl.flock(self.F.fileno(), fcntl.LOCK_UN)
+        return ok, E
@@ -0,0 +1,389 @@
+"""
+Run a debugger with limits on time and output, and filter its backtraces.
+
+The debugger is asked for the faulting thread first, with up to
+'frames' frames, then for all threads with up to 'depth' frames.
+Output is read line by line, and split into per-thread blocks.
+Threads with identical stacks are collapsed into one summary line
+per group, which is printed at the end along with a description
+of anything which was cut to stay within limits.
+
+Thread headers and frames are recognized in the output of
+GDB (Thread 2 (Thread 0x... (LWP 123)):  #0 ...),
+eu-stack (TID 123:  #0 ...), and LLDB (thread #2: tid = 123 ...  frame #0: ...).
+The frame which GDB prints when loading a core, after "Program terminated
+with signal ...", is not a backtrace.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import print_function
+
+import os
+import re
+import select
+
+from .capture import _now
+
+DEFAULT_LIMITS = dict(
+    timeout=300,        # seconds for the whole debugger run
+    max_output=16<<20,  # bytes of debugger output to log
+    frames=256,         # frames of the faulting thread
+    depth=32,           # frames of each other thread
+)
+
+_header = re.compile(r'^(?:Thread \d+ |TID \d+:|\s*\*?\s*thread #\d+)')
+_frame = re.compile(r'^\s*(?:\* )?(?:frame )?#\d+')
+_lwp = re.compile(r'(?:LWP |TID |tid = )(\d+)')
+_addr = re.compile(r'0x[0-9a-fA-F]+')
+_args = re.compile(r'\(.*\)')
+_more = '(More stack frames follow...)'
+_terminated = re.compile(r'^Program terminated with signal ')
+
+# fewest threads for each debugger run in parallel.  Below this, startup time dominates
+SHARD_MIN = 64
+
+def ranges(nums, limit=64):
+    'Format list of integers as ranges, eg. "1-3 5".  At most limit ranges'
+    parts = []
+    for n in sorted(N for N in nums if N is not None):
+        if parts and parts[-1][1]==n-1:
+            parts[-1][1] = n
+        else:
+            parts.append([n, n])
+    ret = ' '.join(('%d'%A if A==B else '%d-%d'%(A, B)) for A, B in parts[:limit])
+    if len(parts)>limit:
+        ret += ' ...'
+    return ret
+
+def frame_key(line):
+    'Frame with addresses and argument values removed'
+    line = _frame.sub('', line)
+    return _args.sub('()', _addr.sub('', line)).strip()
+
+class StackFilter(object):
+    '''Accepts debugger output by line(), and writes the filtered result to out.
+       full is set when the output limit is reached.
+       Afterwards, top holds the frames of the faulting thread shown first,
+       and threads holds [(LWP, [frame, ...])] including collapsed threads.
+    '''
+    def __init__(self, out, max_output=None, frames=None, depth=None, lwp=None):
+        self.out = out
+        self.max_output, self.frames, self.depth, self.lwp = max_output, frames, depth, lwp
+        self.nbytes = 0
+        self.blank = False    # last line emitted was empty
+        self.full = False
+        self.cuts = []
+        self.block = None     # [header, frame, ...] of current thread
+        self.faulting = 0     # frames of faulting thread shown before the first header
+        self.loading = False  # next frame is the one GDB prints at core load
+        self.groups = {}      # stack -> [first header, [LWP, ...]]
+        self.nthreads = 0
+        self.seen = set()     # LWPs of threads emitted
+        self.ncut = 0         # threads with frames cut
+        self.top = []
+        self.threads = []
+        self.code = None      # debugger exit code, None if killed
+
+    def emit(self, line):
+        if self.full or (self.blank and not line.strip()):
+            return
+        self.blank = not line.strip()
+        self.nbytes += len(line)+1
+        if self.max_output and self.nbytes > self.max_output:
+            self.full = True
+            self.cuts.append('Output limit of %d bytes reached after %d threads.  Remaining output discarded.'
+                             %(self.max_output, self.nthreads))
+            return
+        self.out.write(line+'\n')
+
+    def line(self, line):
+        line = line.rstrip('\n')
+        if _header.match(line):
+            self.flush()
+            self.block = [line]
+        elif self.block is not None and (_frame.match(line) or line.strip()==_more
+                                         or (line[:1] in (' ', '\t') and line.strip())):
+            # frames, and indented continuations (eg. eu-stack source lines)
+            self.block.append(line)
+        else:
+            self.flush()
+            if _terminated.match(line):
+                self.loading = True
+            elif self.loading and _frame.match(line):
+                self.loading = False
+            elif _frame.match(line):
+                # current (faulting) thread, before any headers
+                self.faulting += 1
+                self.top.append(line)
+            elif line.strip()==_more:
+                self.cuts.append('Faulting thread: frames beyond %s cut'%self.frames)
+            self.emit(line)
+
+    def flush(self):
+        'Emit, or collapse, the current thread block'
+        block, self.block = self.block, None
+        if block is None:
+            return
+        header, lines = block[0], [L for L in block[1:] if L.strip()!=_more]
+        frames = [L for L in lines if _frame.match(L)]
+        M = _lwp.search(header)
+        lwp = M and int(M.group(1))
+        if lwp is not None and lwp in self.seen:
+            # eg. LLDB shows the faulting thread first, under its header
+            self.emit(header)
+            self.emit('  (shown above)')
+            return
+        self.seen.add(lwp)
+        self.nthreads += 1
+        self.threads.append((lwp, self.top if self.faulting and lwp==self.lwp else lines))
+
+        if self.faulting and lwp is not None and lwp==self.lwp:
+            self.emit(header)
+            self.emit('  (faulting thread, shown above)')
+            return
+
+        if len(lines)<len(block)-1 or (self.depth and len(frames)>=self.depth):
+            self.ncut += 1
+
+        key = tuple(frame_key(L) for L in lines)
+        group = self.groups.get(key)
+        if group is not None and key:
+            group[1].append(lwp)
+            return
+        self.groups[key] = [header, []]
+        for L in block:
+            self.emit(L)
+
+    def close(self):
+        self.flush()
+        self.full = False # always show summary
+        collapsed = [G for G in self.groups.values() if G[1]]
+        if collapsed:
+            self.out.write('# Identical stacks collapsed\n')
+            for header, lwps in collapsed:
+                self.out.write('  %d more threads as %s\n    LWP %s\n'%(len(lwps), header.strip(), ranges(lwps)))
+        if self.ncut:
+            self.cuts.append('%d of %d threads: frames beyond %s cut'%(self.ncut, self.nthreads, self.depth))
+        if self.cuts:
+            self.out.write('# Analysis limits reached\n')
+            for cut in self.cuts:
+                self.out.write('  %s\n'%cut)
+
+def _pump(P, F, timeout=None):
+    '''Feed the output of process P, line by line, to F.line() until it exits,
+       timeout seconds have passed, or F.full.  Returns True if P was killed.
+    '''
+    fd = P.stdout.fileno()
+    deadline = _now()+timeout if timeout else None
+    buf, killed = b'', False
+    while True:
+        wait = None
+        if deadline is not None:
+            wait = deadline - _now()
+            if wait<=0:
+                F.cuts.append('Time limit of %s s reached.  %s killed.'%(timeout, os.path.basename(P.args[0])))
+                killed = True
+                break
+        ready, _w, _x = select.select([fd], [], [], wait)
+        if not ready:
+            continue
+        chunk = os.read(fd, 1<<16)
+        if not chunk:
+            break
+        lines = (buf+chunk).split(b'\n')
+        buf = lines.pop()
+        for L in lines:
+            F.line(L.decode('utf-8', 'replace'))
+        if F.full:
+            killed = True
+            break
+
+    if killed:
+        P.kill()
+    elif buf:
+        F.line(buf.decode('utf-8', 'replace'))
+    P.stdout.close()
+    return killed
+
+def _popen(cmd, env=None, pass_fds=()):
+    import subprocess as SP
+    kws = dict(pass_fds=pass_fds) if pass_fds else {} # py >= 3.2
+    P = SP.Popen(cmd, stdin=open(os.devnull, 'r'), stdout=SP.PIPE, stderr=SP.STDOUT, env=env, **kws)
+    P.args = cmd # py < 3.3
+    return P
+
+def run(cmd, out, env=None, timeout=None, max_output=None, frames=None, depth=None, lwp=None, pass_fds=()):
+    '''Run debugger command, writing its filtered output to file out.
+       Killed when timeout seconds have passed, or max_output bytes written.
+       lwp is the faulting thread.  pass_fds are kept open in the debugger.
+       Returns the StackFilter, with .code the exit code, or None if killed.
+    '''
+    out.flush()
+    P = _popen(cmd, env=env, pass_fds=pass_fds)
+    F = StackFilter(out, max_output=max_output, frames=frames, depth=depth, lwp=lwp)
+    killed = _pump(P, F, timeout)
+    code = P.wait()
+    F.close()
+    out.flush()
+    F.code = None if killed else code
+    return F
+
+def thread_ranges(nthreads, workers):
+    'Split thread numbers 1 to nthreads into at most workers contiguous (first, last) ranges'
+    n = max(1, min(workers, nthreads//SHARD_MIN))
+    ret, first = [], 1
+    for i in range(n):
+        last = first + (nthreads - first + 1)//(n - i) - 1
+        ret.append((first, last))
+        first = last+1
+    return ret
+
+def _spool():
+    'Temporary file for output, or memory if none can be created (eg. read-only /tmp of a container)'
+    import tempfile
+    try:
+        return tempfile.TemporaryFile()
+    except (IOError, OSError):
+        import io
+        return io.BytesIO()
+
+def run_sharded(cmds, out, env=None, timeout=None, max_output=None, frames=None, depth=None, lwp=None, pass_fds=()):
+    '''Run debugger commands in parallel, each printing the backtraces of a range of threads,
+       and write their filtered output to file out in order, as if from one run.
+       Output of the first is filtered as it is read.  Output of the others is spooled
+       to temporary files until then.  Output of all but the first before their first
+       thread header is skipped, being a repeat of the first.
+       Returns the StackFilter, with .code the first non-zero exit code, or None if killed.
+    '''
+    out.flush()
+    F = StackFilter(out, max_output=max_output, frames=frames, depth=depth, lwp=lwp)
+    procs = [_popen(cmd, env=env, pass_fds=pass_fds) for cmd in cmds]
+    spools = [None] + [_spool() for P in procs[1:]]
+    fds = dict((P.stdout.fileno(), n) for n, P in enumerate(procs))
+    deadline = _now()+timeout if timeout else None
+    buf, total, killed, cut = b'', 0, False, None
+    while fds and not killed:
+        wait = None
+        if deadline is not None:
+            wait = deadline - _now()
+            if wait<=0:
+                cut = 'Time limit of %s s reached.  %s killed.'%(timeout, os.path.basename(cmds[0][0]))
+                killed = True
+                break
+        ready, _w, _x = select.select(list(fds), [], [], wait)
+        for fd in ready:
+            chunk = os.read(fd, 1<<16)
+            if not chunk:
+                del fds[fd]
+                continue
+            total += len(chunk)
+            if fds[fd]==0:
+                lines = (buf+chunk).split(b'\n')
+                buf = lines.pop()
+                for L in lines:
+                    if not F.full:
+                        F.line(L.decode('utf-8', 'replace'))
+            else:
+                spools[fds[fd]].write(chunk)
+            if F.full:
+                killed = True
+            elif max_output and total > 4*max_output:
+                # before identical stacks are collapsed
+                cut = 'Output limit reached.  %s killed.'%os.path.basename(cmds[0][0])
+                killed = True
+
+    for P in procs:
+        if killed:
+            P.kill()
+        P.stdout.close()
+    codes = [P.wait() for P in procs]
+
+    if buf and not F.full:
+        F.line(buf.decode('utf-8', 'replace'))
+    for S in spools[1:]:
+        S.seek(0)
+        header = False
+        for L in S:
+            if F.full:
+                break
+            L = L.decode('utf-8', 'replace')
+            if L.endswith('\n'):
+                L = L[:-1]
+            header = header or _header.match(L) is not None
+            if header:
+                F.line(L)
+        S.close()
+    if cut:
+        F.cuts.append(cut)
+    F.close()
+    out.flush()
+    F.code = None if killed else ([C for C in codes if C] or [0])[0]
+    return F
+
+class Demux(object):
+    '''Split the output of one debugger run over many cores at marker lines,
+    "<mark> <name>", into a StackFilter for each core.
+    Output before the first marker (eg. loading symbols) is repeated for each core.
+    Output of a core beyond its max_output is dropped, without killing the debugger.
+    '''
+    full = False
+
+    def __init__(self, mark, filters):
+        self.mark, self.filters = mark+' ', filters
+        self.current = None
+        self.done = []     # names of cores whose output is complete
+        self.elapsed = {}  # name -> seconds
+        self.cuts = []
+        self.preamble = []
+        self._T0 = None
+
+    def line(self, line):
+        if line.startswith(self.mark) and line[len(self.mark):] in self.filters:
+            self.finish()
+            self.current, self._T0 = line[len(self.mark):], _now()
+            for L in self.preamble:
+                self.filters[self.current].line(L)
+        elif not self.done and self.current is None:
+            self.preamble.append(line)
+        elif self.current is not None and not self.filters[self.current].full:
+            self.filters[self.current].line(line)
+
+    def finish(self):
+        if self.current is not None:
+            self.done.append(self.current)
+            self.elapsed[self.current] = _now()-self._T0
+            self.current = None
+
+def run_batch(cmd, mark, cores, env=None, timeout=None, max_output=None, frames=None, depth=None):
+    '''Run one debugger command which analyzes many cores in turn,
+       writing the filtered output of each to its own file.
+       cores is a list of (name, out, lwp).  timeout is for the whole run.
+       Returns {name: StackFilter}, with .code 0 if the output for that core is complete,
+       the debugger exit code for the last core, or None if killed or not reached,
+       and .elapsed seconds.
+    '''
+    filters = {}
+    for name, out, lwp in cores:
+        out.flush()
+        filters[name] = StackFilter(out, max_output=max_output, frames=frames, depth=depth, lwp=lwp)
+    D = Demux(mark, filters)
+    P = _popen(cmd, env=env)
+    killed = _pump(P, D, timeout)
+    code = P.wait()
+    last = D.current
+    if killed and last is not None:
+        filters[last].cuts.extend(D.cuts)
+    D.finish()
+    for name, out, _lwp in cores:
+        F = filters[name]
+        F.elapsed = D.elapsed.get(name, 0.0)
+        if name not in D.done:
+            F.cuts.append('Not analyzed.  %s did not reach this core.'%os.path.basename(cmd[0]))
+            F.code = None
+        elif killed and name==last:
+            F.code = None
+        else:
+            F.code = code if name==last else 0
+        F.close()
+        out.flush()
+    return filters
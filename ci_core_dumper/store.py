@@ -0,0 +1,153 @@
+"""
+Content addressed store of the executables and libraries of crashed
+processes, so that a kept core can be analyzed again (reanalyze)
+after the container, or build tree, which produced it is gone.
+
+Files are named by ELF build-id, in the layout searched by
+GDB's 'set debug-file-directory'.
+
+  store/.build-id/ab/cdef...        executable or library
+  store/.build-id/ab/cdef....debug  separate debug info, if installed in the target
+
+Files without a build-id are named by the SHA-1 of their content, under store/.sha1/.
+A library mapped by many crashed processes is stored once.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from __future__ import print_function
+
+import os
+import errno
+import hashlib
+
+from .capture import capture
+from .elfcore import build_id
+
+STORE = 'store'
+
+# where distributions install separate debug info.  (in the target mount NS)
+DEBUG_DIR = '/usr/lib/debug'
+
+def mkdirs_at(path, D, owner):
+    'Create relative path, and parents, under directory D (fd)'
+    cur = None
+    for part in path.split('/'):
+        cur = part if cur is None else cur+'/'+part
+        try:
+            os.mkdir(cur, 0o755, dir_fd=D)
+            os.chown(cur, owner.st_uid, owner.st_gid, dir_fd=D)
+        except OSError as e:
+            if e.errno!=errno.EEXIST:
+                raise
+
+def link_or_copy(path, dest, D, owner):
+    '''Hard link, or copy, path to relative dest under directory D (fd).
+       A copy is written to a temporary name, then renamed, so dest is
+       never seen incomplete.  Returns 'Link' or 'Copy'.
+    '''
+    try:
+        os.link(path, dest, dst_dir_fd=D)
+        return 'Link'
+    except OSError as e:
+        if e.errno==errno.EEXIST:
+            raise
+        # eg. EXDEV.  fall back to copy
+    tmp = '%s.tmp%d'%(dest, os.getpid())
+    fd = os.open(tmp, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0o644, dir_fd=D)
+    try:
+        with open(path, 'rb') as SF, os.fdopen(fd, 'wb') as DF:
+            os.fchown(fd, owner.st_uid, owner.st_gid)
+            capture(SF, DF, sparse=False)
+        os.rename(tmp, dest, src_dir_fd=D, dst_dir_fd=D)
+    except:
+        try:
+            os.unlink(tmp, dir_fd=D)
+        except OSError:
+            pass
+        raise
+    return 'Copy'
+
+def mapped_files(pid, exe):
+    'The executable, and all files mapped by target PID'
+    paths = [exe]
+    with open('/proc/{}/maps'.format(pid), 'r') as F:
+        for L in F:
+            parts = L.split(None, 5)
+            if len(parts)==6 and parts[5].startswith('/'):
+                path = parts[5].rstrip('\n')
+                if path not in paths and os.path.isfile(path): # excludes '(deleted)'
+                    paths.append(path)
+    return paths
+
+def file_key(path):
+    'Returns (store relative name, build-id or None)'
+    with open(path, 'rb') as F:
+        bid = build_id(F)
+        if bid:
+            return '.build-id/%s/%s'%(bid[:2], bid[2:]), bid
+        F.seek(0)
+        H = hashlib.sha1()
+        for blk in iter(lambda: F.read(1<<20), b''):
+            H.update(blk)
+        digest = H.hexdigest()
+        return '.sha1/%s/%s'%(digest[:2], digest[2:]), None
+
+def add(path, D, owner):
+    '''Store one file, and its separate debug info, in store directory D (fd).
+       Returns module entry for a crash record.
+    '''
+    key, bid = file_key(path)
+    ret = dict(path=path, build_id=bid, key=key)
+
+    todo = [(path, key)]
+    if bid:
+        debug = os.path.join(DEBUG_DIR, key+'.debug')
+        if os.path.isfile(debug):
+            todo.append((debug, key+'.debug'))
+
+    for src, dest in todo:
+        try:
+            os.stat(dest, dir_fd=D)
+            continue # already stored
+        except OSError as e:
+            if e.errno!=errno.ENOENT:
+                raise
+        mkdirs_at(os.path.dirname(dest), D, owner)
+        try:
+            print('Store', link_or_copy(src, dest, D, owner), src)
+        except OSError as e:
+            if e.errno!=errno.EEXIST:
+                raise
+            # stored concurrently
+    return ret
+
+def save(pid, exe, D):
+    '''Store executable and mapped files of target PID in store directory D (fd).
+       Returns list of module entries for a crash record.
+    '''
+    owner = os.fstat(D)
+    modules = []
+    for path in mapped_files(pid, exe):
+        try:
+            modules.append(add(path, D, owner))
+        except (IOError, OSError) as e:
+            print('Unable to store %s : %r'%(path, e))
+    return modules
+
+def sysroot(store, modules, root):
+    '''Populate directory root with symlinks, at their original paths,
+       to files in the store.  For GDB's 'set sysroot'.
+       Returns list of modules missing from the store.
+    '''
+    missing = []
+    for M in modules:
+        target = os.path.join(store, M['key'])
+        if not os.path.isfile(target):
+            missing.append(M)
+            continue
+        link = root+M['path']
+        if not os.path.isdir(os.path.dirname(link)):
+            os.makedirs(os.path.dirname(link))
+        if not os.path.lexists(link):
+            os.symlink(target, link)
+    return missing
@@ -0,0 +1,8 @@
+"""
+Unit tests of the parsers, which need no debugger or crash.
+
+  python -m unittest discover -s ci_core_dumper/test -t .
+
+Samples of debugger output are as captured from GDB, eu-stack, LLDB, and CDB.
+"""
+# SPDX-License-Identifier: GPL-3.0-or-later
@@ -0,0 +1,178 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+'''Debugger output of "crasher threads 2", whose main thread crashed in inner(),
+called by outer() and main(), while another thread waits in pause().
+Also a tiny core file, as Linux would write.
+'''
+
+import struct
+
+from ..elfcore import NT_PRSTATUS, NT_PRPSINFO, NT_SIGINFO, NT_FILE, PT_LOAD, PT_NOTE, PF_R, PF_W
+
+# gdb -ex 'bt 256' -ex 'thread apply all bt 32'
+GDB = '''\
+[New LWP 1234]
+[New LWP 1235]
+[Thread debugging using libthread_db enabled]
+Using host libthread_db library "/lib/x86_64-linux-gnu/libthread_db.so.1".
+Core was generated by `./crasher threads 2'.
+Program terminated with signal SIGSEGV, Segmentation fault.
+#0  0x000055d0c8a2a1ed in inner () at crasher.c:24
+24	    return *oops;
+[Current thread is 1 (Thread 0x7f3c1a2b3740 (LWP 1234))]
+#0  0x000055d0c8a2a1ed in inner () at crasher.c:24
+#1  outer (n=2) at crasher.c:60
+#2  0x000055d0c8a2a3aa in main (argc=3, argv=0x7ffd5e3b9a48) at crasher.c:88
+
+Thread 2 (Thread 0x7f3c19ab2640 (LWP 1235)):
+#0  0x00007f3c1a2e5b1e in pause () from /lib/x86_64-linux-gnu/libc.so.6
+#1  0x000055d0c8a2a200 in park (raw=0x0) at crasher.c:40
+#2  0x00007f3c1a294ac3 in start_thread (arg=<optimized out>) at ./nptl/pthread_create.c:442
+#3  0x00007f3c1a326850 in clone3 () at ../sysdeps/unix/sysv/linux/x86_64/clone3.S:81
+
+Thread 1 (Thread 0x7f3c1a2b3740 (LWP 1234)):
+#0  0x000055d0c8a2a1ed in inner () at crasher.c:24
+#1  outer (n=2) at crasher.c:60
+#2  0x000055d0c8a2a3aa in main (argc=3, argv=0x7ffd5e3b9a48) at crasher.c:88
+'''
+
+# as written by the core_pattern handler before the triage summary.  'thread apply all bt' only
+GDB_OLD_LOG = '''\
+Dumping PID 1234 (1234) @ 1700000000 Tue Nov 14 22:13:20 2023
+EXE: /src/crasher
+CMDLINE: ['./crasher', 'threads', '2']
+Core was generated by `./crasher threads 2'.
+Program terminated with signal SIGSEGV, Segmentation fault.
+#0  0x000055d0c8a2a1ed in inner () at crasher.c:24
+24	    return *oops;
+[Current thread is 1 (Thread 0x7f3c1a2b3740 (LWP 1234))]
+
+Thread 2 (Thread 0x7f3c19ab2640 (LWP 1235)):
+#0  0x00007f3c1a2e5b1e in pause () from /lib/x86_64-linux-gnu/libc.so.6
+#1  0x000055d0c8a2a200 in park (raw=0x0) at crasher.c:40
+
+Thread 1 (Thread 0x7f3c1a2b3740 (LWP 1234)):
+#0  0x000055d0c8a2a1ed in inner () at crasher.c:24
+#1  0x000055d0c8a2a2ff in outer (n=2) at crasher.c:60
+#2  0x000055d0c8a2a3aa in main (argc=3, argv=0x7ffd5e3b9a48) at crasher.c:88
+'''
+
+# eu-stack -i -m -s --core=...
+EUSTACK = '''\
+PID 1234 - core
+TID 1234:
+#0  0x000055d0c8a2a1ed inner - /src/crasher
+    /src/crasher.c:24:12
+#1  0x000055d0c8a2a2ff outer - /src/crasher
+    /src/crasher.c:60:5
+#2  0x000055d0c8a2a3aa main - /src/crasher
+    /src/crasher.c:88
+#3  0x00007f3c1a229d90 __libc_start_call_main - /lib/x86_64-linux-gnu/libc.so.6
+TID 1235:
+#0  0x00007f3c1a2e5b1e pause - /lib/x86_64-linux-gnu/libc.so.6
+#1  0x000055d0c8a2a200 park - /src/crasher
+    /src/crasher.c:40:9
+#2  0x00007f3c1a294ac3 start_thread - /lib/x86_64-linux-gnu/libc.so.6
+'''
+
+# lldb --batch -o 'thread backtrace -c 256' -o 'thread backtrace all -c 32', with LLDB._formats
+LLDB = '''\
+(lldb) target create "/src/crasher" --core "/tmp/core.ccd.1234"
+Core file '/tmp/core.ccd.1234' (x86_64) was loaded.
+(lldb) thread backtrace -c 256
+* thread #1: tid = 1234, name = 'crasher', stop reason = signal SIGSEGV
+  * frame #0: 0x000055d0c8a2a1ed crasher`inner at crasher.c:24:12
+    frame #1: 0x000055d0c8a2a2ff crasher`outer(n=2) at crasher.c:60:5
+    frame #2: 0x000055d0c8a2a3aa crasher`main(argc=3, argv=0x00007ffd5e3b9a48) at crasher.c:88:12
+    frame #3: 0x00007f3c1a229d90 libc.so.6`__libc_start_call_main + 128
+(lldb) thread backtrace all -c 32
+* thread #1: tid = 1234, name = 'crasher', stop reason = signal SIGSEGV
+  * frame #0: 0x000055d0c8a2a1ed crasher`inner at crasher.c:24:12
+    frame #1: 0x000055d0c8a2a2ff crasher`outer(n=2) at crasher.c:60:5
+    frame #2: 0x000055d0c8a2a3aa crasher`main(argc=3, argv=0x00007ffd5e3b9a48) at crasher.c:88:12
+    frame #3: 0x00007f3c1a229d90 libc.so.6`__libc_start_call_main + 128
+  thread #2: tid = 1235, name = 'crasher'
+    frame #0: 0x00007f3c1a2e5b1e libc.so.6`pause + 14
+    frame #1: 0x000055d0c8a2a200 crasher`park(raw=0x0000000000000000) at crasher.c:40:9
+'''
+
+# log written by windows.dump().  cdb '~* kP n' and '!analyze'
+CDB_LOG = '''\
+PID: 7460
+Microsoft (R) Windows Debugger Version 10.0.22621.2428 AMD64
+Copyright (c) Microsoft Corporation. All rights reserved.
+
+Modules list
+start             end                 module name
+00007ff6`3e2d0000 00007ff6`3e2f7000   crasher    (private pdb symbols)  D:\\a\\src\\crasher.pdb
+00007ffb`0bf00000 00007ffb`0c0f0000   ntdll      (pdb symbols)          c:\\symcache\\ntdll.pdb\\1\\ntdll.pdb
+Stacks
+
+.  0  Id: 1d24.1a3c Suspend: 1 Teb: 000000c9`1a4d7000 Unfrozen
+ # Child-SP          RetAddr               Call Site
+00 000000c9`1a2ff8d0 00007ff6`3e2d10a9     crasher!inner(void)+0x1e [D:\\a\\src\\crasher.c @ 24]
+01 000000c9`1a2ff900 00007ff6`3e2d1e54     crasher!outer(
+\t\t\tint n = 0n2)+0x2c [D:\\a\\src\\crasher.c @ 60]
+02 000000c9`1a2ff940 00007ff6`3e2d1e99     crasher!main(
+\t\t\tint argc = 0n3,
+\t\t\tchar ** argv = 0x00000203`a5b41f80)+0x5c [D:\\a\\src\\crasher.c @ 88]
+03 000000c9`1a2ff980 00007ffb`0bf5cc91     KERNEL32!BaseThreadInitThunk+0x14
+04 000000c9`1a2ff9b0 00000000`00000000     ntdll!RtlUserThreadStart+0x21
+
+   1  Id: 1d24.2b10 Suspend: 1 Teb: 000000c9`1a4d9000 Unfrozen
+ # Child-SP          RetAddr               Call Site
+00 000000c9`1a5ffa28 00007ffb`0bf32dc7     ntdll!NtWaitForWorkViaWorkerFactory+0x14
+01 000000c9`1a5ffa30 00007ffb`0a4b7374     ntdll!TppWorkerThread+0x2f7
+analysis
+
+EXCEPTION_CODE_STR:  c0000005
+
+PROCESS_NAME:  crasher.exe
+
+End
+'''
+
+RIP, RSP = 16, 19 # in x86_64 elf_gregset_t
+STACK = 128<<10
+
+def _note(ntype, desc):
+    name = b'CORE\0'
+    return (struct.pack('<III', len(name), len(desc), ntype)
+            + name + b'\0'*(-len(name)%4) + desc + b'\0'*(-len(desc)%4))
+
+def make_core(pid=1234, pc=0x401136, sp=0x7ffc00000f00, pagesize=4096, stack=STACK, fill=b'\xcc'):
+    '''A tiny x86_64 core, as written by Linux.  One thread, which received SIGSEGV
+       at address 0 while running /src/crasher, mapped from file page 2.
+       stack bytes of anonymous memory, repeating fill, follow the notes.
+    '''
+    regs = [0]*27
+    regs[RIP], regs[RSP] = pc, sp
+    prstatus = bytearray(336)
+    struct.pack_into('<i', prstatus, 0, 11) # pr_info.si_signo
+    struct.pack_into('<i', prstatus, 32, pid) # pr_pid
+    struct.pack_into('<27Q', prstatus, 112, *regs)
+
+    siginfo = bytearray(128)
+    struct.pack_into('<iiiiQ', siginfo, 0, 11, 0, 1, 0, 0) # SEGV_MAPERR at NULL
+
+    files = [(0x400000, 0x402000, 2, b'/src/crasher'), (0x7f0000000000, 0x7f0000020000, 0, b'/lib/libc.so.6')]
+    ntfile = struct.pack('<QQ', len(files), pagesize)
+    for start, end, pgoff, _name in files:
+        ntfile += struct.pack('<QQQ', start, end, pgoff)
+    ntfile += b''.join(F[3]+b'\0' for F in files)
+
+    psinfo = bytearray(136)
+    psinfo[-96:-96+7] = b'crasher'
+    psinfo[-80:-80+13] = b'crasher crash'
+
+    notes = (_note(NT_PRSTATUS, bytes(prstatus)) + _note(NT_PRPSINFO, bytes(psinfo))
+             + _note(NT_SIGINFO, bytes(siginfo)) + _note(NT_FILE, ntfile))
+
+    phoff, phnum = 64, 2
+    noteoff = phoff + 56*phnum
+    loadoff = (noteoff + len(notes) + 4095)&~4095
+    ehdr = b'\x7fELF\x02\x01\x01' + b'\0'*9 + struct.pack('<HHIQQQIHHHHHH', 4, 62, 1, 0, phoff, 0, 0,
+                                                              64, 56, phnum, 0, 0, 0)
+    phdrs = (struct.pack('<IIQQQQQQ', PT_NOTE, 0, noteoff, 0, 0, len(notes), 0, 0)
+             + struct.pack('<IIQQQQQQ', PT_LOAD, PF_R|PF_W, loadoff, sp & ~0xffff, 0, stack, stack, 4096))
+    core = ehdr + phdrs + notes
+    return core + b'\0'*(loadoff-len(core)) + (fill*(stack//len(fill)+1))[:stack]
@@ -0,0 +1,126 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import io
+import os
+import json
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from ..aggregate import parse_log, parse, tables, find, update, load_index
+from ..buckets import signature
+from . import samples
+
+# log of linux.dump() with a triage summary of the core notes
+TRIAGE_LOG = samples.GDB_OLD_LOG.split('Core was')[0] + '''\
+# Triage
+  Program: crasher  Args: ./crasher threads 2
+  Signal: 11 SIGSEGV code 1  fault address 0x0
+  Machine: x86_64  Threads: 2  Mapped files: 9
+  Thread LWP 1234 (crashed)  pc 0x55d0c8a2a1ed /src/crasher+0x11ed  sp 0x7ffd5e3b9900
+  Thread LWP 1235  pc 0x7f3c1a2e5b1e /lib/libc.so.6+0xe5b1e  sp 0x7f3c19ab1e00
+''' + samples.GDB
+
+class TestLinux(unittest.TestCase):
+    def test_old(self):
+        'Without triage summary, from GDB alone'
+        E = parse_log('/out/1700000000.1234.txt', samples.GDB_OLD_LOG.encode('utf-8'))
+        self.assertEqual((E['platform'], E['pid'], E['time'], E['exe'], E['signal']),
+                         ('Linux', 1234, 1700000000, '/src/crasher', 'SIGSEGV'))
+        self.assertEqual(E['frames'], ['inner', 'outer', 'main'])
+        self.assertEqual(E['log'], '1700000000.1234.txt')
+
+        # older GDB prints the signal number
+        E2 = parse_log('1700000000.1234.txt', samples.GDB_OLD_LOG.replace(
+            'signal SIGSEGV, Segmentation', 'signal 11, Segmentation').encode('utf-8'))
+        self.assertEqual((E2['signal'], E2['signature']), ('SIGSEGV', E['signature']))
+
+    def test_triage(self):
+        E = parse_log('1700000000.1234.txt', TRIAGE_LOG.encode('utf-8'))
+        self.assertEqual((E['pid'], E['signal']), (1234, 'SIGSEGV'))
+        # inlined outer() omitted, as in the crash record
+        self.assertEqual(E['frames'], ['inner', 'main'])
+
+    def test_record(self):
+        'The crash record is used instead of the log text'
+        rec = dict(time=1700000000, pid=1234, exe='/src/crasher', signal=dict(signo=11, name='SIGSEGV'),
+                   threads=[dict(lwp=1234, crashed=True, frames=[dict(pc=1, function='inner'),
+                                                                 dict(pc=2, function='main')])])
+        E = parse_log('1700000000.1234.txt', b'', record=json.dumps(rec).encode('utf-8'))
+        self.assertEqual((E['pid'], E['signal'], E['frames']), (1234, 'SIGSEGV', ['inner', 'main']))
+        self.assertEqual(E['signature'], signature(rec)[0])
+
+        # not a crash record
+        E = parse_log('1700000000.1234.txt', samples.GDB_OLD_LOG.encode('utf-8'), record=b'{')
+        self.assertEqual(E['frames'], ['inner', 'outer', 'main'])
+
+    def test_unknown(self):
+        E = parse_log('1700000005.99.txt', b'something else\n')
+        self.assertEqual((E['time'], E['frames']), (1700000005, []))
+
+class TestWindows(unittest.TestCase):
+    def test_cdb(self):
+        E = parse_log('1700000000.7460.txt', samples.CDB_LOG.encode('utf-8'))
+        self.assertEqual((E['platform'], E['pid'], E['exe'], E['signal']),
+                         ('Windows', 7460, 'crasher.exe', 'c0000005'))
+        self.assertEqual(E['frames'], ['inner', 'outer', 'main', 'BaseThreadInitThunk', 'RtlUserThreadStart'])
+
+class TestFiles(unittest.TestCase):
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.outdir)
+
+    def test_tar(self):
+        name = os.path.join(self.outdir, 'job1.tar.gz')
+        with tarfile.open(name, 'w:gz') as T:
+            for member, text in (('cores/1700000000.1234.txt', samples.GDB_OLD_LOG),
+                                 ('cores/1700000100.7460.txt', samples.CDB_LOG),
+                                 ('cores/README', 'not a log')):
+                data = text.encode('utf-8')
+                info = tarfile.TarInfo(member)
+                info.size = len(data)
+                T.addfile(info, io.BytesIO(data))
+
+        path, entries = parse(name)
+        self.assertEqual(path, name)
+        self.assertEqual([(E['log'], E['platform'], E['dir']) for E in entries],
+                         [('1700000000.1234.txt', 'Linux', name+':cores'),
+                          ('1700000100.7460.txt', 'Windows', name+':cores')])
+
+        _cols, rows = tables(entries)['signature']
+        self.assertEqual(sorted(row[3] for row in rows), ['inner outer main', 'inner outer main BaseThreadInitThunk RtlUserThreadStart'])
+
+    def write(self, name, text):
+        path = os.path.join(self.outdir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as F:
+            F.write(text)
+        return path
+
+    def test_update(self):
+        A = self.write('job1/1700000000.1234.txt', samples.GDB_OLD_LOG)
+        B = self.write('job2/1700000100.7460.txt', samples.CDB_LOG)
+        self.write('job1/README.txt', 'not a log')
+        self.write('job1/build.1.log.txt', 'not a log')
+        self.assertEqual(sorted(find([self.outdir])), [A, B])
+
+        index = load_index(os.path.join(self.outdir, 'missing.json'))
+        entries, errors = update([self.outdir], index, jobs=1)
+        self.assertEqual((len(entries), errors), (2, []))
+        self.assertEqual(sorted(index['files']), [A, B])
+
+        # unchanged files are not parsed again, and deleted ones dropped
+        index['files'][A]['logs'][0]['exe'] = 'cached'
+        os.remove(B)
+        entries, errors = update([self.outdir], index, jobs=1)
+        self.assertEqual([E['exe'] for E in entries], ['cached'])
+        self.assertEqual(list(index['files']), [A])
+
+    def test_error(self):
+        path, ret = parse(os.path.join(self.outdir, 'missing.txt'))
+        self.assertIn('error', ret)
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from ..buckets import INDEX, Index, frame_name, normalize, signature
+from ..record import COMPLETE, DEFERRED, TRIAGE
+
+def crash(log, frames, signame='SIGSEGV', time=1700000000, **thread):
+    thread.setdefault('crashed', True)
+    return dict(log=log, time=time, exe='/src/crasher', status=COMPLETE, signal=dict(signo=11, name=signame),
+                threads=[dict(lwp=1235, crashed=False, frames=[dict(pc=1, function='pause')]),
+                         dict(lwp=1234, frames=frames, **thread)])
+
+def calls(*names):
+    return [dict(pc=n, function=name) for n, name in enumerate(names)]
+
+class TestSignature(unittest.TestCase):
+    def test_frame_name(self):
+        self.assertEqual(frame_name(dict(function='inner.constprop.0.isra.0')), 'inner')
+        self.assertEqual(frame_name(dict(function='outer.cold')), 'outer')
+        self.assertEqual(frame_name(dict(function='__GI_raise')), 'raise')
+        self.assertEqual(frame_name(dict(function='ns::cls::meth(int, char const*)')), 'ns::cls::meth')
+        self.assertEqual(frame_name(dict(function=None, module='/src/libfoo.so')), '?? libfoo.so')
+        self.assertEqual(frame_name(dict(pc=0)), '??')
+
+    def test_normalize(self):
+        self.assertIsNone(normalize(dict(function='__GI_abort')))
+        self.assertIsNone(normalize(dict(function='outer', inline=True)))
+        self.assertIsNone(normalize(dict(error='Cannot access memory at address 0x0')))
+        self.assertEqual(normalize(dict(function='main')), 'main')
+
+    def test_signature(self):
+        sig, frames = signature(crash('a.txt', calls('inner', 'outer', 'main', '__libc_start_call_main')))
+        self.assertEqual(frames, ['SIGSEGV', 'inner', 'outer', 'main'])
+        self.assertEqual(len(sig), 16)
+
+        # addresses, arguments, and abort() do not matter
+        frames = [dict(pc=10, function='__pthread_kill_implementation'), dict(pc=11, function='__GI_raise'),
+                  dict(pc=12, function='__GI_abort'), dict(pc=20, function='inner.isra.0'),
+                  dict(pc=None, function='outer', inline=True), dict(pc=21, function='outer(n=2)'),
+                  dict(pc=22, function='main')]
+        self.assertEqual(signature(crash('b.txt', frames))[0], sig)
+
+        self.assertNotEqual(signature(crash('c.txt', calls('inner', 'outer', 'main'), signame='SIGBUS'))[0], sig)
+        self.assertEqual(signature(crash('d.txt', calls('a', 'b', 'c', 'd', 'e', 'f', 'g')), depth=3)[1],
+                         ['SIGSEGV', 'a', 'b', 'c'])
+
+    def test_triage(self):
+        'Without frames, the module of the faulting PC'
+        rec = crash('a.txt', [], module='/src/crasher+0x11ed')
+        rec['status'] = TRIAGE
+        self.assertEqual(signature(rec)[1], ['SIGSEGV', 'crasher+0x11ed'])
+        self.assertEqual(signature(dict(threads=[]))[1], ['?'])
+
+class TestIndex(unittest.TestCase):
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.outdir)
+
+    def test_missing(self):
+        'Nothing to record is not an error, and creates nothing'
+        missing = os.path.join(self.outdir, 'missing')
+        self.assertEqual(Index(missing).update([]), {})
+        self.assertFalse(os.path.exists(missing))
+
+        pending = crash('a.txt', calls('inner'))
+        pending['status'] = DEFERRED
+        self.assertEqual(Index(self.outdir).update([pending, dict(log='b.txt', time=1)]), {})
+        self.assertEqual(os.listdir(self.outdir), [])
+
+    def test_update(self):
+        A1 = crash('a1.txt', calls('inner', 'outer', 'main'))
+        A2 = crash('a2.txt', calls('inner', 'outer', 'main'), time=1700000100)
+        B = crash('b.txt', calls('other', 'main'))
+
+        buckets = Index(self.outdir).update([A1, B])
+        self.assertEqual(sorted(len(V) for V in buckets.values()), [1, 1])
+        self.assertEqual(buckets[A1['signature']][0]['frames'], ['SIGSEGV', 'inner', 'outer', 'main'])
+
+        # records seen before are not indexed twice
+        buckets = Index(self.outdir).update([A1, A2, B])
+        self.assertEqual([E['log'] for E in buckets[A1['signature']]], ['a1.txt', 'a2.txt'])
+        self.assertEqual([E['log'] for E in buckets[B['signature']]], ['b.txt'])
+
+        with open(os.path.join(self.outdir, INDEX)) as F:
+            self.assertEqual([json.loads(line)['log'] for line in F], ['a1.txt', 'b.txt', 'a2.txt'])
+
+        # read back only
+        self.assertEqual(Index(self.outdir).update([]), buckets)
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import io
+import os
+import errno
+import threading
+import tempfile
+import unittest
+
+from ..capture import capture, compressor, decompressor, expand, have_codec, BLOCK_SIZE, HOLE_SIZE
+from ..elfcore import CoreParser
+from .samples import make_core
+
+def _zeros(n):
+    return b'\0'*n
+
+# data, with holes in the middle and at the end
+SPARSE = (b'x'*100 + _zeros(3*HOLE_SIZE-100) + b'y'*HOLE_SIZE + _zeros(BLOCK_SIZE)
+          + b'z'*(HOLE_SIZE+1) + _zeros(2*HOLE_SIZE-1) + b'w' + _zeros(BLOCK_SIZE+HOLE_SIZE-1))
+
+class Collect(object):
+    'Tee which keeps everything'
+    def __init__(self):
+        self.parts, self.closed = [], False
+    def write(self, data):
+        self.parts.append(bytes(bytearray(data))) # memoryview
+    def close(self):
+        self.closed = True
+
+class TestCapture(unittest.TestCase):
+    def capture(self, data, out=True, **kws):
+        R, W = os.pipe()
+        def feed():
+            with os.fdopen(W, 'wb') as F:
+                F.write(data)
+        T = threading.Thread(target=feed)
+        T.start()
+        with os.fdopen(R, 'rb') as IF, tempfile.TemporaryFile() as OF:
+            S = capture(IF, OF if out else None, **kws)
+            T.join()
+            OF.seek(0)
+            return S, OF.read()
+
+    def without(self, name, error=None):
+        'Remove, or break, os.splice or os.sendfile for this test'
+        orig = getattr(os, name, None)
+        if orig is None:
+            return
+        if error is None:
+            delattr(os, name)
+        else:
+            def broken(*args):
+                raise OSError(error, os.strerror(error))
+            setattr(os, name, broken)
+        self.addCleanup(setattr, os, name, orig)
+
+    def test_sparse(self):
+        T = Collect()
+        S, out = self.capture(SPARSE, tees=[T])
+        self.assertEqual(out, SPARSE)
+        self.assertEqual(b''.join(T.parts), SPARSE)
+        self.assertTrue(T.closed)
+        self.assertEqual((S.method, S.nbytes, S.holes), ('sparse', len(SPARSE), 4))
+        self.assertEqual(S.written + S.holebytes, len(SPARSE))
+        self.assertEqual(S.holebytes, 2*HOLE_SIZE + BLOCK_SIZE + HOLE_SIZE + BLOCK_SIZE)
+
+    def test_kernel(self):
+        S, out = self.capture(SPARSE, sparse=False)
+        self.assertEqual(out, SPARSE)
+        self.assertEqual((S.nbytes, S.written, S.holes), (len(SPARSE), len(SPARSE), 0))
+        if hasattr(os, 'splice'):
+            self.assertEqual(S.method, 'splice')
+
+    def test_fallback(self):
+        'Without splice(), and when sendfile() fails'
+        self.without('splice')
+        self.without('sendfile', errno.EINVAL)
+        S, out = self.capture(SPARSE, sparse=False)
+        self.assertEqual(out, SPARSE)
+        self.assertEqual((S.method, S.nbytes), ('copy', len(SPARSE)))
+
+    def test_user(self):
+        'A tee which needs everything'
+        T = Collect()
+        S, out = self.capture(SPARSE, sparse=False, tees=[T])
+        self.assertEqual(out, SPARSE)
+        self.assertEqual(b''.join(T.parts), SPARSE)
+        self.assertEqual(S.method, 'copy')
+
+        T = Collect()
+        S, out = self.capture(SPARSE, out=False, tees=[T])
+        self.assertEqual((out, S.method, S.written), (b'', 'tee', 0))
+        self.assertEqual(b''.join(T.parts), SPARSE)
+
+    def test_kernel_tee(self):
+        'With a parser as tee, only the notes pass through user space'
+        core, P = make_core(), CoreParser()
+        S, out = self.capture(core, sparse=False, tees=[P])
+        self.assertEqual(out, core)
+        self.assertEqual(S.nbytes, len(core))
+        self.assertTrue(P.complete)
+        self.assertLess(P.offset, len(core))
+        if hasattr(os, 'splice'):
+            self.assertEqual(S.method, 'splice')
+
+    def test_sparse_tee(self):
+        core, P = make_core(), CoreParser()
+        S, out = self.capture(core, sparse=True, tees=[P])
+        self.assertEqual(out, core)
+        self.assertEqual(S.method, 'sparse')
+        self.assertTrue(P.complete)
+        self.assertEqual(P.offset, len(core))
+
+class TestCodecs(unittest.TestCase):
+    def test_roundtrip(self):
+        for codec in ('gzip', 'lzma', 'zstd'):
+            if not have_codec(codec):
+                continue
+            F = io.BytesIO()
+            C = compressor(codec, F)
+            C.write(SPARSE)
+            C.close()
+            self.assertLess(len(F.getvalue()), len(SPARSE)//10, codec)
+
+            F.seek(0)
+            with tempfile.TemporaryFile() as OF:
+                expand(decompressor(codec, F), OF)
+                OF.seek(0)
+                self.assertEqual(OF.read(), SPARSE, codec)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, compressor, 'zip', io.BytesIO())
+        self.assertRaises(ValueError, decompressor, 'zip', io.BytesIO())
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..cgroup import CGroup, summary, write_oom
+from ..aggregate import parse_log
+from .. import record
+
+class TestResources(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.CG = CGroup(self.dir, '/')
+
+    def write(self, name, text):
+        with open(os.path.join(self.dir, name), 'w') as F:
+            F.write(text)
+
+    def test_cpu_only(self):
+        'Without the memory and io controllers'
+        self.write('cpu.stat', 'usage_usec 2500000\nuser_usec 2000000\nsystem_usec 500000\nnr_periods 0\n')
+        R = self.CG.resources()
+        self.assertEqual(R['cpu'], dict(usage_usec=2500000, user_usec=2000000, system_usec=500000))
+        self.assertEqual(R['memory'], dict(peak=None, swap_peak=None, max=None, events=None))
+        self.assertEqual((R['io'], R['oom_kill']), (None, 0))
+        self.assertEqual(summary(R), 'CPU 2.50 s (user 2.00 s, system 0.50 s)')
+
+    def test_all(self):
+        self.write('cpu.stat', 'usage_usec 1000000\n')
+        self.write('memory.peak', '3145728\n')
+        self.write('memory.max', 'max\n')
+        self.write('memory.events', 'low 0\nhigh 0\nmax 4\noom 1\noom_kill 2\n')
+        self.write('io.stat', '8:0 rbytes=1048576 wbytes=0 rios=1 wios=0 dbytes=0 dios=0\n'
+                              '8:16 rbytes=1048576 wbytes=524288 rios=2 wios=1\n')
+        R = self.CG.resources()
+        self.assertEqual((R['memory']['peak'], R['memory']['max'], R['memory']['events']['max']),
+                         (3<<20, 'max', 4))
+        self.assertEqual(R['io'], dict(rbytes=2<<20, wbytes=512<<10, rios=3, wios=1))
+        self.assertEqual(R['oom_kill'], 2)
+        self.assertEqual(summary(R), 'peak memory 3.0 MB, CPU 1.00 s (user 0.00 s, system 0.00 s), '
+                                     'read 2.0 MB, written 0.5 MB, 2 OOM kills')
+
+    def test_corrupt(self):
+        self.write('cpu.stat', 'garbage\n')
+        R = self.CG.resources()
+        self.assertEqual(R['cpu'], {})
+        self.assertEqual(summary(R), 'no usage counted')
+
+class TestOOM(unittest.TestCase):
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.outdir)
+
+    def test_record(self):
+        R = dict(cgroup='/sys/fs/cgroup/ccd.1', oom_kill=1, cpu={}, io=None,
+                 memory=dict(peak=1<<30, swap_peak=None, max=1<<30, events=dict(max=9, oom=1, oom_kill=1)))
+        cmd = ['/usr/bin/make', 'check']
+        logfile = write_oom(self.outdir, '1700000000.42', R, cmd, -9)
+        self.assertEqual(logfile, os.path.join(self.outdir, '1700000000.42.txt'))
+
+        with open(logfile, 'r') as F:
+            log = F.read()
+        self.assertTrue(log.startswith('OOM PID 42 (42) @ 1700000000 '))
+        self.assertIn('1 processes killed by the OOM killer in cgroup /sys/fs/cgroup/ccd.1\n', log)
+        self.assertIn('memory.events: max 9 oom 1 oom_kill 1\n', log)
+
+        rec = record.load(os.path.join(self.outdir, '1700000000.42.json'))
+        self.assertEqual((rec['status'], rec['signal'], rec['time'], rec['pid'], rec['exe']),
+                         (record.OOM, dict(signo=9, name='OOM'), 1700000000, 42, '/usr/bin/make'))
+        self.assertEqual(rec['resources'], R)
+
+        # as seen by aggregate
+        with open(os.path.join(self.outdir, '1700000000.42.json'), 'rb') as F:
+            E = parse_log(logfile, log.encode('utf-8'), record=F.read())
+        self.assertEqual((E['pid'], E['signal'], E['exe']), (42, 'OOM', '/usr/bin/make'))
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import tempfile
+import unittest
+
+from ..elfcore import CoreParser, ReducedCore, signame, PT_LOAD
+from .samples import make_core
+
+class TestCoreParser(unittest.TestCase):
+    def parse(self, core, block=100):
+        P = CoreParser()
+        for n in range(0, len(core), block):
+            P.write(core[n:n+block])
+        P.close()
+        return P
+
+    def test_notes(self):
+        P = self.parse(make_core())
+        self.assertIsNone(P.error)
+        self.assertTrue(P.complete)
+        self.assertTrue(P.satisfied)
+        self.assertEqual(P.machine, 'x86_64')
+        self.assertEqual(P.psinfo, ('crasher', 'crasher crash'))
+        self.assertEqual([(T.pid, T.signo, T.pc, T.sp) for T in P.threads],
+                         [(1234, 11, 0x401136, 0x7ffc00000f00)])
+        self.assertEqual(P.module(0x401136), '/src/crasher+0x3136')
+        self.assertEqual(P.module(0x7f0000000010), '/lib/libc.so.6+0x10')
+        self.assertIsNone(P.module(0x1000))
+
+        S = P.summary()
+        self.assertEqual(S['signal'], dict(signo=11, name='SIGSEGV', code=1, addr=0, sender=None))
+        self.assertEqual(S['threads'], [dict(lwp=1234, pc=0x401136, sp=0x7ffc00000f00, module='/src/crasher+0x3136')])
+
+    def test_blocks(self):
+        'Notes are found however the core is split'
+        core = make_core()
+        for block in (1, 7, 4096, len(core)):
+            P = self.parse(core[:8192], block=block)
+            self.assertTrue(P.complete, block)
+            self.assertEqual(P.threads[0].pc, 0x401136)
+            self.assertEqual(P.offset, 8192)
+
+    def test_triage(self):
+        lines = []
+        self.assertTrue(self.parse(make_core()).triage(out=lines.append))
+        self.assertEqual(lines[:3], ['# Triage', '  Program: crasher  Args: crasher crash',
+                                     '  Signal: 11 SIGSEGV code 1  fault address 0x0'])
+        self.assertIn('  Thread LWP 1234 (crashed)  pc 0x401136 /src/crasher+0x3136  sp 0x7ffc00000f00', lines)
+
+        lines = []
+        self.assertFalse(self.parse(make_core()[:200]).triage(out=lines.append))
+        self.assertEqual(lines, ['# Triage', '  Truncated core file'])
+
+        self.assertEqual(signame(11), 'SIGSEGV')
+        self.assertEqual(signame(1000), 'signal 1000')
+
+    def test_pagesize(self):
+        # eg. aarch64 or ppc64 with 64K pages
+        P = self.parse(make_core(pagesize=0x10000))
+        self.assertEqual(P.pagesize, 0x10000)
+        self.assertEqual(P.module(0x401136), '/src/crasher+0x21136')
+
+    def test_truncated(self):
+        P = self.parse(make_core()[:200])
+        self.assertFalse(P.complete)
+        self.assertEqual(P.error, 'Truncated core file')
+
+    def test_not_core(self):
+        P = self.parse(b'\x7fELF\x02\x01\x01' + b'\0'*57 + b'\0'*100)
+        self.assertFalse(P.complete)
+        self.assertIn('Not a core file', P.error)
+
+class TestReducedCore(unittest.TestCase):
+    def reduce(self, core):
+        with tempfile.TemporaryFile() as OF:
+            R = ReducedCore(OF)
+            for n in range(0, len(core), 1<<16):
+                R.write(core[n:n+(1<<16)])
+            R.close()
+            OF.seek(0)
+            return R, OF.read()
+
+    def test_stack(self):
+        'Of a large stack segment, only a window around the stack pointer is kept'
+        fill = bytes(bytearray(range(256)))
+        core = make_core(stack=4<<20, fill=fill)
+        R, out = self.reduce(core)
+        self.assertEqual((R.insize, R.outsize), (len(core), len(out)))
+        self.assertLess(len(out), 2<<20)
+
+        P = CoreParser()
+        P.write(out)
+        P.close()
+        self.assertTrue(P.complete)
+        self.assertEqual([(T.pid, T.pc) for T in P.threads], [(1234, 0x401136)])
+        loads = [seg for seg in P.segments if seg.type==PT_LOAD]
+        # memory layout is unchanged
+        self.assertEqual((loads[0].vaddr, sum(seg.memsz for seg in loads)), (0x7ffc00000000, 4<<20))
+        kept = [seg for seg in loads if seg.filesz]
+        self.assertEqual(len(kept), 1)
+        start = kept[0].vaddr - 0x7ffc00000000
+        self.assertLessEqual(start, 0xf00)
+        self.assertGreaterEqual(start+kept[0].filesz, 0xf00 + ReducedCore.STACK_ABOVE)
+        self.assertEqual(out[kept[0].offset:kept[0].offset+kept[0].filesz],
+                         (fill*(4<<12))[start:start+kept[0].filesz])
+
+    def test_small(self):
+        'A small core is kept whole'
+        core = make_core()
+        _R, out = self.reduce(core)
+        P = CoreParser()
+        P.write(out)
+        self.assertEqual([seg.filesz for seg in P.segments if seg.type==PT_LOAD], [128<<10])
+        self.assertEqual(out[-(128<<10):], core[-(128<<10):])
+
+    def test_not_core(self):
+        'Copied unchanged'
+        R, out = self.reduce(b'not a core'*1000)
+        self.assertEqual(out, b'not a core'*1000)
+        self.assertIn('Unable to reduce', str(R))
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+
+from ..mergetree import Node, windows, build
+
+def rank(pid, time, *stacks):
+    return dict(pid=pid, time=time, threads=[dict(lwp=pid+n, frames=[dict(pc=1, function=name) for name in S])
+                                             for n, S in enumerate(stacks)])
+
+class TestTree(unittest.TestCase):
+    def test_render(self):
+        root = Node('all')
+        for pid in (1, 2, 3, 5):
+            root.add(pid, ['MPI_Wait', 'solve', 'main'])
+        root.add(4, ['inner', 'solve', 'main'])
+        out = []
+        root.render(out.append)
+        self.assertEqual(out, [
+            'main > solve  [5 procs 1-5, 5 threads]',
+            '  MPI_Wait  [4 procs 1-3 5, 4 threads]',
+            '  inner  [1 procs 4, 1 threads]',
+        ])
+        D = root.todict()
+        self.assertEqual((D['name'], D['pids'], D['threads']), ('all', [1, 2, 3, 4, 5], 5))
+        self.assertEqual([C['name'] for C in D['children'][0]['children'][0]['children']], ['MPI_Wait', 'inner'])
+
+    def test_windows(self):
+        recs = [rank(1, 100, ['main']), rank(2, 130, ['main']), dict(pid=3, time=140),
+                rank(4, 170, ['main']), rank(5, 120, ['main'])]
+        self.assertEqual([[R['pid'] for R in W] for W in windows(recs, window=60)], [[1, 5, 2], [4]])
+
+    def test_build(self):
+        recs = [rank(10, 0, ['inner', 'solve', 'main'], ['pause', 'start_thread']),
+                rank(20, 1, ['MPI_Wait', 'solve', 'main'], ['pause', 'start_thread']),
+                dict(pid=30, ipid=3, threads=[dict(lwp=30, frames=[dict(error='Cannot access memory')])])]
+        root = build(recs)
+        self.assertEqual(root.threads, 5)
+        self.assertEqual(sorted(root.pids), [3, 10, 20])
+        self.assertEqual([C.name for C in root.sorted_children()], ['main', 'start_thread', '?? no frames'])
+        self.assertEqual(sorted(root.children['start_thread'].children['pause'].pids), [10, 20])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import sys
+import fcntl
+import shutil
+import tempfile
+import unittest
+try:
+    from StringIO import StringIO # py2, str
+except ImportError:
+    from io import StringIO
+
+from ..quota import Quota, parse_size, tiers
+
+class TestParse(unittest.TestCase):
+    def test_size(self):
+        self.assertEqual(parse_size('0'), 0)
+        self.assertEqual(parse_size('100'), 100)
+        self.assertEqual(parse_size('4k'), 4096)
+        self.assertEqual(parse_size('500M'), 500<<20)
+        self.assertEqual(parse_size(' 1.5 GiB '), 3<<29)
+        self.assertEqual(parse_size('2TB'), 2<<40)
+        for bad in ('', 'M', '1X', '-1G', '1 G G'):
+            self.assertRaises(ValueError, parse_size, bad)
+
+    def test_tiers(self):
+        self.assertEqual(tiers(1000, 100, 10, keep=True, defer=True),
+                         [('capture', 10+250+1000, 5), ('stack', 10+100, 4), ('metadata', 10, 2)])
+        self.assertEqual(tiers(1000, 100, 10, core_mode='stack', defer=True)[0], ('capture', 10+100, 4))
+
+class TestQuota(unittest.TestCase):
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.outdir)
+        # three crashes, oldest first
+        for n, cid in enumerate(('1700000000.1', '1700000100.2', '1700000200.3')):
+            for ext in ('.txt', '.json'):
+                path = os.path.join(self.outdir, cid+ext)
+                with open(path, 'w') as F:
+                    F.write('x'*8192)
+                os.utime(path, (1700000000+n, 1700000000+n))
+        os.mkdir(os.path.join(self.outdir, 'store')) # not counted
+
+    def reserve(self, Q, need, protect=()):
+        out, sys.stdout = sys.stdout, StringIO()
+        try:
+            return Q.reserve(need, protect=protect)
+        finally:
+            sys.stdout = out
+
+    def remaining(self):
+        return sorted(name for name in os.listdir(self.outdir) if name.endswith('.txt'))
+
+    def test_crashes(self):
+        C = Quota(self.outdir).crashes()
+        self.assertEqual([(E['id'], E['files']) for E in C], [('1700000000.1', 2), ('1700000100.2', 2),
+                                                             ('1700000200.3', 2)])
+        self.assertTrue(all(E['bytes']>=16384 for E in C))
+
+    def test_lru(self):
+        Q = Quota(self.outdir, max_files=5)
+        self.assertEqual(self.reserve(Q, [('capture', 0, 2)]), ('capture', ['1700000000.1', '1700000100.2']))
+        self.assertEqual(self.remaining(), ['1700000200.3.txt'])
+
+    def test_locked(self):
+        'A crash being captured, or analyzed, is skipped'
+        with open(os.path.join(self.outdir, '1700000000.1.txt'), 'a') as LOG:
+            fcntl.flock(LOG.fileno(), fcntl.LOCK_EX)
+            Q = Quota(self.outdir, max_files=5)
+            self.assertEqual(self.reserve(Q, [('capture', 0, 2)]), ('capture', ['1700000100.2', '1700000200.3']))
+        self.assertEqual(self.remaining(), ['1700000000.1.txt'])
+
+    def test_protect(self):
+        Q = Quota(self.outdir, max_files=3)
+        self.assertEqual(self.reserve(Q, [('capture', 0, 2)], protect=['1700000000.1']),
+                         (None, []))
+        self.assertEqual(len(self.remaining()), 3)
+
+    def test_tiers(self):
+        'Less is captured rather than evicting what would not make enough space'
+        Q = Quota(self.outdir, max_files=4)
+        self.assertEqual(self.reserve(Q, [('capture', 0, 5), ('metadata', 0, 2)]),
+                         ('metadata', ['1700000000.1', '1700000100.2']))
+
+        Q = Quota(self.outdir, max_bytes=1<<30)
+        self.assertEqual(self.reserve(Q, [('capture', 1<<20, 2)]), ('capture', []))
+        self.assertEqual(self.remaining(), ['1700000200.3.txt'])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import unittest
+try:
+    from StringIO import StringIO # py2, str
+except ImportError:
+    from io import StringIO
+
+from ..record import parse_frame, parse_frames, threads
+from ..stacks import StackFilter
+from . import samples
+
+class TestParse(unittest.TestCase):
+    def test_gdb(self):
+        self.assertEqual(parse_frame('#2  0x000055d0c8a2a3aa in main (argc=3, argv=0x7ffd5e3b9a48) at crasher.c:88'),
+                         dict(pc=0x55d0c8a2a3aa, function='main', file='crasher.c', line=88))
+        self.assertEqual(parse_frame('#0  0x00007f3c1a2e5b1e in pause () from /lib/x86_64-linux-gnu/libc.so.6'),
+                         dict(pc=0x7f3c1a2e5b1e, function='pause', module='/lib/x86_64-linux-gnu/libc.so.6'))
+        # GDB omits the address of inlined frames
+        self.assertEqual(parse_frame('#1  outer (n=2) at crasher.c:60'),
+                         dict(pc=None, function='outer', file='crasher.c', line=60, inline=True))
+        self.assertEqual(parse_frame('#3  0x0000000000000000 in ?? ()'), dict(pc=0, function=None))
+        self.assertIsNone(parse_frame('24\t    return *oops;'))
+
+    def test_eustack(self):
+        lines = samples.EUSTACK.splitlines()[2:10]
+        self.assertEqual(parse_frames(lines), [
+            dict(pc=0x55d0c8a2a1ed, function='inner', module='/src/crasher', file='/src/crasher.c', line=24),
+            dict(pc=0x55d0c8a2a2ff, function='outer', module='/src/crasher', file='/src/crasher.c', line=60),
+            dict(pc=0x55d0c8a2a3aa, function='main', module='/src/crasher', file='/src/crasher.c', line=88),
+            dict(pc=0x7f3c1a229d90, function='__libc_start_call_main', module='/lib/x86_64-linux-gnu/libc.so.6'),
+        ])
+        self.assertEqual(parse_frame('#1  0x000055d0c8a2a200'), dict(pc=0x55d0c8a2a200, function=None))
+
+    def test_lldb(self):
+        lines = samples.LLDB.splitlines()[4:8]
+        self.assertEqual(parse_frames(lines), [
+            dict(pc=0x55d0c8a2a1ed, function='inner', module='crasher', file='crasher.c', line=24),
+            dict(pc=0x55d0c8a2a2ff, function='outer', module='crasher', file='crasher.c', line=60),
+            dict(pc=0x55d0c8a2a3aa, function='main', module='crasher', file='crasher.c', line=88),
+            dict(pc=0x7f3c1a229d90, function='__libc_start_call_main', module='libc.so.6'),
+        ])
+
+class TestThreads(unittest.TestCase):
+    summary = dict(threads=[dict(lwp=1234, pc=0x55d0c8a2a1ed, sp=0x7ffd5e3b9900, module='/src/crasher+0x11ed'),
+                            dict(lwp=1235, pc=0x7f3c1a2e5b1e, sp=0x7f3c19ab1e00, module='/lib/libc.so.6+0xe5b1e')])
+
+    def filtered(self, text):
+        F = StackFilter(StringIO(), lwp=1234)
+        for line in text.splitlines():
+            F.line(line)
+        F.close()
+        return F
+
+    def test_text(self):
+        for name in ('GDB', 'EUSTACK', 'LLDB'):
+            T = threads(self.summary, text=self.filtered(getattr(samples, name)))
+            self.assertEqual([(R['lwp'], R['crashed'], [F['function'] for F in R['frames']][:2]) for R in T],
+                             [(1234, True, ['inner', 'outer']), (1235, False, ['pause', 'park'])], name)
+            self.assertEqual(T[0]['module'], '/src/crasher+0x11ed')
+
+    def test_script(self):
+        script = dict(threads=[dict(lwp=1235, name='worker', frames=[dict(pc=1, function='pause')]),
+                               dict(lwp=99, frames=[])]) # not in the core notes
+        T = threads(self.summary, script=script)
+        self.assertEqual([(R['lwp'], R['crashed'], R.get('name'), len(R['frames'])) for R in T],
+                         [(1234, True, None, 0), (1235, False, 'worker', 1), (99, False, None, 0)])
+
+    def test_sysroot(self):
+        script = dict(threads=[dict(lwp=1234, frames=[dict(pc=1, function='main', module='/tmp/root/src/crasher',
+                                                           file='/tmp/root/src/crasher.c', line=88)])])
+        T = threads(self.summary, script=script, sysroot='/tmp/root')
+        self.assertEqual(T[0]['frames'][0]['module'], '/src/crasher')
+        self.assertEqual(T[0]['frames'][0]['file'], '/src/crasher.c')
+
+if __name__=='__main__':
+    unittest.main()
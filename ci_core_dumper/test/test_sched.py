@@ -0,0 +1,95 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+try:
+    from StringIO import StringIO # py2, str
+except ImportError:
+    from io import StringIO
+
+from ..sched import Slots, RateLimit, RATELIMIT, read_ratelimit
+from ..linux import wait_slot
+
+class TestSlots(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def slots(self, prefix='run', count=2):
+        'As opened by another crash handler.  flock() of a different open file conflicts'
+        S = Slots(self.dir, prefix, count)
+        self.addCleanup(S.close)
+        return S
+
+    def test_count(self):
+        A, B = self.slots(), self.slots()
+        self.assertEqual(len(A), 2)
+        self.assertEqual(A.try_acquire(), 0)
+        self.assertEqual(A.try_acquire([0]), 1)
+        self.assertIsNone(B.try_acquire())
+        A.release(0)
+        self.assertEqual(B.try_acquire(), 0)
+        self.assertIsNone(A.try_acquire([1]))
+
+    def wait_slot(self, slots, queue, want=1):
+        out, sys.stdout = sys.stdout, StringIO()
+        try:
+            return wait_slot(slots, queue, want=want)
+        finally:
+            sys.stdout = out
+
+    def test_wait_slot(self):
+        A = self.slots(count=3)
+        self.assertEqual(self.wait_slot(A, None, want=2), 2)
+        self.assertEqual([F.closed for F in A.files], [False, False, True])
+        B = self.slots(count=3)
+        self.assertEqual(self.wait_slot(B, self.slots('wait', 1), want=4), 1)
+
+        # all running, and the queue full
+        C, Q = self.slots(count=3), self.slots('wait', 1)
+        self.assertEqual(Q.try_acquire(), 0)
+        self.assertEqual(self.wait_slot(C, self.slots('wait', 1)), 0)
+
+class TestRateLimit(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def limit(self, **kws):
+        'As opened by each crash handler'
+        F = open(os.path.join(self.dir, RATELIMIT), 'a+')
+        self.addCleanup(F.close)
+        return RateLimit(F, **kws)
+
+    def test_refill(self):
+        take = lambda key, now: self.limit(burst=2, window=10).take(key, now=now)[0]
+        self.assertEqual([take('/bin/a', 100) for n in range(3)], [True, True, False])
+        self.assertTrue(take('/bin/b', 100)) # each key has its own bucket
+        self.assertFalse(take('/bin/a', 104)) # 0.8 tokens
+        self.assertTrue(take('/bin/a', 105))
+        self.assertFalse(take('/bin/a', 105))
+
+        # refilled to at most burst
+        self.assertEqual([take('/bin/a', 1000) for n in range(3)], [True, True, False])
+
+        R = self.limit(burst=2, window=10)
+        E = read_ratelimit(R.F)['/bin/a']
+        self.assertEqual((E['analyzed'], E['skipped'], E['time']), (5, 4, 1000))
+
+    def test_no_refill(self):
+        R = self.limit(burst=1, window=0)
+        self.assertEqual([R.take('/bin/a', now=T)[0] for T in (0, 1e6)], [True, False])
+
+    def test_corrupt(self):
+        R = self.limit(burst=1, window=10)
+        R.F.write('{')
+        R.F.flush()
+        ok, E = R.take('/bin/a', now=0)
+        self.assertTrue(ok)
+        self.assertEqual(E['analyzed'], 1)
+
+if __name__=='__main__':
+    unittest.main()
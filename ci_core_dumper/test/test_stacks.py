@@ -0,0 +1,115 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import sys
+import unittest
+try:
+    from StringIO import StringIO # py2, str
+except ImportError:
+    from io import StringIO
+
+from ..stacks import StackFilter, frame_key, ranges, thread_ranges, run_sharded
+from ..record import parse_frames
+from . import samples
+
+def run(text, **kws):
+    out = StringIO()
+    F = StackFilter(out, **kws)
+    for line in text.splitlines():
+        F.line(line)
+    F.close()
+    return F, out.getvalue()
+
+def functions(lines):
+    return [F['function'] for F in parse_frames(lines)]
+
+class TestStackFilter(unittest.TestCase):
+    def test_gdb(self):
+        F, out = run(samples.GDB, lwp=1234)
+        # not the frame printed when the core is loaded
+        self.assertEqual(functions(F.top), ['inner', 'outer', 'main'])
+        self.assertEqual([(lwp, functions(lines)) for lwp, lines in F.threads],
+                         [(1235, ['pause', 'park', 'start_thread', 'clone3']),
+                          (1234, ['inner', 'outer', 'main'])])
+        self.assertIn('  (faulting thread, shown above)\n', out)
+        self.assertEqual(F.cuts, [])
+
+    def test_gdb_old(self):
+        'Without bt, the faulting thread is only found by its header'
+        F, _out = run(samples.GDB_OLD_LOG)
+        self.assertEqual(F.top, [])
+        self.assertEqual([lwp for lwp, _lines in F.threads], [1235, 1234])
+
+    def test_eustack(self):
+        F, _out = run(samples.EUSTACK, lwp=1234)
+        self.assertEqual(F.top, [])
+        self.assertEqual([(lwp, functions(lines)) for lwp, lines in F.threads],
+                         [(1234, ['inner', 'outer', 'main', '__libc_start_call_main']),
+                          (1235, ['pause', 'park', 'start_thread'])])
+        self.assertEqual(F.cuts, []) # source lines are not frames
+
+    def test_lldb(self):
+        F, out = run(samples.LLDB, lwp=1234)
+        self.assertEqual([(lwp, functions(lines)) for lwp, lines in F.threads],
+                         [(1234, ['inner', 'outer', 'main', '__libc_start_call_main']),
+                          (1235, ['pause', 'park'])])
+        self.assertEqual(F.nthreads, 2)
+        self.assertIn('  (shown above)\n', out)
+
+    def test_collapse(self):
+        text = ''.join('Thread %d (Thread 0x7f%02x (LWP %d)):\n'
+                       '#0  0x00007f3c1a2e5b1e in pause () from /lib/libc.so.6\n'
+                       '#1  0x000055d0c8a2a200 in park (raw=0x%x) at crasher.c:40\n'%(n, n, 100+n, n)
+                       for n in range(2, 7))
+        F, out = run(text)
+        self.assertEqual(F.nthreads, 5)
+        self.assertEqual(out.count('in park'), 1)
+        self.assertIn('  4 more threads as Thread 2 (Thread 0x7f02 (LWP 102)):\n    LWP 103-106\n', out)
+
+    def test_limits(self):
+        text = 'Thread 2 (Thread 0x7f3c19ab2640 (LWP 1235)):\n'+''.join(
+            '#%d  0x000055d0c8a2a200 in park (raw=0x0) at crasher.c:40\n'%n for n in range(4))
+        F, _out = run(text+'(More stack frames follow...)\n', depth=4)
+        self.assertEqual(F.cuts, ['1 of 1 threads: frames beyond 4 cut'])
+
+        F, out = run(text, max_output=100)
+        self.assertTrue(F.cuts[0].startswith('Output limit of 100 bytes reached'))
+        self.assertNotIn('#3', out)
+
+def shard(*lwps):
+    'Command printing a preamble, as GDB loading a core, then a thread for each LWP'
+    text = 'Core was generated by `./crasher threads 300\'.\n' + ''.join(
+        'Thread %d (Thread 0x7f%02x (LWP %d)):\n#0  0x000055d0c8a2a200 in park%d (raw=0x0) at crasher.c:40\n'%(L, L, L, L)
+        for L in lwps)
+    return [sys.executable, '-c', 'import sys; sys.stdout.write(%r)'%text]
+
+class TestSharded(unittest.TestCase):
+    def test_order(self):
+        out = StringIO()
+        F = run_sharded([shard(1, 2), shard(3), shard(4, 5)], out)
+        self.assertEqual(F.code, 0)
+        self.assertEqual([lwp for lwp, _lines in F.threads], [1, 2, 3, 4, 5])
+        self.assertEqual(out.getvalue().count('Core was generated'), 1)
+
+    def test_limit(self):
+        out = StringIO()
+        F = run_sharded([shard(*range(1, 200)), shard(*range(200, 400))], out, max_output=1000)
+        self.assertIsNone(F.code)
+        self.assertTrue(F.cuts[0].startswith('Output limit of 1000 bytes reached'))
+        self.assertLess(len(out.getvalue()), 1200)
+
+class TestUtil(unittest.TestCase):
+    def test_frame_key(self):
+        self.assertEqual(frame_key('#1  0x000055d0c8a2a200 in park (raw=0x0) at crasher.c:40'),
+                         'in park () at crasher.c:40')
+
+    def test_ranges(self):
+        self.assertEqual(ranges([5, 1, 2, 3, None, 7, 8]), '1-3 5 7-8')
+        self.assertEqual(ranges(range(0, 10, 2), limit=2), '0 2 ...')
+
+    def test_thread_ranges(self):
+        self.assertEqual(thread_ranges(10, 4), [(1, 10)]) # too few to split
+        self.assertEqual(thread_ranges(200, 4), [(1, 66), (67, 133), (134, 200)])
+        self.assertEqual(thread_ranges(1000, 2), [(1, 500), (501, 1000)])
+
+if __name__=='__main__':
+    unittest.main()
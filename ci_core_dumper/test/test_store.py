@@ -0,0 +1,112 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import sys
+import errno
+import shutil
+import struct
+import hashlib
+import tempfile
+import unittest
+try:
+    from StringIO import StringIO # py2, str
+except ImportError:
+    from io import StringIO
+
+from .. import store
+from ..elfcore import PT_NOTE, NT_GNU_BUILD_ID
+
+BID = 'ab' + '0123456789abcdef'*2 + '012345'
+
+def make_elf(bid=BID):
+    'A tiny x86_64 shared library with only a GNU build-id note'
+    desc = bytearray.fromhex(bid)
+    note = struct.pack('<III', 4, len(desc), NT_GNU_BUILD_ID) + b'GNU\0' + bytes(desc)
+    ehdr = b'\x7fELF\x02\x01\x01' + b'\0'*9 + struct.pack('<HHIQQQIHHHHHH', 3, 62, 1, 0, 64, 0, 0,
+                                                              64, 56, 1, 0, 0, 0)
+    phdr = struct.pack('<IIQQQQQQ', PT_NOTE, 0, 64+56, 0, 0, len(note), 0, 0)
+    return ehdr + phdr + note
+
+@unittest.skipUnless(os.open in getattr(os, 'supports_dir_fd', ()), 'needs dir_fd')
+class TestStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.store = os.path.join(self.dir, store.STORE)
+        os.mkdir(self.store)
+        self.D = os.open(self.store, os.O_RDONLY)
+        self.addCleanup(os.close, self.D)
+        self.owner = os.fstat(self.D)
+
+        self.lib = self.write('lib/libfoo.so.1', make_elf())
+        self.script = self.write('bin/script', b'#!/bin/sh\n')
+
+        # separate debug info, as installed in the target
+        orig, store.DEBUG_DIR = store.DEBUG_DIR, os.path.join(self.dir, 'debug')
+        self.addCleanup(setattr, store, 'DEBUG_DIR', orig)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as F:
+            F.write(data)
+        return path
+
+    def add(self, path):
+        out, sys.stdout = sys.stdout, StringIO()
+        try:
+            return store.add(path, self.D, self.owner), sys.stdout.getvalue()
+        finally:
+            sys.stdout = out
+
+    def test_key(self):
+        self.assertEqual(store.file_key(self.lib), ('.build-id/ab/'+BID[2:], BID))
+        digest = hashlib.sha1(b'#!/bin/sh\n').hexdigest()
+        self.assertEqual(store.file_key(self.script), ('.sha1/%s/%s'%(digest[:2], digest[2:]), None))
+
+    def test_add(self):
+        self.write('debug/.build-id/ab/%s.debug'%BID[2:], b'debug info')
+        M, out = self.add(self.lib)
+        self.assertEqual(M, dict(path=self.lib, build_id=BID, key='.build-id/ab/'+BID[2:]))
+        self.assertEqual(out.count('Store Link'), 2)
+        with open(os.path.join(self.store, M['key']+'.debug'), 'rb') as F:
+            self.assertEqual(F.read(), b'debug info')
+
+        # stored once
+        M2, out = self.add(self.lib)
+        self.assertEqual((M2, out), (M, ''))
+
+    def test_copy(self):
+        'When a hard link is not possible, eg. across filesystems'
+        def link(*args, **kws):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        orig, os.link = os.link, link
+        self.addCleanup(setattr, os, 'link', orig)
+
+        M, out = self.add(self.script)
+        self.assertIn('Store Copy', out)
+        with open(os.path.join(self.store, M['key']), 'rb') as F:
+            self.assertEqual(F.read(), b'#!/bin/sh\n')
+        self.assertEqual(os.listdir(os.path.join(self.store, os.path.dirname(M['key']))),
+                         [os.path.basename(M['key'])]) # no temporary left
+
+    def test_sysroot(self):
+        M, _out = self.add(self.lib)
+        gone = dict(path='/lib/libgone.so', build_id=None, key='.sha1/00/00')
+        root = os.path.join(self.dir, 'sysroot')
+        self.assertEqual(store.sysroot(self.store, [M, gone], root), [gone])
+        link = root+self.lib
+        self.assertEqual(os.readlink(link), os.path.join(self.store, M['key']))
+        self.assertFalse(os.path.lexists(root+gone['path']))
+        # again, eg. reanalyze twice
+        self.assertEqual(store.sysroot(self.store, [M], root), [])
+
+    def test_mapped(self):
+        paths = store.mapped_files(os.getpid(), sys.executable)
+        self.assertEqual(paths[0], sys.executable)
+        self.assertEqual(len(paths), len(set(paths)))
+        self.assertTrue(all(os.path.isfile(P) for P in paths))
+
+if __name__=='__main__':
+    unittest.main()
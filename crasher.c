@@ -8,6 +8,11 @@
 #include <stdio.h>
 #include <string.h>
 
+#ifndef _WIN32
+#  include <pthread.h>
+#  include <unistd.h>
+#endif
+
 volatile int* volatile oops;
 
 void doAbort()
@@ -20,6 +25,53 @@ int doCrash()
     return *oops;
 }
 
+#ifndef _WIN32
+/* start gate.  No pthread_barrier_t on OSX */
+static pthread_mutex_t lock = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t wakeup = PTHREAD_COND_INITIALIZER;
+static unsigned nstarted;
+/* never set.  Lets park() return as far as the compiler knows */
+static volatile int stop;
+
+/* recurse a little, so that threads have different stacks */
+static void* park(void* raw)
+{
+    volatile size_t depth = (size_t)raw;
+    if(depth>0) {
+        park((void*)(depth-1));
+    } else {
+        pthread_mutex_lock(&lock);
+        nstarted++;
+        pthread_cond_signal(&wakeup);
+        pthread_mutex_unlock(&lock);
+        while(!stop)
+            pause();
+    }
+    return raw;
+}
+
+/* crash with many threads running */
+int doThreads(unsigned n)
+{
+    unsigned i;
+    pthread_attr_t attr;
+    pthread_attr_init(&attr);
+    pthread_attr_setstacksize(&attr, 64*1024);
+    for(i=0; i<n; i++) {
+        pthread_t tid;
+        if(pthread_create(&tid, &attr, &park, (void*)(size_t)(i%8))) {
+            fprintf(stderr, "Unable to start thread %u\n", i);
+            return 4;
+        }
+    }
+    pthread_mutex_lock(&lock);
+    while(nstarted<n)
+        pthread_cond_wait(&wakeup, &lock);
+    pthread_mutex_unlock(&lock);
+    return doCrash();
+}
+#endif
+
 int main(int argc, char *argv[])
 {
 #ifdef _WIN32
@@ -33,13 +85,17 @@ int main(int argc, char *argv[])
 #endif
 
     if(argc<2) {
-        printf("%s [abort|crash]\n", argv[0]);
+        printf("%s [abort|crash|threads [N]]\n", argv[0]);
         return 2;
     } else if(strcmp(argv[1], "abort")==0) {
         doAbort();
         return 0; // not going to happen
     } else if(strcmp(argv[1], "crash")==0) {
         return doCrash();
+#ifndef _WIN32
+    } else if(strcmp(argv[1], "threads")==0) {
+        return doThreads(argc>2 ? (unsigned)atoi(argv[2]) : 1000);
+#endif
     } else {
         return 3;
     }